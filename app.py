@@ -1,28 +1,462 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import time
+_module_import_started = time.perf_counter()
+
+from fastapi import FastAPI, File, Form, Query, UploadFile, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import os
+import re
+import sys
+import io
+import base64
+import hashlib
+import hmac
+import shutil
+import asyncio
+import subprocess
 import requests
 from pathlib import Path
-import assemblyai as aai
-import google.generativeai as genai
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
 
 import logging
-import time
-from typing import Optional
+import logging.handlers
+import uuid
+import queue
+import random
+import atexit
+import math
+import bisect
+import functools
+import threading
+import contextvars
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from typing import List, Optional
 import json
+import zipfile
+import zlib
+import tempfile
+import sqlite3
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_REDACT_PAYLOADS = os.getenv("LOG_REDACT_PAYLOADS", "false").lower() in ("1", "true", "yes")
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "100"))
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+session_id_var = contextvars.ContextVar("session_id", default=None)
+
+SAMPLED = {"sampled": True}
+
+class LogPayload:
+    """Wraps user/model text so truncation or redaction happens only when a record is written"""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        text = "" if self.value is None else str(self.value)
+        if LOG_REDACT_PAYLOADS:
+            return f"<redacted {len(text)} chars>"
+        if len(text) > LOG_PAYLOAD_MAX_CHARS:
+            return f"{text[:LOG_PAYLOAD_MAX_CHARS]}... ({len(text)} chars)"
+        return text
+
+def payload(value) -> LogPayload:
+    return LogPayload(value)
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the request/session ids and samples high-volume info lines"""
+
+    def filter(self, record):
+        if getattr(record, "sampled", False) and record.levelno <= logging.INFO and random.random() >= LOG_SAMPLE_RATE:
+            return False
+        record.request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        return True
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves message formatting to the background listener thread"""
+
+    def prepare(self, record):
+        return record
 
-logging.basicConfig(level=logging.INFO)
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        if getattr(record, "session_id", None):
+            entry["session_id"] = record.session_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def configure_logging() -> logging.handlers.QueueListener:
+    """Route all logging through a queue drained by a background writer thread"""
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:[%(request_id)s] %(message)s"))
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    
+    root_logger = logging.getLogger()
+    root_logger.handlers = [queue_handler]
+    root_logger.setLevel(LOG_LEVEL)
+    
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
 
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "voice-agent")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ALLOW_HEADER = os.getenv("PROFILE_ALLOW_HEADER", "false").lower() in ("1", "true", "yes")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", "2"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.1"))
+EVENT_LOOP_LAG_WARN_MS = float(os.getenv("EVENT_LOOP_LAG_WARN_MS", "100"))
 
-load_dotenv()
+current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """A finished-or-running unit of work, serialized in the OTLP/JSON span shape"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: int, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        otlp_span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [otlp_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+        if self.parent_id:
+            otlp_span["parentSpanId"] = self.parent_id
+        return otlp_span
+
+def otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+class SpanExporter:
+    """Batches finished spans on a background thread and writes them as OTLP/JSON
+
+    Each batch becomes one line of TRACE_EXPORT_FILE (the collector file-exporter format)
+    and/or one POST to <OTEL_EXPORTER_OTLP_ENDPOINT>/v1/traces.
+    """
+
+    def __init__(self, file_path: Optional[str], endpoint: Optional[str], max_batch: int = 256):
+        self.file_path = file_path
+        self.endpoint = endpoint.rstrip("/") + "/v1/traces" if endpoint else None
+        self.max_batch = max_batch
+        self.queue = queue.SimpleQueue()
+        threading.Thread(target=self.export_loop, name="span-exporter", daemon=True).start()
+
+    def export(self, span: Span):
+        self.queue.put(span)
+
+    def export_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get())
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.error("Failed to export %d spans: %s", len(batch), e)
+
+    def write(self, batch: list):
+        document = {
+            "resourceSpans": [{
+                "resource": {"attributes": [otlp_attribute("service.name", OTEL_SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": OTEL_SERVICE_NAME}, "spans": [span.to_otlp() for span in batch]}]
+            }]
+        }
+        if self.file_path:
+            with open(self.file_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(document, separators=(",", ":")) + "\n")
+        if self.endpoint:
+            requests.post(self.endpoint, json=document, timeout=5).raise_for_status()
+
+span_exporter = SpanExporter(TRACE_EXPORT_FILE, OTEL_EXPORTER_OTLP_ENDPOINT) if TRACE_EXPORT_FILE or OTEL_EXPORTER_OTLP_ENDPOINT else None
+
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+
+def start_span(name: str, kind: int = SPAN_KIND_INTERNAL, trace_parent: Optional[tuple] = None, **attributes) -> Optional[Span]:
+    """Create a child of the current span without entering it (None unless a span exporter is configured)"""
+    if span_exporter is None:
+        return None
+    parent = current_span.get()
+    if trace_parent:
+        trace_id, parent_id = trace_parent
+    elif parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+    return Span(name, trace_id, parent_id, kind, attributes)
+
+def end_span(current: Span):
+    current.end_ns = time.time_ns()
+    span_exporter.export(current)
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, trace_parent: Optional[tuple] = None, **attributes):
+    """Open a child of the current span (no-op unless a span exporter is configured)"""
+    current = start_span(name, kind, trace_parent, **attributes)
+    if current is None:
+        yield None
+        return
+    token = current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = str(e) or type(e).__name__
+        raise
+    finally:
+        current_span.reset(token)
+        end_span(current)
+
+def traced(name: str, kind: int = SPAN_KIND_INTERNAL):
+    """Decorator wrapping an async helper in a span; dict results report their "success" flag"""
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name, kind) as current:
+                result = await func(*args, **kwargs)
+                if current is not None and isinstance(result, dict) and "success" in result:
+                    current.set("success", bool(result["success"]))
+                return result
+        return wrapper
+    return decorate
+
+def parse_traceparent(header: Optional[str]) -> Optional[tuple]:
+    """(trace_id, parent_span_id) from a W3C traceparent header"""
+    match = re.fullmatch(r"[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}", (header or "").strip())
+    return match.groups() if match else None
+
+# Request id each event-loop task and each busy worker thread is running for, so a
+# per-request profile can leave out concurrent requests
+task_requests = weakref.WeakKeyDictionary()
+worker_requests = {}
+
+def attributed_task_factory(loop, coro, **kwargs):
+    task = asyncio.Task(coro, loop=loop, **kwargs)
+    context = kwargs.get("context")
+    task_requests[task] = context.get(request_id_var) if context is not None else request_id_var.get()
+    return task
+
+class AttributedExecutor(ThreadPoolExecutor):
+    """Default executor that records which request each worker thread is running for"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(self.run_for, request_id_var.get(), fn, *args, **kwargs)
+
+    @staticmethod
+    def run_for(request_id, fn, *args, **kwargs):
+        thread_id = threading.get_ident()
+        worker_requests[thread_id] = request_id
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            worker_requests.pop(thread_id, None)
+
+def install_request_attribution(loop: asyncio.AbstractEventLoop):
+    loop.set_task_factory(attributed_task_factory)
+    loop.set_default_executor(AttributedExecutor(thread_name_prefix="asyncio"))
+
+class SamplingProfiler:
+    """Samples the event-loop thread and asyncio worker threads while one request runs
+
+    Only samples attributed to the request are kept: the loop thread while one of its tasks
+    is running, and worker threads while they run a call it submitted. Stacks are aggregated
+    in collapsed ("folded") form, ready for flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, interval_ms: float, request_id: str):
+        self.interval = interval_ms / 1000
+        self.request_id = request_id
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.stacks = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample_loop, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def attributed(self, thread_id: int) -> bool:
+        if thread_id == self.loop_thread_id:
+            task = asyncio.current_task(self.loop)
+            return task is not None and task_requests.get(task) == self.request_id
+        return worker_requests.get(thread_id) == self.request_id
+
+    def sample_loop(self):
+        while not self.stopped.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if not self.attributed(thread_id):
+                    continue
+                thread_name = thread_names.get(thread_id, "")
+                stack = []
+                while frame is not None and len(stack) < 64:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                key = ";".join(["event-loop" if thread_id == self.loop_thread_id else thread_name] + stack[::-1])
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def write(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+
+# Profilers currently sampling; each one is a thread walking every thread's stack
+active_profilers = set()
+
+def profiling_requested(request: Request) -> bool:
+    if len(active_profilers) >= PROFILE_MAX_ACTIVE:
+        return False
+    header = request.headers.get("x-profile", "")
+    if PROFILE_ALLOW_HEADER and header:
+        # With PROFILE_TOKEN set the header must carry it; otherwise any client could load the server
+        if PROFILE_TOKEN:
+            if hmac.compare_digest(header.encode(), PROFILE_TOKEN.encode()):
+                return True
+        elif header.lower() in ("1", "true", "yes"):
+            return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def prune_profiles(directory: Path, keep: int):
+    """Delete the oldest profiles beyond the newest `keep`"""
+    profiles = sorted(directory.glob("*.folded"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for stale in profiles[keep:]:
+        stale.unlink(missing_ok=True)
 
-app = FastAPI()
+class EventLoopLagMonitor:
+    """Measures how late the event loop wakes up a periodic sleeper (time spent blocked)"""
+
+    def __init__(self, interval: float, window: int = 600):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            woke = time.perf_counter()
+            lag_ms = max(0.0, (woke - started - self.interval) * 1000)
+            self.samples.append((woke, lag_ms))
+            if lag_ms > EVENT_LOOP_LAG_WARN_MS:
+                logger.warning("Event loop blocked for %.1f ms", lag_ms)
+
+    def max_lag_since(self, since: float) -> float:
+        # A block that starts inside the window is only observed when the loop wakes up after it
+        return round(max((lag for woke, lag in self.samples if woke >= since), default=0.0), 1)
+
+    def snapshot(self) -> dict:
+        lags = sorted(lag for _, lag in self.samples)
+        if not lags:
+            return {"samples": 0}
+        return {
+            "samples": len(lags),
+            "p50_lag_ms": round(lags[len(lags) // 2], 1),
+            "p99_lag_ms": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))], 1),
+            "max_lag_ms": round(lags[-1], 1)
+        }
+
+event_loop_monitor = EventLoopLagMonitor(EVENT_LOOP_LAG_INTERVAL)
+
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "750"))
+
+readiness = {
+    "services": False,
+    "audio_index": False,
+    "prewarmed_audio": False
+}
+startup_metrics = {}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize providers in parallel and pre-warm fallback audio without blocking startup"""
+    startup_started = time.perf_counter()
+    install_request_attribution(asyncio.get_running_loop())
+    await asyncio.gather(initialize_services(), asyncio.to_thread(index_audio_directories),
+                         asyncio.to_thread(restore_chat_sessions) if chat_log else asyncio.sleep(0))
+    startup_metrics["services_init_ms"] = round((time.perf_counter() - startup_started) * 1000, 1)
+    logger.info("✅ Services initialized in %.1f ms", startup_metrics["services_init_ms"])
+    
+    prewarm_task = asyncio.create_task(prewarm_fallback_audio())
+    probe_task = asyncio.create_task(health_probe_loop()) if HEALTH_PROBE_INTERVAL > 0 else None
+    lag_task = asyncio.create_task(event_loop_monitor.run()) if EVENT_LOOP_LAG_INTERVAL > 0 else None
+    await asyncio.to_thread(usage_meter.open)
+    usage_task = asyncio.create_task(usage_meter.run())
+    try:
+        yield
+    finally:
+        prewarm_task.cancel()
+        usage_task.cancel()
+        await asyncio.gather(usage_task, return_exceptions=True)
+        if lag_task:
+            lag_task.cancel()
+        if probe_task:
+            probe_task.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 uploads_dir = Path("uploads")
 fallback_audio_dir = Path("fallback_audio")
@@ -41,206 +475,1484 @@ except Exception as e:
     logger.error(f"❌ Error creating fallback audio directory: {e}")
     fallback_audio_dir = Path(".")
 
-def initialize_services():
-    """Initialize all API services with proper error handling"""
-    services_status = {
-        "assemblyai": False,
-        "gemini": False,
-        "murf": False
+tts_cache_dir = Path("tts_cache")
+
+try:
+    tts_cache_dir.mkdir(exist_ok=True)
+    logger.info(f"✅ TTS cache directory ready: {tts_cache_dir.absolute()}")
+except Exception as e:
+    logger.error(f"❌ Error creating TTS cache directory: {e}")
+    tts_cache_dir = Path(".")
+
+# Only TTS cache variants: a fallback clip's name hashes its text, not its bytes, so the
+# clip behind a name can change (e.g. when post-processing failed) and must be revalidated
+HASHED_AUDIO_FILENAME = re.compile(r"^[a-z]+_[0-9a-f]{8,32}\.(mp3|wav|ogg|webm)$")
+AUDIO_MEDIA_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".ogg": "audio/ogg",
+    ".webm": "audio/webm"
+}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+class AudioManifest:
+    """In-memory index of an audio directory, kept up to date as files are written
+
+    Only files present at startup or written through store() are served; store() writes to
+    a temporary file and renames it into place (in a worker thread), so a half-written clip
+    is never indexed. A file changed on disk by anything else is dropped from the index.
+    With max_bytes set, the least recently used files are deleted once the directory
+    grows past it (entries are kept in LRU order).
+    """
+
+    def __init__(self, directory: Path, pattern: str = "*.mp3", max_bytes: Optional[int] = None):
+        self.directory = directory
+        self.pattern = pattern
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = {}
+        self._listing = None
+
+    def scan(self):
+        """Index every matching file in the directory (done once at startup)"""
+        self.entries = {}
+        self.total_bytes = 0
+        self._listing = None
+        if self.directory.exists():
+            for temp_path in self.directory.glob(".*.tmp"):
+                temp_path.unlink(missing_ok=True)
+            for file_path in sorted(self.directory.glob(self.pattern), key=lambda path: path.stat().st_mtime):
+                self.add(file_path)
+        logger.info(f"✅ Indexed {len(self.entries)} audio files in {self.directory}")
+
+    def add(self, file_path: Path) -> dict:
+        """Add or refresh a single file (blocking: hashes it)"""
+        return self.insert(self.describe(file_path))
+
+    @staticmethod
+    def describe(file_path: Path) -> dict:
+        """Manifest entry of a file, hashing its content for the ETag"""
+        file_stats = file_path.stat()
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                digest.update(chunk)
+        return {
+            "filename": file_path.name,
+            "path": file_path,
+            "stat": file_stats,
+            "size": file_stats.st_size,
+            "created": datetime.fromtimestamp(file_stats.st_ctime).isoformat(),
+            "etag": f'"{digest.hexdigest()[:32]}"'
+        }
+
+    def insert(self, entry: dict) -> dict:
+        self.discard(entry["filename"])
+        self.entries[entry["filename"]] = entry
+        self._listing = None
+        self.total_bytes += entry["size"]
+        self.evict(keep=entry["filename"])
+        return entry
+
+    def write(self, filename: str, data: bytes) -> dict:
+        """Write a file atomically and describe it (blocking)"""
+        file_path = self.directory / filename
+        temp_path = self.directory / f".{filename}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            temp_path.write_bytes(data)
+            os.replace(temp_path, file_path)
+        finally:
+            temp_path.unlink(missing_ok=True)
+        return self.describe(file_path)
+
+    async def store(self, filename: str, data: bytes) -> dict:
+        """Write and hash a file in a worker thread, then index it"""
+        return self.insert(await asyncio.to_thread(self.write, filename, data))
+
+    def discard(self, filename: str):
+        entry = self.entries.pop(filename, None)
+        if entry is not None:
+            self.total_bytes -= entry["size"]
+            self._listing = None
+
+    def evict(self, keep: Optional[str] = None):
+        if self.max_bytes is None:
+            return
+        for filename in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if filename == keep:
+                continue
+            entry = self.entries[filename]
+            self.discard(filename)
+            entry["path"].unlink(missing_ok=True)
+            logger.info("Evicted %s from %s (cache over %d MB)", filename, self.directory, self.max_bytes // (1024 * 1024))
+
+    def get(self, filename: str) -> Optional[dict]:
+        """Look up an indexed file, dropping it if it vanished or was changed on disk since it was indexed"""
+        entry = self.entries.get(filename)
+        if entry is None:
+            return None
+        try:
+            file_stats = entry["path"].stat()
+        except FileNotFoundError:
+            self.discard(filename)
+            return None
+        if (file_stats.st_size, file_stats.st_mtime_ns) != (entry["stat"].st_size, entry["stat"].st_mtime_ns):
+            logger.warning("%s changed on disk outside the manifest, no longer serving it", entry["path"])
+            self.discard(filename)
+            return None
+        if self.max_bytes is not None:
+            self.entries[filename] = self.entries.pop(filename)
+        return entry
+
+    def listing(self) -> list:
+        """Serializable view of the manifest, rebuilt only after a change"""
+        if self._listing is None:
+            self._listing = [
+                {
+                    "filename": entry["filename"],
+                    "size": entry["size"],
+                    "created": entry["created"],
+                    "etag": entry["etag"].strip('"'),
+                    "download_url": f"http://localhost:8000/download-fallback-audio/{entry['filename']}",
+                    "play_url": f"http://localhost:8000/fallback-audio/{entry['filename']}"
+                }
+                for entry in sorted(self.entries.values(), key=lambda e: e["filename"])
+            ]
+        return self._listing
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+def cached_audio_response(request: Request, manifest: AudioManifest, filename: str, download: bool = False) -> Response:
+    """Serve an indexed audio file with content-hash ETag, cache headers and range support"""
+    entry = manifest.get(filename)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    
+    headers = {
+        "ETag": entry["etag"],
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if HASHED_AUDIO_FILENAME.match(filename) else REVALIDATE_CACHE_CONTROL
+    }
+    
+    if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    
+    return FileResponse(
+        path=str(entry["path"]),
+        media_type=AUDIO_MEDIA_TYPES.get(entry["path"].suffix, "application/octet-stream"),
+        filename=filename if download else None,
+        headers=headers,
+        stat_result=entry["stat"]
+    )
+
+fallback_manifest = AudioManifest(fallback_audio_dir)
+tts_manifest = AudioManifest(tts_cache_dir, pattern="tts_*", max_bytes=int(os.getenv("TTS_CACHE_MAX_MB", "200")) * 1024 * 1024)
+
+def index_audio_directories():
+    fallback_manifest.scan()
+    tts_manifest.scan()
+    readiness["audio_index"] = True
+
+AUDIO_FORMATS = {
+    "mp3": {"provider_format": "MP3", "media_type": "audio/mpeg", "codec": "libmp3lame", "muxer": "mp3"},
+    "wav": {"provider_format": "WAV", "media_type": "audio/wav", "codec": "pcm_s16le", "muxer": "wav"},
+    "ogg": {"provider_format": None, "media_type": "audio/ogg", "codec": "libopus", "muxer": "ogg"},
+    "webm": {"provider_format": None, "media_type": "audio/webm", "codec": "libopus", "muxer": "webm"}
+}
+AUDIO_FORMAT_ALIASES = {
+    "mpeg": "mp3",
+    "mp3": "mp3",
+    "wav": "wav",
+    "wave": "wav",
+    "x-wav": "wav",
+    "ogg": "ogg",
+    "opus": "ogg",
+    "webm": "webm"
+}
+MURF_SAMPLE_RATES = (8000, 24000, 44100, 48000)
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+DEFAULT_OPUS_BITRATE = os.getenv("TTS_OPUS_BITRATE", "24k")
+BITRATE_PATTERN = re.compile(r"^\d{1,3}k$")
+FFMPEG_PATH = os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg")
+
+def parse_audio_format(value: Optional[str]) -> Optional[str]:
+    """Map a format name or audio MIME type to one of AUDIO_FORMATS"""
+    if not value:
+        return None
+    value = value.split(";")[0].strip().lower()
+    if value.startswith("audio/"):
+        value = value[len("audio/"):]
+    return AUDIO_FORMAT_ALIASES.get(value)
+
+def negotiate_audio_format(requested: Optional[str] = None, accept: Optional[str] = None,
+                           sample_rate: Optional[int] = None, bitrate: Optional[str] = None) -> dict:
+    """Pick the output audio variant from an explicit request field or the Accept header"""
+    audio_format = parse_audio_format(requested)
+    
+    if requested and not audio_format:
+        raise HTTPException(status_code=400, detail=f"Unsupported audio format: {requested}")
+    
+    if not audio_format and accept:
+        candidates = []
+        for position, item in enumerate(accept.split(",")):
+            params = [part.strip() for part in item.split(";")]
+            media_range = params[0].lower()
+            if not media_range.startswith("audio/"):
+                continue
+            quality = 1.0
+            for param in params[1:]:
+                if param.startswith("q="):
+                    try:
+                        quality = float(param[2:])
+                    except ValueError:
+                        quality = 0.0
+            candidate = "mp3" if media_range == "audio/*" else parse_audio_format(media_range)
+            if candidate and quality > 0:
+                candidates.append((-quality, position, candidate))
+        if candidates:
+            audio_format = min(candidates)[2]
+    
+    audio_format = audio_format or "mp3"
+    
+    if bitrate and not BITRATE_PATTERN.match(bitrate):
+        raise HTTPException(status_code=400, detail=f"Invalid bitrate: {bitrate} (expected e.g. '32k')")
+    
+    if AUDIO_FORMATS[audio_format]["codec"] == "libopus":
+        bitrate = bitrate or DEFAULT_OPUS_BITRATE
+        if sample_rate:
+            sample_rate = min(OPUS_SAMPLE_RATES, key=lambda rate: abs(rate - sample_rate))
+    elif audio_format == "wav":
+        bitrate = None
+    
+    return {
+        "format": audio_format,
+        "sample_rate": sample_rate,
+        "bitrate": bitrate
     }
+
+def needs_transcoding(variant: dict) -> bool:
+    """Whether Murf can deliver this variant directly"""
+    if AUDIO_FORMATS[variant["format"]]["provider_format"] is None:
+        return True
+    if variant["bitrate"]:
+        return True
+    return bool(variant["sample_rate"]) and variant["sample_rate"] not in MURF_SAMPLE_RATES
+
+TTS_POSTPROCESS = os.getenv("TTS_POSTPROCESS", "true").lower() in ("1", "true", "yes")
+# Processing a reply that would otherwise be sent straight from Murf costs more latency than the
+# trimmed silence saves, so by default only fallback clips and already transcoded variants get it
+TTS_POSTPROCESS_LIVE = os.getenv("TTS_POSTPROCESS_LIVE", "false").lower() in ("1", "true", "yes")
+TTS_SILENCE_THRESHOLD_DB = float(os.getenv("TTS_SILENCE_THRESHOLD_DB", "-45"))
+TTS_SILENCE_PAD_MS = float(os.getenv("TTS_SILENCE_PAD_MS", "30"))
+TTS_TARGET_LOUDNESS_DB = float(os.getenv("TTS_TARGET_LOUDNESS_DB", "-18"))
+TTS_PEAK_LIMIT_DB = float(os.getenv("TTS_PEAK_LIMIT_DB", "-1"))
+POSTPROCESS_SAMPLE_RATE = 24000
+# Part of the TTS cache key, so changing the processing settings re-renders instead of serving old variants
+TTS_POSTPROCESS_TAG = f"post:{TTS_SILENCE_THRESHOLD_DB}:{TTS_SILENCE_PAD_MS}:{TTS_TARGET_LOUDNESS_DB}:{TTS_PEAK_LIMIT_DB}" if TTS_POSTPROCESS else "raw"
+
+def tts_cache_filename(text: str, voice_id: str, variant: dict) -> str:
+    key = f"{voice_id}|{variant['format']}|{variant['sample_rate']}|{variant['bitrate']}|{TTS_POSTPROCESS_TAG}|{text}"
+    return f"tts_{hashlib.sha256(key.encode()).hexdigest()[:16]}.{variant['format']}"
+
+def transcode_audio(source: bytes, variant: dict, input_args: Optional[list] = None) -> bytes:
+    """Transcode provider audio to the requested variant with ffmpeg"""
+    spec = AUDIO_FORMATS[variant["format"]]
+    args = [FFMPEG_PATH, "-hide_banner", "-loglevel", "error", *(input_args or []), "-i", "pipe:0", "-vn", "-ac", "1", "-c:a", spec["codec"]]
+    if variant["sample_rate"]:
+        args += ["-ar", str(variant["sample_rate"])]
+    if variant["bitrate"]:
+        args += ["-b:a", variant["bitrate"]]
+    if spec["codec"] == "libopus":
+        args += ["-application", "voip"]
+    args += ["-f", spec["muxer"], "pipe:1"]
     
+    result = subprocess.run(args, input=source, capture_output=True, timeout=60)
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace')[:200]}")
+    return result.stdout
+
+def decode_pcm(source: bytes, sample_rate: int) -> bytes:
+    """Decode any audio ffmpeg understands to mono 16-bit PCM"""
+    args = [FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-vn", "-ac", "1",
+            "-ar", str(sample_rate), "-f", "s16le", "pipe:1"]
+    result = subprocess.run(args, input=source, capture_output=True, timeout=60)
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(f"ffmpeg decode failed: {result.stderr.decode(errors='replace')[:200]}")
+    return result.stdout
+
+def trim_and_normalize(pcm: bytes, sample_rate: int) -> tuple:
+    """Trim leading/trailing silence and normalize loudness of mono 16-bit PCM
+
+    Loudness is the RMS of the non-silent 10 ms frames (a simple gated loudness), moved to
+    TTS_TARGET_LOUDNESS_DB with the gain capped so peaks stay under TTS_PEAK_LIMIT_DB.
+    Returns (processed PCM, stats).
+    """
+    import numpy as np
+    
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    frame = sample_rate // 100
+    frame_count = len(samples) // frame
+    if frame_count == 0:
+        return pcm, {"trimmed_ms": 0.0, "gain_db": 0.0}
+    
+    frames = samples[:frame_count * frame].reshape(frame_count, frame)
+    frame_rms = np.sqrt(np.mean(frames * frames, axis=1))
+    frame_db = 20 * np.log10(np.maximum(frame_rms, 1e-10))
+    voiced = np.flatnonzero(frame_db > TTS_SILENCE_THRESHOLD_DB)
+    if voiced.size == 0:
+        return pcm, {"trimmed_ms": 0.0, "gain_db": 0.0}
+    
+    pad = int(TTS_SILENCE_PAD_MS * sample_rate / 1000)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(len(samples), (voiced[-1] + 1) * frame + pad)
+    trimmed = samples[start:end]
+    
+    loudness_db = 20 * np.log10(max(float(np.sqrt(np.mean(frame_rms[voiced] ** 2))), 1e-10))
+    peak = float(np.max(np.abs(trimmed)))
+    gain_db = TTS_TARGET_LOUDNESS_DB - loudness_db
+    if peak > 0:
+        gain_db = min(gain_db, TTS_PEAK_LIMIT_DB - 20 * np.log10(peak))
+    processed = np.clip(trimmed * (10 ** (gain_db / 20)), -1.0, 32767 / 32768)
+    
+    stats = {
+        "trimmed_ms": round((len(samples) - len(trimmed)) * 1000 / sample_rate, 1),
+        "leading_trimmed_ms": round(start * 1000 / sample_rate, 1),
+        "gain_db": round(float(gain_db), 1)
+    }
+    return (processed * 32768).astype(np.int16).tobytes(), stats
+
+def postprocess_audio(source: bytes, variant: dict) -> bytes:
+    """Trim silence and normalize loudness, then encode to the requested variant"""
+    sample_rate = variant["sample_rate"] or POSTPROCESS_SAMPLE_RATE
+    pcm, stats = trim_and_normalize(decode_pcm(source, sample_rate), sample_rate)
+    logger.info("Post-processed TTS audio: trimmed %.0f ms (%.0f ms leading), gain %+.1f dB",
+                stats["trimmed_ms"], stats.get("leading_trimmed_ms", 0), stats["gain_db"], extra=SAMPLED)
+    return transcode_audio(pcm, variant, ["-f", "s16le", "-ar", str(sample_rate), "-ac", "1"])
+
+def process_tts_audio(source: bytes, variant: dict) -> bytes:
+    if TTS_POSTPROCESS:
+        try:
+            return postprocess_audio(source, variant)
+        except Exception as e:
+            logger.error(f"TTS post-processing failed, transcoding unprocessed audio: {e}")
+    return transcode_audio(source, variant)
+
+def llm_tier_setting(tier: str, model: str, max_output_tokens: str, temperature: str) -> dict:
+    """Model and generation config of a tier, overridable via LLM_TIER_<TIER>_MODEL / _MAX_OUTPUT_TOKENS / _TEMPERATURE"""
+    prefix = f"LLM_TIER_{tier.upper()}"
+    return {
+        "model": os.getenv(f"{prefix}_MODEL", model),
+        "generation_config": {
+            "max_output_tokens": int(os.getenv(f"{prefix}_MAX_OUTPUT_TOKENS", max_output_tokens)),
+            "temperature": float(os.getenv(f"{prefix}_TEMPERATURE", temperature))
+        }
+    }
+
+# Replies are spoken, so output budgets stay small: a few sentences take seconds to play
+LLM_TIERS = {
+    "fast": llm_tier_setting("fast", "gemini-1.5-flash-8b", "120", "0.8"),
+    "strong": llm_tier_setting("strong", "gemini-1.5-flash", "400", "0.7")
+}
+LLM_DEFAULT_TIER = "strong"
+LLM_TIERING_ENABLED = os.getenv("LLM_TIERING_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Transcriber settings; part of the transcript cache key so a config change never serves stale text
+STT_CONFIG = {"provider": "assemblyai", "language_code": os.getenv("ASSEMBLYAI_LANGUAGE_CODE")}
+
+aai = None
+transcriber = None
+gemini_models = {}
+
+def init_assemblyai() -> bool:
+    """Import and configure AssemblyAI (imported lazily to keep cold starts fast)"""
     try:
         assemblyai_key = os.getenv("ASSEMBLYAI_API_KEY")
         if not assemblyai_key:
             logger.error("❌ AssemblyAI API key not found")
+            return False
+        global aai, transcriber
+        import assemblyai as aai
+        aai.settings.api_key = assemblyai_key
+        if STT_CONFIG["language_code"]:
+            transcriber = aai.Transcriber(config=aai.TranscriptionConfig(language_code=STT_CONFIG["language_code"]))
         else:
-            aai.settings.api_key = assemblyai_key
-            global transcriber
             transcriber = aai.Transcriber()
-            services_status["assemblyai"] = True
-            logger.info("✅ AssemblyAI initialized successfully")
+        logger.info("✅ AssemblyAI initialized successfully")
+        return True
     except Exception as e:
         logger.error(f"❌ Failed to initialize AssemblyAI: {e}")
-    
+        return False
+
+def init_gemini() -> bool:
+    """Import and configure Gemini (imported lazily to keep cold starts fast)"""
     try:
         gemini_key = os.getenv("GEMINI_API_KEY")
         if not gemini_key:
             logger.error("❌ Gemini API key not found")
-        else:
-            genai.configure(api_key=gemini_key)
-            global gemini_model
-            gemini_model = genai.GenerativeModel('gemini-1.5-flash')
-            services_status["gemini"] = True
-            logger.info("✅ Gemini AI initialized successfully")
+            return False
+        import google.generativeai as genai
+        genai.configure(api_key=gemini_key)
+        for tier, config in LLM_TIERS.items():
+            gemini_models[tier] = genai.GenerativeModel(config["model"], generation_config=config["generation_config"])
+        logger.info("✅ Gemini AI initialized successfully (%s)", ", ".join(f"{tier}: {config['model']}" for tier, config in LLM_TIERS.items()))
+        return True
     except Exception as e:
         logger.error(f"❌ Failed to initialize Gemini: {e}")
-    
+        return False
+
+def init_murf() -> bool:
     try:
         murf_key = os.getenv("MURF_API_KEY")
         if not murf_key:
             logger.error("❌ Murf API key not found")
-        else:
-            services_status["murf"] = True
-            logger.info("✅ Murf API key found")
+            return False
+        logger.info("✅ Murf API key found")
+        return True
     except Exception as e:
         logger.error(f"❌ Failed to check Murf API key: {e}")
-    
-    return services_status
+        return False
 
-services_status = initialize_services()
-chat_sessions = {}
+async def initialize_services() -> dict:
+    """Initialize all API services in parallel with proper error handling"""
+    assemblyai_ready, gemini_ready, murf_ready = await asyncio.gather(
+        asyncio.to_thread(init_assemblyai),
+        asyncio.to_thread(init_gemini),
+        asyncio.to_thread(init_murf)
+    )
+    services_status.update(assemblyai=assemblyai_ready, gemini=gemini_ready, murf=murf_ready)
+    readiness["services"] = True
+    return services_status
 
-FALLBACK_RESPONSES = {
-    "stt_error": "I'm having trouble understanding your audio right now. Please try speaking more clearly or check your microphone.",
-    "llm_error": "I'm having trouble connecting right now. My AI brain needs a moment to reboot. Please try again in a few seconds.",
-    "tts_error": "I'm having trouble connecting right now. I can understand you, but I'm having trouble speaking right now.",
-    "network_error": "I'm having trouble connecting right now. Please check your internet connection and try again.",
-    "general_error": "I'm having trouble connecting right now. Something unexpected happened. Please try again in a moment."
+services_status = {
+    "assemblyai": False,
+    "gemini": False,
+    "murf": False
 }
 
-async def generate_fallback_audio_url(text: str) -> str:
-    """Generate fallback audio using same voice as main TTS (Murf), with gTTS backup"""
-    try:
-        import hashlib
-        
-        text_hash = hashlib.md5(text.encode()).hexdigest()[:8]
-        murf_filename = f"murf_fallback_{text_hash}.mp3"
-        murf_file_path = fallback_audio_dir / murf_filename
-        
-        if murf_file_path.exists():
-            logger.info(f"Using existing Murf fallback audio: {murf_filename}")
-            return f"http://localhost:8000/fallback-audio/{murf_filename}"
-        
-        logger.info(f"Generating fallback audio using Murf API (same voice as main TTS) for: '{text[:50]}...'")
-        
-        murf_result = await generate_murf_fallback_audio(text, murf_file_path)
-        if murf_result:
-            logger.info(f"✅ Murf fallback audio saved: {murf_file_path}")
-            return f"http://localhost:8000/fallback-audio/{murf_filename}"
-        
-        logger.warning("Murf API failed for fallback, using gTTS with faster speed")
-        return await generate_gtts_fallback_audio(text)
-        
-    except Exception as e:
-        logger.error(f"Failed to generate fallback audio: {e}")
-        return create_web_speech_fallback(text)
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "30"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+HEALTH_WINDOW_SIZE = int(os.getenv("HEALTH_WINDOW_SIZE", "20"))
+HEALTH_DEGRADED_LATENCY_MS = float(os.getenv("HEALTH_DEGRADED_LATENCY_MS", "3000"))
+HEALTH_DOWN_AFTER_FAILURES = 3
+HEALTH_DOWN_RETRY_SECONDS = float(os.getenv("HEALTH_DOWN_RETRY_SECONDS", "30"))
 
-async def generate_murf_fallback_audio(text: str, file_path: Path) -> bool:
-    """Generate fallback audio using Murf API (same voice as main TTS)"""
-    try:
-        import requests
-        
-        url = "https://api.murf.ai/v1/speech/generate-with-key"
-        headers = {
-            "accept": "application/json",
-            "Content-Type": "application/json",
-            "api-key": os.getenv("MURF_API_KEY")
-        }
-        
-        payload = {
-            "text": text,
-            "voiceId": "en-US-marcus",
-            "format": "MP3"
+class ProviderHealth:
+    """Rolling latency/error statistics for one provider, fed by probes and real calls
+
+    Errors from both count, but only probe latency is scored against HEALTH_DEGRADED_LATENCY_MS:
+    a real call's duration depends on its work (a long transcription, a full generation),
+    not on the provider's health.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.samples = deque(maxlen=HEALTH_WINDOW_SIZE)
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_checked = None
+
+    def record(self, ok: bool, latency_ms: float, error: Optional[str] = None, source: str = "request"):
+        self.samples.append((ok, latency_ms, source))
+        self.last_checked = time.time()
+        if ok:
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            self.last_error = f"{source}: {error}"
+
+    @property
+    def state(self) -> str:
+        if not self.samples:
+            return "unknown"
+        if self.consecutive_failures >= HEALTH_DOWN_AFTER_FAILURES:
+            return "down"
+        failures = sum(1 for ok, _, _ in self.samples if not ok)
+        if failures / len(self.samples) > 0.2 or self.latency_percentile(0.95) > HEALTH_DEGRADED_LATENCY_MS:
+            return "degraded"
+        return "healthy"
+
+    def latency_percentile(self, fraction: float, source: str = "probe") -> float:
+        latencies = sorted(latency for ok, latency, sample_source in self.samples if ok and sample_source == source)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state if services_status[self.name] else "unavailable",
+            "configured": services_status[self.name],
+            "samples": len(self.samples),
+            "error_rate": round(sum(1 for ok, _, _ in self.samples if not ok) / len(self.samples), 3) if self.samples else None,
+            "latency_p50_ms": round(self.latency_percentile(0.5), 1),
+            "latency_p95_ms": round(self.latency_percentile(0.95), 1),
+            "request_latency_p95_ms": round(self.latency_percentile(0.95, "request"), 1),
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "last_checked": datetime.fromtimestamp(self.last_checked).isoformat() if self.last_checked else None
         }
-        
-        logger.info("Calling Murf API for fallback audio...")
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            audio_url = result.get("audioFile")
-            
-            if audio_url:
-                audio_response = requests.get(audio_url, timeout=30)
-                if audio_response.status_code == 200:
-                    with open(file_path, 'wb') as f:
-                        f.write(audio_response.content)
-                    logger.info("✅ Murf fallback audio downloaded and saved")
-                    return True
-        
-        logger.warning(f"Murf API failed for fallback: {response.status_code}")
-        return False
-        
-    except Exception as e:
-        logger.error(f"Murf fallback generation failed: {e}")
+
+provider_health = {name: ProviderHealth(name) for name in services_status}
+
+def provider_available(name: str) -> bool:
+    """Instant check used on the request path instead of discovering outages by timing out"""
+    if not services_status[name]:
         return False
+    health = provider_health[name]
+    if health.state != "down":
+        return True
+    return time.time() - health.last_checked >= HEALTH_DOWN_RETRY_SECONDS
 
-async def generate_gtts_fallback_audio(text: str) -> str:
-    """Generate fallback audio using gTTS with faster speed and better settings"""
+def provider_retries(name: str, max_retries: int) -> int:
+    return 1 if provider_health[name].state in ("degraded", "down") else max_retries
+
+def provider_error_summary(error: Exception) -> str:
+    """Exception type and HTTP status only; raw messages can carry URLs with credentials"""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return f"{type(error).__name__} (HTTP {status})" if status else type(error).__name__
+
+def record_provider_call(name: str, started: float, error: Optional[str] = None):
+    provider_health[name].record(error is None, (time.perf_counter() - started) * 1000, error)
+
+def probe_assemblyai():
+    response = requests.get(
+        "https://api.assemblyai.com/v2/transcript",
+        params={"limit": 1},
+        headers={"authorization": os.getenv("ASSEMBLYAI_API_KEY")},
+        timeout=HEALTH_PROBE_TIMEOUT
+    )
+    response.raise_for_status()
+
+def probe_gemini():
+    response = requests.get(
+        f"https://generativelanguage.googleapis.com/v1beta/models/{LLM_TIERS[LLM_DEFAULT_TIER]['model']}",
+        headers={"x-goog-api-key": os.getenv("GEMINI_API_KEY")},
+        timeout=HEALTH_PROBE_TIMEOUT
+    )
+    response.raise_for_status()
+
+def probe_murf():
+    response = requests.get(
+        "https://api.murf.ai/v1/speech/voices",
+        headers={"api-key": os.getenv("MURF_API_KEY")},
+        timeout=HEALTH_PROBE_TIMEOUT
+    )
+    response.raise_for_status()
+
+# Cheap read-only calls per provider; replace entries with local stand-ins in tests
+HEALTH_PROBES = {
+    "assemblyai": probe_assemblyai,
+    "gemini": probe_gemini,
+    "murf": probe_murf
+}
+
+async def probe_provider(name: str):
+    started = time.perf_counter()
     try:
-        from gtts import gTTS
-        import hashlib
-        
-        text_hash = hashlib.md5(text.encode()).hexdigest()[:8]
-        filename = f"gtts_fallback_{text_hash}.mp3"
-        file_path = fallback_audio_dir / filename
-        
-        if file_path.exists():
-            logger.info(f"Using existing gTTS fallback audio: {filename}")
-            return f"http://localhost:8000/fallback-audio/{filename}"
-        
-        logger.info("Generating gTTS fallback with optimized settings...")
-        
-        tts = gTTS(
-            text=text, 
-            lang='en', 
-            slow=False,
-            tld='com'
-        )
-        tts.save(str(file_path))
-        
-        logger.info(f"✅ gTTS fallback audio saved: {file_path}")
-        return f"http://localhost:8000/fallback-audio/{filename}"
-        
-    except ImportError:
-        logger.warning("gTTS not available, using Web Speech API fallback")
-        return create_web_speech_fallback(text)
+        await asyncio.wait_for(asyncio.to_thread(HEALTH_PROBES[name]), timeout=HEALTH_PROBE_TIMEOUT + 1)
+        provider_health[name].record(True, (time.perf_counter() - started) * 1000, source="probe")
     except Exception as e:
-        logger.error(f"gTTS fallback generation failed: {e}")
-        return create_web_speech_fallback(text)
+        error = provider_error_summary(e)
+        provider_health[name].record(False, (time.perf_counter() - started) * 1000, error, source="probe")
+        logger.warning("Health probe for %s failed: %s", name, error)
+
+async def health_probe_loop():
+    """Periodically probe every configured provider in the background"""
+    while True:
+        await asyncio.gather(*(probe_provider(name) for name, configured in services_status.items() if configured))
+        await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+
+MURF_GENERATE_URL = "https://api.murf.ai/v1/speech/generate-with-key"
+
+def assemblyai_transcribe(audio_data: bytes) -> dict:
+    transcript = transcriber.transcribe(audio_data)
+    return {
+        "status": "error" if transcript.status == aai.TranscriptStatus.error else "completed",
+        "error": transcript.error,
+        "text": transcript.text,
+        "audio_duration": transcript.audio_duration,
+        "confidence": getattr(transcript, 'confidence', None)
+    }
+
+def gemini_token_usage(response) -> Optional[dict]:
+    metadata = getattr(response, "usage_metadata", None)
+    if not metadata or not getattr(metadata, "prompt_token_count", None):
+        return None
+    return {"input_tokens": metadata.prompt_token_count, "output_tokens": metadata.candidates_token_count or 0}
+
+def gemini_generate(request: dict) -> dict:
+    response = gemini_models[request["tier"]].generate_content(request["prompt"])
+    return {"text": response.text, "usage": gemini_token_usage(response)}
+
+def murf_generate(murf_payload: dict) -> dict:
+    headers = {
+        "accept": "application/json",
+        "Content-Type": "application/json",
+        "api-key": os.getenv("MURF_API_KEY")
+    }
+    response = requests.post(MURF_GENERATE_URL, headers=headers, json=murf_payload, timeout=30)
+    return {
+        "status_code": response.status_code,
+        "body": response.json() if response.status_code == 200 else response.text
+    }
+
+def murf_download(audio_url: str) -> bytes:
+    """Fetch a generated clip from the URL Murf returned"""
+    response = requests.get(audio_url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+# Blocking provider calls made on the request path (run in worker threads); the trace
+# recorder wraps these and the replay tool swaps in stubs serving recorded responses
+PROVIDER_CALLS = {
+    "assemblyai": assemblyai_transcribe,
+    "gemini": gemini_generate,
+    "murf": murf_generate,
+    "murf_audio": murf_download
+}
+
+async def call_provider(name: str, request, attempt: int = 0, purpose: str = "reply"):
+    """Run a provider call in a worker thread; every call is metered, failed or not"""
+    response = None
+    try:
+        with span(f"provider.{name}", SPAN_KIND_CLIENT, **{"peer.service": name}):
+            response = await asyncio.to_thread(PROVIDER_CALLS[name], request)
+        return response
+    finally:
+        usage_meter.record_call(name, request, response, attempt, purpose)
+
+def gemini_stream(request: dict, stopped: threading.Event):
+    """Yield text chunks; returns the token usage reported with the last chunk, if any"""
+    usage = None
+    for chunk in gemini_models[request["tier"]].generate_content(request["prompt"], stream=True):
+        if stopped.is_set():
+            return usage
+        usage = gemini_token_usage(chunk) or usage
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. only safety metadata) are skipped
+            continue
+        if text:
+            yield text
+    return usage
+
+# Blocking provider streams, iterated in a worker thread by stream_provider
+PROVIDER_STREAMS = {
+    "gemini": gemini_stream
+}
+
+class StreamFinished:
+    def __init__(self, value):
+        self.value = value
+
+async def stream_provider(name: str, request, attempt: int = 0, purpose: str = "reply"):
+    """Yield chunks of a blocking provider stream as the worker thread receives them"""
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    stopped = threading.Event()
+    received = []
+    usage = None
+    error = None
+    
+    def produce():
+        stream = PROVIDER_STREAMS[name](request, stopped)
+        try:
+            while True:
+                loop.call_soon_threadsafe(chunks.put_nowait, next(stream))
+        except StopIteration as done:
+            loop.call_soon_threadsafe(chunks.put_nowait, StreamFinished(done.value))
+        except Exception as e:
+            loop.call_soon_threadsafe(chunks.put_nowait, e)
+    
+    asyncio.ensure_future(asyncio.to_thread(produce))
+    try:
+        while True:
+            item = await chunks.get()
+            if isinstance(item, StreamFinished):
+                usage = item.value
+                return
+            if isinstance(item, Exception):
+                error = item
+                raise item
+            received.append(item)
+            yield item
+    finally:
+        # The thread can't be killed; this makes it stop reading the stream at the next chunk
+        stopped.set()
+        partial = {"text": "".join(received), "usage": usage, "failed": error is not None}
+        usage_meter.record_call(name, request, partial if received or error is None else None, attempt, purpose)
+
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "usage.db")
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+
+def estimated_tokens(text: str) -> int:
+    # Roughly four characters per token; only used when the provider reports no counts
+    return max(1, len(text) // 4) if text else 0
+
+def assemblyai_usage(request, response: dict) -> tuple:
+    if response["status"] == "error":
+        return {}, True
+    return {"stt_seconds": response["audio_duration"] or 0}, False
+
+def gemini_usage(request: dict, response: dict) -> tuple:
+    usage = response.get("usage") or {
+        "input_tokens": estimated_tokens(request["prompt"]),
+        "output_tokens": estimated_tokens(response["text"])
+    }
+    metrics = {"llm_input_tokens": usage["input_tokens"], "llm_output_tokens": usage["output_tokens"]}
+    return metrics, response.get("failed", False) or not response["text"]
+
+def murf_usage(request: dict, response: dict) -> tuple:
+    if response["status_code"] != 200:
+        return {}, True
+    return {"tts_characters": len(request["text"])}, False
+
+def murf_audio_usage(request: str, response: bytes) -> tuple:
+    return {"audio_bytes": len(response)}, False
+
+# Billable units of a provider response: (metrics, failed)
+USAGE_UNITS = {
+    "assemblyai": assemblyai_usage,
+    "gemini": gemini_usage,
+    "murf": murf_usage,
+    "murf_audio": murf_audio_usage
+}
+
+active_usage = contextvars.ContextVar("active_usage", default=None)
+
+class TurnUsage:
+    """Provider consumption of one pipeline run (or of a session's calls made outside any pipeline)"""
+    __slots__ = ("id", "pipeline", "session_id", "turn_id", "recorded_at", "metrics", "finished")
+
+    def __init__(self, pipeline: str, session_id: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.pipeline = pipeline
+        self.session_id = session_id
+        self.turn_id = None
+        self.recorded_at = time.time()
+        self.metrics = {}  # (provider, metric) -> value
+        self.finished = False
+
+    def add(self, provider: str, metric: str, value: float):
+        key = (provider, metric)
+        self.metrics[key] = self.metrics.get(key, 0) + value
+
+    def summary(self) -> dict:
+        summary = {}
+        for (provider, metric), value in self.metrics.items():
+            summary.setdefault(provider, {})[metric] = round(value, 3)
+        return summary
+
+class UsageMeter:
+    """Collects per-turn provider usage in memory and periodically flushes it to SQLite
+
+    Calls made outside a live turn (fallback pre-warm, follow-ups of a finished turn) are
+    added to one "background" record per session and flush interval; those records are
+    not turns and are left out of turn counts.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS usage (
+            turn_key TEXT NOT NULL, session_id TEXT, turn_id INTEGER, pipeline TEXT NOT NULL,
+            recorded_at REAL NOT NULL, provider TEXT NOT NULL, metric TEXT NOT NULL, value REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS usage_session ON usage (session_id, recorded_at);
+        CREATE INDEX IF NOT EXISTS usage_metric ON usage (metric, recorded_at);
+    """
+
+    def __init__(self, db_path: Optional[str]):
+        self.db_path = db_path
+        self.pending = []
+        self.background = {}  # session_id -> TurnUsage of calls made outside any live turn
+        self.lock = threading.Lock()
+        self.metrics = {"turns": 0, "flushes": 0, "flushed_rows": 0, "flush_errors": 0}
+        self.last_flush = None
+        self.opened = False
+
+    def open(self):
+        """Create the store (at startup, not import, so importing the app writes nothing)"""
+        if self.db_path and not self.opened:
+            with sqlite3.connect(self.db_path, timeout=10) as db:
+                db.executescript(self.SCHEMA)
+            self.opened = True
+
+    def connect(self) -> sqlite3.Connection:
+        self.open()
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def finish(self, usage: TurnUsage, turn_id: Optional[int] = None):
+        usage.turn_id = turn_id
+        usage.finished = True
+        if usage.metrics and self.db_path:
+            self.pending.append(usage)
+            self.metrics["turns"] += 1
+
+    def current(self) -> Optional[TurnUsage]:
+        """The active turn's usage, or the session's background record when the call belongs to no (live) turn"""
+        usage = active_usage.get()
+        if usage is not None and not usage.finished:
+            return usage
+        if not self.db_path:
+            return None
+        session_id = usage.session_id if usage is not None else session_id_var.get()
+        background = self.background.get(session_id)
+        if background is None:
+            background = self.background[session_id] = TurnUsage("background", session_id)
+        return background
+
+    def record(self, provider: str, metrics: dict):
+        usage = self.current()
+        if usage is None:
+            return
+        for metric, value in metrics.items():
+            usage.add(provider, metric, value)
+
+    def record_call(self, provider: str, request, response: Optional[dict], attempt: int, purpose: str):
+        metrics = {"calls": 1}
+        failed = response is None
+        if response is not None:
+            units, failed = USAGE_UNITS[provider](request, response)
+            metrics.update(units)
+        if failed:
+            metrics["errors"] = 1
+        if attempt:
+            metrics["retries"] = 1
+        if purpose == "fallback":
+            metrics["fallback_calls"] = 1
+        self.record(provider, metrics)
+
+    def flush_rows(self, batch: list):
+        rows = [
+            (usage.id, usage.session_id, usage.turn_id, usage.pipeline, usage.recorded_at, provider, metric, value)
+            for usage in batch for (provider, metric), value in usage.metrics.items()
+        ]
+        with self.lock, self.connect() as db:
+            db.executemany("INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    async def flush(self):
+        if not self.db_path or not (self.pending or self.background):
+            return
+        batch, self.pending = self.pending + list(self.background.values()), []
+        self.background = {}
+        try:
+            self.metrics["flushed_rows"] += await asyncio.to_thread(self.flush_rows, batch)
+            self.metrics["flushes"] += 1
+            self.last_flush = time.time()
+        except Exception as e:
+            self.metrics["flush_errors"] += 1
+            self.pending[:0] = batch
+            logger.error("Failed to flush usage records: %s", e)
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    def query(self, sql: str, params: tuple = ()) -> list:
+        with self.lock, self.connect() as db:
+            return db.execute(sql, params).fetchall()
+
+    def snapshot(self) -> dict:
+        return {
+            **self.metrics,
+            "pending_turns": len(self.pending),
+            "pending_background_sessions": len(self.background),
+            "store": self.db_path,
+            "last_flush": datetime.fromtimestamp(self.last_flush).isoformat() if self.last_flush else None
+        }
+
+usage_meter = UsageMeter(USAGE_DB_PATH or None)
+
+def usage_totals(rows: list) -> dict:
+    totals = {}
+    for provider, metric, value in rows:
+        totals.setdefault(provider, {})[metric] = round(value, 3)
+    return totals
+
+TRACE_RECORD_DIR = os.getenv("TRACE_RECORD_DIR")
+TRACE_RECORD_SAMPLE_RATE = float(os.getenv("TRACE_RECORD_SAMPLE_RATE", "1"))
+
+active_recording = contextvars.ContextVar("active_recording", default=None)
+
+class TurnRecording:
+    """Everything needed to re-drive one request: the upload, provider traffic and stage timings"""
+
+    def __init__(self, endpoint: str, form: dict):
+        self.endpoint = endpoint
+        self.form = form
+        self.recorded_at = time.time()
+        self.started = time.perf_counter()
+        self.filename = None
+        self.upload = None
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def add_call(self, provider: str, request, response, latency_ms: float, error: Optional[str]):
+        with self.lock:
+            self.calls.append({
+                "provider": provider,
+                "offset_ms": round((time.perf_counter() - self.started) * 1000 - latency_ms, 1),
+                "latency_ms": round(latency_ms, 1),
+                "request": request,
+                "response": response,
+                "error": error
+            })
+
+class TraceRecorder:
+    """Appends recorded turns to a local corpus from a background writer thread
+
+    Layout: <dir>/turns.jsonl (one turn per line) and <dir>/blobs/<sha256> for audio bytes,
+    stored once per distinct content.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.blob_dir = self.directory / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.queue = queue.SimpleQueue()
+        threading.Thread(target=self.write_loop, name="trace-recorder", daemon=True).start()
+
+    def start(self, endpoint: str, form: dict) -> Optional[TurnRecording]:
+        if random.random() >= TRACE_RECORD_SAMPLE_RATE:
+            return None
+        recording = TurnRecording(endpoint, form)
+        active_recording.set(recording)
+        return recording
+
+    def submit(self, recording: TurnRecording, ctx, response: dict):
+        recording.filename = ctx.filename
+        recording.upload = ctx.audio_data
+        self.queue.put((recording, dict(ctx.timings), response.get("status"), (time.perf_counter() - recording.started) * 1000))
+
+    def write_loop(self):
+        while True:
+            recording, timings, status, total_ms = self.queue.get()
+            try:
+                self.write(recording, timings, status, total_ms)
+            except Exception as e:
+                logger.error("Failed to write trace recording: %s", e)
+
+    def store_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self.blob_dir / digest
+        if not blob_path.exists():
+            blob_path.write_bytes(data)
+        return digest
+
+    def encode(self, value):
+        if isinstance(value, (bytes, bytearray)):
+            return {"blob": self.store_blob(bytes(value))}
+        return value
+
+    def write(self, recording: TurnRecording, timings: dict, status: str, total_ms: float):
+        entry = {
+            "id": uuid.uuid4().hex[:12],
+            "recorded_at": datetime.fromtimestamp(recording.recorded_at).isoformat(),
+            "endpoint": recording.endpoint,
+            "form": recording.form,
+            "filename": recording.filename,
+            "upload": self.encode(recording.upload) if recording.upload else None,
+            "calls": [
+                {**call, "request": self.encode(call["request"]), "response": self.encode(call["response"])}
+                for call in sorted(recording.calls, key=lambda call: call["offset_ms"])
+            ],
+            "stage_timings_ms": timings,
+            "total_ms": round(total_ms, 1),
+            "status": status
+        }
+        with open(self.directory / "turns.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+def recorded_provider_call(name: str, func):
+    """Wrap a provider call so it is captured into the active recording, if any"""
+    def call(request):
+        recording = active_recording.get()
+        if recording is None:
+            return func(request)
+        started = time.perf_counter()
+        try:
+            response = func(request)
+        except Exception as e:
+            recording.add_call(name, request, None, (time.perf_counter() - started) * 1000, str(e) or type(e).__name__)
+            raise
+        recording.add_call(name, request, response, (time.perf_counter() - started) * 1000, None)
+        return response
+    return call
+
+trace_recorder = TraceRecorder(TRACE_RECORD_DIR) if TRACE_RECORD_DIR else None
+if trace_recorder:
+    for provider_name, provider_call in list(PROVIDER_CALLS.items()):
+        PROVIDER_CALLS[provider_name] = recorded_provider_call(provider_name, provider_call)
+
+CHAT_LOG_DIR = os.getenv("CHAT_LOG_DIR")
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+CHAT_HISTORY_MAX_PAGE_SIZE = 500
+SEARCH_TOKEN_PATTERN = re.compile(r"\w{2,}")
+
+class ChatMessage:
+    """One session message; slotted, with an interned role and an epoch timestamp"""
+    __slots__ = ("id", "role", "content", "timestamp")
+
+    def __init__(self, message_id: int, role: str, content: str, timestamp: float):
+        self.id = message_id
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = timestamp
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "role": self.role,
+            "content": self.content,
+            "timestamp": datetime.fromtimestamp(self.timestamp).isoformat()
+        }
+
+class ChatLog:
+    """Append-only JSONL file per session, written off the event loop and replayed on first use"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.queue = queue.SimpleQueue()
+        threading.Thread(target=self.write_loop, name="chat-log", daemon=True).start()
+
+    def path(self, session_id: str) -> Path:
+        # Session ids come from clients; keep a readable prefix but make the name safe and unique
+        readable = re.sub(r"[^A-Za-z0-9_-]", "_", session_id)[:48]
+        digest = hashlib.blake2b(session_id.encode("utf-8"), digest_size=6).hexdigest()
+        return self.directory / f"{readable}_{digest}.jsonl"
+
+    def append(self, session_id: str, message: ChatMessage):
+        self.queue.put((session_id, {"op": "add", "id": message.id, "role": message.role,
+                                     "content": message.content, "ts": message.timestamp}))
+
+    def delete(self, session_id: str, message: ChatMessage):
+        self.queue.put((session_id, {"op": "del", "id": message.id}))
+
+    def write_loop(self):
+        while True:
+            session_id, record = self.queue.get()
+            try:
+                path = self.path(session_id)
+                new_log = not path.exists()
+                with open(path, "a", encoding="utf-8") as f:
+                    if new_log:
+                        f.write(json.dumps({"op": "session", "session_id": session_id}, ensure_ascii=False) + "\n")
+                    f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            except Exception as e:
+                logger.error("Failed to append to chat log of %s: %s", session_id, e)
+
+    def load(self, session_id: str) -> List[ChatMessage]:
+        path = self.path(session_id)
+        if not path.exists():
+            return []
+        messages = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                if record["op"] == "session":
+                    continue
+                if record["op"] == "add":
+                    messages[record["id"]] = ChatMessage(record["id"], record["role"], record["content"], record["ts"])
+                else:
+                    messages.pop(record["id"], None)
+        return list(messages.values())
+
+    def session_ids(self) -> List[str]:
+        session_ids = []
+        for path in self.directory.glob("*.jsonl"):
+            with open(path, encoding="utf-8") as f:
+                header = f.readline()
+            try:
+                session_ids.append(json.loads(header)["session_id"])
+            except (ValueError, KeyError):
+                logger.warning("Skipping chat log without a session header: %s", path.name)
+        return session_ids
+
+class ChatSearchIndex:
+    """Inverted index from word to the messages containing it, across all sessions"""
+
+    def __init__(self):
+        self.postings = {}  # token -> {session_id: {message_id, ...}}
+
+    @staticmethod
+    def tokens(text: str) -> set:
+        return set(SEARCH_TOKEN_PATTERN.findall(text.lower()))
+
+    def add(self, session_id: str, message: ChatMessage):
+        for token in self.tokens(message.content):
+            self.postings.setdefault(sys.intern(token), {}).setdefault(session_id, set()).add(message.id)
+
+    def remove(self, session_id: str, message: ChatMessage):
+        for token in self.tokens(message.content):
+            sessions = self.postings.get(token, {})
+            ids = sessions.get(session_id)
+            if ids is None:
+                continue
+            ids.discard(message.id)
+            if not ids:
+                del sessions[session_id]
+            if not sessions:
+                del self.postings[token]
+
+    def search(self, query: str, session_id: Optional[str] = None) -> List[tuple]:
+        """(session_id, message_id) pairs containing every word of the query"""
+        tokens = sorted(self.tokens(query), key=lambda token: sum(map(len, self.postings.get(token, {}).values())))
+        if not tokens:
+            return []
+        # Intersect starting from the rarest word so the candidate set stays small
+        matches = None
+        for token in tokens:
+            sessions = self.postings.get(token, {})
+            if session_id is not None:
+                sessions = {session_id: sessions[session_id]} if session_id in sessions else {}
+            found = {(sid, message_id) for sid, ids in sessions.items() for message_id in ids}
+            matches = found if matches is None else matches & found
+            if not matches:
+                return []
+        return list(matches)
+
+chat_sessions = {}
+chat_log = ChatLog(CHAT_LOG_DIR) if CHAT_LOG_DIR else None
+chat_search_index = ChatSearchIndex()
+
+FALLBACK_RESPONSES = {
+    "stt_error": "I'm having trouble understanding your audio right now. Please try speaking more clearly or check your microphone.",
+    "llm_error": "I'm having trouble connecting right now. My AI brain needs a moment to reboot. Please try again in a few seconds.",
+    "tts_error": "I'm having trouble connecting right now. I can understand you, but I'm having trouble speaking right now.",
+    "network_error": "I'm having trouble connecting right now. Please check your internet connection and try again.",
+    "general_error": "I'm having trouble connecting right now. Something unexpected happened. Please try again in a moment."
+}
+
+# Short clips played the moment a transcript is ready, while the real answer is generated
+ACKNOWLEDGEMENT_MESSAGES = [
+    "Okay, one moment.",
+    "Let me think about that.",
+    "Sure, give me a second.",
+    "Good question, let me check."
+]
+
+PREWARM_MESSAGES = [
+    "I'm having trouble connecting right now",
+    "I didn't catch that. Could you please repeat?",
+    *FALLBACK_RESPONSES.values(),
+    *ACKNOWLEDGEMENT_MESSAGES
+]
+
+async def prewarm_fallback_audio():
+    """Render the fixed fallback messages ahead of time so error paths never wait on TTS"""
+    started = time.perf_counter()
+    for message in PREWARM_MESSAGES:
+        try:
+            await generate_fallback_audio_url(message)
+        except Exception as e:
+            logger.error(f"Failed to pre-warm fallback audio: {e}")
+    startup_metrics["prewarm_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    readiness["prewarmed_audio"] = True
+    logger.info("✅ Fallback audio pre-warmed in %.1f ms", startup_metrics["prewarm_ms"])
+
+@traced("fallback_audio.generate")
+async def generate_fallback_audio_url(text: str) -> str:
+    """Generate fallback audio using same voice as main TTS (Murf), with gTTS backup"""
+    try:
+        murf_filename = fallback_clip_filename("murf", text)
+        murf_file_path = fallback_audio_dir / murf_filename
+        
+        if fallback_manifest.get(murf_filename):
+            logger.info(f"Using existing Murf fallback audio: {murf_filename}")
+            return f"http://localhost:8000/fallback-audio/{murf_filename}"
+        
+        if await process_raw_fallback_clip("murf", text):
+            return f"http://localhost:8000/fallback-audio/{murf_filename}"
+        
+        logger.info(f"Generating fallback audio using Murf API (same voice as main TTS) for: '{text[:50]}...'")
+        
+        murf_result = await generate_murf_fallback_audio(text, murf_file_path)
+        if murf_result:
+            logger.info(f"✅ Murf fallback audio saved: {murf_file_path}")
+            return f"http://localhost:8000/fallback-audio/{murf_filename}"
+        
+        logger.warning("Murf API failed for fallback, using gTTS with faster speed")
+        return await generate_gtts_fallback_audio(text)
+        
+    except Exception as e:
+        logger.error(f"Failed to generate fallback audio: {e}")
+        return create_web_speech_fallback(text)
+
+def fallback_postprocessing_enabled() -> bool:
+    return TTS_POSTPROCESS and FFMPEG_PATH is not None
+
+def fallback_clip_filename(source: str, text: str, processed: Optional[bool] = None) -> str:
+    """Clip name for text; processed clips hash the processing settings in too"""
+    if processed is None:
+        processed = fallback_postprocessing_enabled()
+    key = f"{TTS_POSTPROCESS_TAG}|{text}" if processed else text
+    return f"{source}_fallback_{hashlib.md5(key.encode()).hexdigest()[:8]}.mp3"
+
+async def process_raw_fallback_clip(source: str, text: str) -> bool:
+    """Render the processed clip from an unprocessed one already on disk (e.g. shipped with the repo)"""
+    if not fallback_postprocessing_enabled():
+        return False
+    raw = fallback_manifest.get(fallback_clip_filename(source, text, processed=False))
+    if raw is None:
+        return False
+    processed = await postprocess_fallback_audio(await asyncio.to_thread(raw["path"].read_bytes))
+    entry = await fallback_manifest.store(fallback_clip_filename(source, text), processed)
+    logger.info(f"✅ Processed existing fallback clip {raw['filename']} into {entry['filename']}")
+    return True
+
+async def postprocess_fallback_audio(audio_bytes: bytes) -> bytes:
+    """Give fallback clips the same trimming and loudness as live replies (unchanged if that fails)"""
+    if not fallback_postprocessing_enabled():
+        return audio_bytes
+    try:
+        return await asyncio.to_thread(postprocess_audio, audio_bytes, negotiate_audio_format("mp3"))
+    except Exception as e:
+        logger.error(f"Fallback audio post-processing failed: {e}")
+        return audio_bytes
+
+async def generate_murf_fallback_audio(text: str, file_path: Path) -> bool:
+    """Generate fallback audio using Murf API (same voice as main TTS)"""
+    try:
+        payload = {
+            "text": text,
+            "voiceId": "en-US-marcus",
+            "format": "MP3"
+        }
+        
+        logger.info("Calling Murf API for fallback audio...")
+        response = await call_provider("murf", payload, purpose="fallback")
+        
+        if response["status_code"] == 200:
+            result = response["body"]
+            audio_url = result.get("audioFile")
+            
+            if audio_url:
+                audio_bytes = await call_provider("murf_audio", audio_url, purpose="fallback")
+                audio_bytes = await postprocess_fallback_audio(audio_bytes)
+                await fallback_manifest.store(file_path.name, audio_bytes)
+                logger.info("✅ Murf fallback audio downloaded and saved")
+                return True
+        
+        logger.warning(f"Murf API failed for fallback: {response['status_code']}")
+        return False
+        
+    except Exception as e:
+        logger.error(f"Murf fallback generation failed: {e}")
+        return False
+
+async def generate_gtts_fallback_audio(text: str) -> str:
+    """Generate fallback audio using gTTS with faster speed and better settings"""
+    try:
+        from gtts import gTTS
+        
+        filename = fallback_clip_filename("gtts", text)
+        file_path = fallback_audio_dir / filename
+        
+        if fallback_manifest.get(filename) or await process_raw_fallback_clip("gtts", text):
+            logger.info(f"Using existing gTTS fallback audio: {filename}")
+            return f"http://localhost:8000/fallback-audio/{filename}"
+        
+        logger.info("Generating gTTS fallback with optimized settings...")
+        
+        tts = gTTS(
+            text=text, 
+            lang='en', 
+            slow=False,
+            tld='com'
+        )
+        buffer = io.BytesIO()
+        await asyncio.to_thread(tts.write_to_fp, buffer)
+        usage_meter.record("gtts", {"calls": 1, "fallback_calls": 1, "tts_characters": len(text)})
+        processed = await postprocess_fallback_audio(buffer.getvalue())
+        await fallback_manifest.store(filename, processed)
+        
+        logger.info(f"✅ gTTS fallback audio saved: {file_path}")
+        return f"http://localhost:8000/fallback-audio/{filename}"
+        
+    except ImportError:
+        logger.warning("gTTS not available, using Web Speech API fallback")
+        return create_web_speech_fallback(text)
+    except Exception as e:
+        logger.error(f"gTTS fallback generation failed: {e}")
+        return create_web_speech_fallback(text)
 
 def create_web_speech_fallback(text: str) -> str:
     """Create a fallback that uses browser's Web Speech API"""
     logger.info("Using Web Speech API fallback")
     
-    import base64
-    
     text_base64 = base64.b64encode(text.encode('utf-8')).decode('utf-8')
     
     return f"web-speech:{text_base64}"
 
-async def safe_transcribe(audio_data: bytes, max_retries: int = 3) -> dict:
+def cached_fallback_audio_url(text: str) -> Optional[str]:
+    """URL of an already rendered fallback clip for text, without generating one"""
+    # Processed clips first; an unprocessed one still beats browser speech
+    candidates = [fallback_clip_filename(source, text, processed) for processed in (True, False) for source in ("murf", "gtts")]
+    for filename in candidates if fallback_postprocessing_enabled() else candidates[2:]:
+        if fallback_manifest.get(filename):
+            return f"http://localhost:8000/fallback-audio/{filename}"
+    return None
+
+def choose_acknowledgement() -> tuple:
+    """(text, audio_url) of a pre-rendered acknowledgement; browser speech if none is rendered yet"""
+    rendered = [(text, url) for text in ACKNOWLEDGEMENT_MESSAGES if (url := cached_fallback_audio_url(text))]
+    if rendered:
+        return random.choice(rendered)
+    text = random.choice(ACKNOWLEDGEMENT_MESSAGES)
+    return text, create_web_speech_fallback(text)
+
+def audio_content_hash(audio_data: bytes) -> str:
+    return hashlib.blake2b(audio_data, digest_size=16).hexdigest()
+
+TRANSCRIPT_CACHE_TTL = float(os.getenv("TRANSCRIPT_CACHE_TTL", "3600"))
+TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", "2000"))
+
+class TranscriptCache:
+    """Successful transcripts keyed by audio content hash and STT config, with TTL and LRU eviction
+
+    Identical audio that is already being transcribed joins the in-flight call instead of
+    starting (and paying for) a second one.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.config_fingerprint = hashlib.blake2b(json.dumps(STT_CONFIG, sort_keys=True).encode(), digest_size=4).hexdigest()
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.metrics = {"hits": 0, "misses": 0, "inflight_joins": 0, "evictions": 0, "expirations": 0}
+
+    def key(self, audio_data: bytes) -> str:
+        return self.digest_key(audio_content_hash(audio_data))
+
+    def digest_key(self, digest: str) -> str:
+        return f"{digest}:{self.config_fingerprint}"
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] > self.ttl:
+            del self.entries[key]
+            self.metrics["expirations"] += 1
+            entry = None
+        if entry is None:
+            self.metrics["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.metrics["hits"] += 1
+        return entry[1]
+
+    def settle(self, key: str, job: asyncio.Future):
+        """Cache a finished call even when the request that started it has given up waiting"""
+        if self.inflight.get(key) is job:
+            del self.inflight[key]
+        if not job.cancelled() and job.exception() is None:
+            self.put(key, job.result())
+
+    def put(self, key: str, transcription: dict):
+        if not transcription.get("success") or self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic(), transcription)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.metrics["evictions"] += 1
+
+    def snapshot(self) -> dict:
+        lookups = self.metrics["hits"] + self.metrics["misses"]
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            **self.metrics,
+            "hit_rate": round((self.metrics["hits"] + self.metrics["inflight_joins"]) / lookups, 3) if lookups else None
+        }
+
+transcript_cache = TranscriptCache(TRANSCRIPT_CACHE_TTL, TRANSCRIPT_CACHE_MAX_ENTRIES)
+
+@traced("safe_transcribe")
+async def safe_transcribe(audio_data, max_retries: int = 3, cache_key: Optional[str] = None) -> dict:
+    """Transcribe audio, reusing the transcript of identical audio (cached or in flight)
+
+    audio_data may also be a provider upload URL or local path, given with the cache_key
+    of the audio it refers to.
+    """
+    key = cache_key or transcript_cache.key(audio_data)
+    cached = transcript_cache.get(key)
+    if cached is not None:
+        usage_meter.record("assemblyai", {"cached_stt_seconds": cached.get("duration") or 0})
+        return {**cached, "cached": True}
+    
+    inflight = transcript_cache.inflight.get(key)
+    if inflight is not None:
+        try:
+            transcription = await asyncio.shield(inflight)
+            transcript_cache.metrics["inflight_joins"] += 1
+            usage_meter.record("assemblyai", {"cached_stt_seconds": transcription.get("duration") or 0})
+            return {**transcription, "cached": True}
+        except asyncio.CancelledError:
+            # Only fall through to our own call if the owner's turn was cancelled, not ours
+            if not inflight.cancelled():
+                raise
+    
+    # Shielded: the provider keeps working (and billing) after a caller times out, so the
+    # call runs to completion and its transcript is cached for the next request
+    job = asyncio.ensure_future(transcribe_with_retries(audio_data, max_retries))
+    transcript_cache.inflight[key] = job
+    job.add_done_callback(functools.partial(transcript_cache.settle, key))
+    return await asyncio.shield(job)
+
+async def transcribe_with_retries(audio_data, max_retries: int = 3) -> dict:
     """Safely transcribe audio with retries and fallback"""
-    if not services_status["assemblyai"]:
+    if not provider_available("assemblyai"):
         return {
             "success": False,
             "error": "AssemblyAI service not available",
             "fallback_text": "Speech transcription unavailable"
         }
     
+    max_retries = provider_retries("assemblyai", max_retries)
     for attempt in range(max_retries):
+        started = time.perf_counter()
         try:
-            logger.info(f"Transcription attempt {attempt + 1}/{max_retries}")
-            transcript = transcriber.transcribe(audio_data)
+            logger.info("Transcription attempt %d/%d", attempt + 1, max_retries, extra=SAMPLED)
+            transcript = await call_provider("assemblyai", audio_data, attempt)
+            record_provider_call("assemblyai", started)
             
-            if transcript.status == aai.TranscriptStatus.error:
-                logger.error(f"Transcription failed: {transcript.error}")
+            if transcript["status"] == "error":
+                logger.error(f"Transcription failed: {transcript['error']}")
                 if attempt == max_retries - 1:
                     return {
                         "success": False,
-                        "error": f"Transcription failed: {transcript.error}",
+                        "error": f"Transcription failed: {transcript['error']}",
                         "fallback_text": "Could not transcribe audio"
                     }
                 continue
             
             return {
                 "success": True,
-                "text": transcript.text,
-                "duration": transcript.audio_duration,
-                "confidence": getattr(transcript, 'confidence', None)
+                "text": transcript["text"],
+                "duration": transcript["audio_duration"],
+                "confidence": transcript["confidence"]
             }
             
         except Exception as e:
+            record_provider_call("assemblyai", started, provider_error_summary(e))
             logger.error(f"Transcription attempt {attempt + 1} failed: {e}")
             if attempt == max_retries - 1:
                 return {
@@ -248,7 +1960,7 @@ async def safe_transcribe(audio_data: bytes, max_retries: int = 3) -> dict:
                     "error": str(e),
                     "fallback_text": "Transcription service error"
                 }
-            time.sleep(1)
+            await asyncio.sleep(1)
     
     return {
         "success": False,
@@ -256,21 +1968,25 @@ async def safe_transcribe(audio_data: bytes, max_retries: int = 3) -> dict:
         "fallback_text": "Could not process audio"
     }
 
-async def safe_llm_generate(prompt: str, max_retries: int = 3) -> dict:
+@traced("safe_llm_generate")
+async def safe_llm_generate(prompt: str, max_retries: int = 3, tier: str = LLM_DEFAULT_TIER) -> dict:
     """Safely generate LLM response with retries and fallback"""
-    if not services_status["gemini"]:
+    if not provider_available("gemini"):
         return {
             "success": False,
             "error": "Gemini AI service not available",
             "fallback_response": FALLBACK_RESPONSES["llm_error"]
         }
     
+    max_retries = provider_retries("gemini", max_retries)
     for attempt in range(max_retries):
+        started = time.perf_counter()
         try:
-            logger.info(f"LLM generation attempt {attempt + 1}/{max_retries}")
-            response = gemini_model.generate_content(prompt)
+            logger.info("LLM generation attempt %d/%d (%s tier)", attempt + 1, max_retries, tier, extra=SAMPLED)
+            response = await call_provider("gemini", {"tier": tier, "prompt": prompt}, attempt)
+            record_provider_call("gemini", started)
             
-            if not response.text:
+            if not response["text"]:
                 if attempt == max_retries - 1:
                     return {
                         "success": False,
@@ -281,10 +1997,12 @@ async def safe_llm_generate(prompt: str, max_retries: int = 3) -> dict:
             
             return {
                 "success": True,
-                "text": response.text.strip()
+                "text": response["text"].strip(),
+                "model": LLM_TIERS[tier]["model"]
             }
             
         except Exception as e:
+            record_provider_call("gemini", started, provider_error_summary(e))
             logger.error(f"LLM generation attempt {attempt + 1} failed: {e}")
             if attempt == max_retries - 1:
                 return {
@@ -292,7 +2010,7 @@ async def safe_llm_generate(prompt: str, max_retries: int = 3) -> dict:
                     "error": str(e),
                     "fallback_response": FALLBACK_RESPONSES["llm_error"]
                 }
-            time.sleep(2)
+            await asyncio.sleep(2)
     
     return {
         "success": False,
@@ -300,9 +2018,89 @@ async def safe_llm_generate(prompt: str, max_retries: int = 3) -> dict:
         "fallback_response": FALLBACK_RESPONSES["llm_error"]
     }
 
-async def safe_tts_generate(text: str, voice_id: str = "en-US-marcus", max_retries: int = 3) -> dict:
+async def safe_llm_stream(prompt: str, max_retries: int = 3, tier: str = LLM_DEFAULT_TIER):
+    """Stream LLM text as {"type": "delta"} events, ending with one {"type": "done"} event
+
+    Retries only happen before the first chunk; an answer that fails midway is not restarted,
+    its partial text is returned with success=False.
+    """
+    if not provider_available("gemini"):
+        yield {"type": "done", "success": False, "error": "Gemini AI service not available",
+               "text": FALLBACK_RESPONSES["llm_error"]}
+        return
+    
+    max_retries = provider_retries("gemini", max_retries)
+    error = "Max retries exceeded"
+    for attempt in range(max_retries):
+        started = time.perf_counter()
+        parts = []
+        try:
+            logger.info("LLM streaming attempt %d/%d (%s tier)", attempt + 1, max_retries, tier, extra=SAMPLED)
+            async for chunk in stream_provider("gemini", {"tier": tier, "prompt": prompt}, attempt):
+                parts.append(chunk)
+                yield {"type": "delta", "text": chunk}
+            record_provider_call("gemini", started)
+            text = "".join(parts).strip()
+            if text:
+                yield {"type": "done", "success": True, "text": text, "model": LLM_TIERS[tier]["model"]}
+                return
+            error = "No response generated"
+        except Exception as e:
+            record_provider_call("gemini", started, provider_error_summary(e))
+            logger.error(f"LLM streaming attempt {attempt + 1} failed: {e}")
+            error = str(e)
+            if parts:
+                yield {"type": "done", "success": False, "error": error, "text": "".join(parts).strip()}
+                return
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2)
+    
+    yield {"type": "done", "success": False, "error": error, "text": FALLBACK_RESPONSES["llm_error"]}
+
+@traced("tts.transcode")
+async def transcode_tts_audio(audio_url: str, text: str, voice_id: str, variant: dict) -> dict:
+    """Download provider audio, post-process / transcode it and store the variant in the TTS cache"""
+    provider_audio = await call_provider("murf_audio", audio_url)
+    audio_bytes = await asyncio.to_thread(process_tts_audio, provider_audio, variant)
+    
+    filename = tts_cache_filename(text, voice_id, variant)
+    await tts_manifest.store(filename, audio_bytes)
+    
+    logger.info(f"✅ Transcoded TTS audio to {variant['format']} ({len(provider_audio)} -> {len(audio_bytes)} bytes)")
+    return tts_success_result(f"http://localhost:8000/tts-audio/{filename}", variant)
+
+def tts_success_result(audio_url: str, variant: dict) -> dict:
+    return {
+        "success": True,
+        "audio_url": audio_url,
+        "format": variant["format"],
+        "media_type": AUDIO_FORMATS[variant["format"]]["media_type"],
+        "sample_rate": variant["sample_rate"],
+        "bitrate": variant["bitrate"]
+    }
+
+@traced("safe_tts_generate")
+async def safe_tts_generate(text: str, voice_id: str = "en-US-marcus", max_retries: int = 3,
+                            audio_format: Optional[dict] = None) -> dict:
     """Safely generate TTS audio with retries and fallback"""
-    if not services_status["murf"]:
+    variant = audio_format or negotiate_audio_format()
+    transcode = needs_transcoding(variant)
+    
+    if transcode and not FFMPEG_PATH:
+        logger.warning(f"ffmpeg not available, delivering MP3 instead of {variant['format']}")
+        variant = negotiate_audio_format("mp3")
+        transcode = False
+    # Opt-in: post-processing then proxies every reply through the TTS cache, so each phrase is processed once
+    transcode = transcode or (TTS_POSTPROCESS_LIVE and TTS_POSTPROCESS and FFMPEG_PATH is not None)
+    
+    if transcode:
+        cache_filename = tts_cache_filename(text, voice_id, variant)
+        if tts_manifest.get(cache_filename):
+            logger.info(f"Using cached TTS variant: {cache_filename}")
+            usage_meter.record("murf", {"cached_tts_characters": len(text)})
+            return tts_success_result(f"http://localhost:8000/tts-audio/{cache_filename}", variant)
+    
+    if not provider_available("murf"):
         fallback_message = "I'm having trouble connecting right now"
         fallback_audio = await generate_fallback_audio_url(fallback_message)
         return {
@@ -312,38 +2110,37 @@ async def safe_tts_generate(text: str, voice_id: str = "en-US-marcus", max_retri
             "fallback_text": fallback_message
         }
     
+    max_retries = provider_retries("murf", max_retries)
     for attempt in range(max_retries):
+        started = time.perf_counter()
         try:
-            logger.info(f"TTS generation attempt {attempt + 1}/{max_retries}")
+            logger.info("TTS generation attempt %d/%d", attempt + 1, max_retries, extra=SAMPLED)
             
-            url = "https://api.murf.ai/v1/speech/generate-with-key"
-            headers = {
-                "accept": "application/json",
-                "Content-Type": "application/json",
-                "api-key": os.getenv("MURF_API_KEY")
-            }
-            payload = {
+            murf_payload = {
                 "text": text,
                 "voiceId": voice_id,
-                "format": "MP3"
+                "format": "WAV" if transcode else AUDIO_FORMATS[variant["format"]]["provider_format"]
             }
+            if variant["sample_rate"] in MURF_SAMPLE_RATES:
+                murf_payload["sampleRate"] = variant["sample_rate"]
             
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
+            response = await call_provider("murf", murf_payload, attempt)
+            record_provider_call("murf", started, f"HTTP {response['status_code']}" if response["status_code"] >= 500 else None)
             
-            if response.status_code != 200:
-                logger.error(f"Murf API failed: {response.status_code} - {response.text}")
+            if response["status_code"] != 200:
+                logger.error("Murf API failed: %s - %s", response["status_code"], payload(response["body"]))
                 if attempt == max_retries - 1:
                     fallback_message = "I'm having trouble connecting right now"
                     fallback_audio = await generate_fallback_audio_url(fallback_message)
                     return {
                         "success": False,
-                        "error": f"TTS API failed: {response.status_code}",
+                        "error": f"TTS API failed: {response['status_code']}",
                         "fallback_audio": fallback_audio,
                         "fallback_text": fallback_message
                     }
                 continue
             
-            result = response.json()
+            result = response["body"]
             audio_url = result.get("audioFile")
             
             if not audio_url:
@@ -358,12 +2155,17 @@ async def safe_tts_generate(text: str, voice_id: str = "en-US-marcus", max_retri
                     }
                 continue
             
-            return {
-                "success": True,
-                "audio_url": audio_url
-            }
+            if transcode:
+                try:
+                    return await transcode_tts_audio(audio_url, text, voice_id, variant)
+                except Exception as e:
+                    logger.error(f"TTS transcoding to {variant['format']} failed, returning provider WAV: {e}")
+                    return tts_success_result(audio_url, negotiate_audio_format("wav"))
+            
+            return tts_success_result(audio_url, variant)
             
         except Exception as e:
+            record_provider_call("murf", started, provider_error_summary(e))
             logger.error(f"TTS generation attempt {attempt + 1} failed: {e}")
             if attempt == max_retries - 1:
                 fallback_message = "I'm having trouble connecting right now"
@@ -374,7 +2176,7 @@ async def safe_tts_generate(text: str, voice_id: str = "en-US-marcus", max_retri
                     "fallback_audio": fallback_audio,
                     "fallback_text": fallback_message
                 }
-            time.sleep(1)
+            await asyncio.sleep(1)
     
     fallback_message = "I'm having trouble connecting right now"
     fallback_audio = await generate_fallback_audio_url(fallback_message)
@@ -385,49 +2187,316 @@ async def safe_tts_generate(text: str, voice_id: str = "en-US-marcus", max_retri
         "fallback_text": fallback_message
     }
  
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class TurnSuperseded(Exception):
+    """Raised inside a turn that was cancelled by a newer turn or an explicit interrupt"""
 
-app.mount("/fallback-audio", StaticFiles(directory="fallback_audio"), name="fallback_audio")
+class ConversationTurn:
+    """One user utterance in a session, owning the provider tasks started on its behalf"""
+    __slots__ = ("session_id", "turn_id", "tasks", "cancelled", "started_at")
 
-class TTSRequest(BaseModel):
-    text: str
-    voiceId: str
-    format: str = "MP3"
+    def __init__(self, session_id: str, turn_id: int):
+        self.session_id = session_id
+        self.turn_id = turn_id
+        self.tasks = set()
+        self.cancelled = False
+        self.started_at = time.monotonic()
 
-class LLMRequest(BaseModel):
-    text: str
+    async def run(self, coro):
+        """Run provider work as a task that a newer turn can cancel"""
+        if self.cancelled:
+            coro.close()
+            raise TurnSuperseded(f"Turn {self.turn_id} was superseded")
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if self.cancelled and task.cancelled():
+                raise TurnSuperseded(f"Turn {self.turn_id} was superseded")
+            raise
+        finally:
+            self.tasks.discard(task)
+
+    def check(self):
+        if self.cancelled:
+            raise TurnSuperseded(f"Turn {self.turn_id} was superseded")
+
+    def cancel(self):
+        self.cancelled = True
+        for task in list(self.tasks):
+            task.cancel()
+
+FOLLOW_UP_RESULT_TTL = float(os.getenv("FOLLOW_UP_RESULT_TTL", "300"))
+
+class TurnTracker:
+    """Tracks the in-flight turn of every session so a new utterance cancels the old one
+
+    A session's turn counter is dropped once it has been idle for `ttl` seconds; by then the
+    follow-up results keyed on its turn ids have expired too, so restarting at 1 is safe.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.active = {}
+        self.turn_counters = {}  # session_id -> [last turn id, monotonic time it ended or None while running]
+
+    def begin(self, session_id: str) -> ConversationTurn:
+        self.prune()
+        previous = self.active.get(session_id)
+        if previous is not None:
+            logger.info("Barge-in: cancelling turn %d of session %s", previous.turn_id, session_id)
+            previous.cancel()
+        counter = self.turn_counters.setdefault(session_id, [0, None])
+        counter[0] += 1
+        counter[1] = None
+        turn = ConversationTurn(session_id, counter[0])
+        self.active[session_id] = turn
+        return turn
+
+    def ended(self, turn: ConversationTurn):
+        counter = self.turn_counters.get(turn.session_id)
+        if counter is not None and counter[0] == turn.turn_id:
+            counter[1] = time.monotonic()
+
+    def finish(self, turn: ConversationTurn):
+        if self.active.get(turn.session_id) is turn:
+            del self.active[turn.session_id]
+            self.ended(turn)
+
+    def interrupt(self, session_id: str) -> Optional[ConversationTurn]:
+        turn = self.active.pop(session_id, None)
+        if turn is not None:
+            turn.cancel()
+            self.ended(turn)
+        return turn
+
+    def prune(self):
+        now = time.monotonic()
+        for session_id, (_, ended) in list(self.turn_counters.items()):
+            if ended is not None and now - ended > self.ttl:
+                del self.turn_counters[session_id]
+
+turn_tracker = TurnTracker(FOLLOW_UP_RESULT_TTL)
+
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    """Attach a request id to every log record and echo it back to the client
+
+    The root span and the profile cover the whole response: call_next returns once the
+    headers are ready, so they are finished when the body has been sent (streamed
+    endpoints keep working well after that point).
+    """
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    request_id_token = request_id_var.set(request_id)
+    session_id_token = session_id_var.set(request.query_params.get("session_id"))
+    task_requests[asyncio.current_task()] = request_id
+    profiler = SamplingProfiler(PROFILE_INTERVAL_MS, request_id) if profiling_requested(request) else None
+    if profiler:
+        active_profilers.add(profiler)
+        profiler.start()
+    started = time.perf_counter()
+    root = start_span(f"{request.method} {request.url.path}", SPAN_KIND_SERVER, parse_traceparent(request.headers.get("traceparent")),
+                      **{"http.request.method": request.method, "url.path": request.url.path, "request.id": request_id})
+    root_token = current_span.set(root)
+    
+    async def finish(error: Optional[str] = None):
+        if root is not None:
+            root.set("event_loop.max_lag_ms", event_loop_monitor.max_lag_since(started))
+            root.error = root.error or error
+            end_span(root)
+        if profiler:
+            try:
+                await asyncio.to_thread(profiler.stop)
+            finally:
+                active_profilers.discard(profiler)
+            await asyncio.to_thread(profiler.write, profile_path)
+            await asyncio.to_thread(prune_profiles, PROFILE_DIR, PROFILE_MAX_FILES)
+            logger.info("Profile of %s %s written to %s (%d samples)", request.method, request.url.path, profile_path, profiler.samples)
+    
+    if profiler:
+        # Named by the server: the request id comes from the client
+        profile_path = PROFILE_DIR / f"{uuid.uuid4().hex[:16]}.folded"
+    try:
+        response = await call_next(request)
+    except BaseException as e:
+        await finish(str(e) or type(e).__name__)
+        raise
+    finally:
+        current_span.reset(root_token)
+        request_id_var.reset(request_id_token)
+        session_id_var.reset(session_id_token)
+    response.headers["X-Request-ID"] = request_id
+    if root is not None:
+        root.set("http.response.status_code", response.status_code)
+    if profiler:
+        response.headers["X-Profile"] = profile_path.name
+    if root is None and profiler is None:
+        return response
+    
+    body = response.body_iterator
+    
+    async def body_then_finish():
+        error = None
+        try:
+            async for chunk in body:
+                yield chunk
+        except BaseException as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            await finish(error)
+    
+    response.body_iterator = body_then_finish()
+    return response
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+class TTSRequest(BaseModel):
+    text: str
+    voiceId: str
+    format: Optional[str] = None
+    sampleRate: Optional[int] = None
+    bitrate: Optional[str] = None
+
+class LLMRequest(BaseModel):
+    text: str
+
+class ConversationTextRequest(BaseModel):
+    text: str
+    session_id: Optional[str] = None
+    voiceId: Optional[str] = None
+    speak: bool = True
+    format: Optional[str] = None
 
 @app.get("/")
 def working():
     return {
         "message": "API working good",
         "services_status": services_status,
+        "providers": {name: health.snapshot()["state"] for name, health in provider_health.items()},
         "timestamp": datetime.now().isoformat()
     }
 
 @app.get("/health")
 def health_check():
     """Comprehensive health check endpoint"""
+    providers = {name: health.snapshot() for name, health in provider_health.items()}
+    states = [provider["state"] for provider in providers.values()]
+    if all(state == "unavailable" for state in states):
+        status = "unhealthy"
+    elif any(state in ("degraded", "down", "unavailable") for state in states):
+        status = "degraded"
+    else:
+        status = "healthy"
+    
     return {
-        "status": "healthy",
+        "status": status,
         "services": services_status,
+        "providers": providers,
         "uptime": datetime.now().isoformat(),
-        "fallback_available": True
+        "fallback_available": True,
+        "event_loop": event_loop_monitor.snapshot(),
+        "transcript_cache": transcript_cache.snapshot(),
+        "usage": usage_meter.snapshot(),
+        "startup": startup_metrics
     }
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness probe: 200 only once providers are initialized and fallback audio is pre-warmed"""
+    ready = all(readiness.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "starting",
+            "checks": readiness,
+            "services": services_status,
+            "startup": startup_metrics,
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+
+USAGE_METRICS = ("stt_seconds", "llm_input_tokens", "llm_output_tokens", "tts_characters", "calls", "errors",
+                 "retries", "fallback_calls", "cached_stt_seconds", "cached_tts_characters")
+
+async def flushed_usage_store():
+    if not usage_meter.db_path:
+        raise HTTPException(status_code=503, detail="Usage store is disabled (USAGE_DB_PATH is empty)")
+    await usage_meter.flush()
+
+@app.get("/usage/summary")
+async def usage_summary(since_hours: Optional[float] = Query(None, gt=0)):
+    """Provider usage totals, including what the transcript and TTS caches saved"""
+    await flushed_usage_store()
+    since = time.time() - since_hours * 3600 if since_hours else 0
+    rows = await asyncio.to_thread(usage_meter.query, """
+        SELECT provider, metric, SUM(value) FROM usage WHERE recorded_at >= ? GROUP BY provider, metric
+    """, (since,))
+    sessions, turns = (await asyncio.to_thread(usage_meter.query, """
+        SELECT COUNT(DISTINCT session_id), COUNT(DISTINCT CASE WHEN pipeline != 'background' THEN turn_key END)
+        FROM usage WHERE recorded_at >= ?
+    """, (since,)))[0]
+    return {"providers": usage_totals(rows), "sessions": sessions, "turns": turns, "since_hours": since_hours}
+
+@app.get("/usage/sessions")
+async def usage_top_sessions(metric: str = Query("tts_characters"), limit: int = Query(20, ge=1, le=500),
+                             since_hours: Optional[float] = Query(None, gt=0)):
+    """Sessions that consumed the most of one metric (e.g. stt_seconds, llm_output_tokens)"""
+    if metric not in USAGE_METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric: {metric} (expected one of {', '.join(USAGE_METRICS)})")
+    await flushed_usage_store()
+    since = time.time() - since_hours * 3600 if since_hours else 0
+    rows = await asyncio.to_thread(usage_meter.query, """
+        SELECT session_id, SUM(value) AS total, COUNT(DISTINCT CASE WHEN pipeline != 'background' THEN turn_key END),
+               MAX(recorded_at) FROM usage
+        WHERE metric = ? AND recorded_at >= ? AND session_id IS NOT NULL
+        GROUP BY session_id ORDER BY total DESC LIMIT ?
+    """, (metric, since, limit))
+    return {
+        "metric": metric,
+        "sessions": [
+            {"session_id": session_id, metric: round(total, 3), "turns": turns,
+             "last_activity": datetime.fromtimestamp(last).isoformat()}
+            for session_id, total, turns, last in rows
+        ]
+    }
 
+@app.get("/usage/sessions/{session_id}")
+async def usage_for_session(session_id: str, turns: int = Query(20, ge=0, le=500)):
+    """Usage totals of one session plus its most recent turns"""
+    await flushed_usage_store()
+    totals = await asyncio.to_thread(usage_meter.query, """
+        SELECT provider, metric, SUM(value) FROM usage WHERE session_id = ? GROUP BY provider, metric
+    """, (session_id,))
+    rows = await asyncio.to_thread(usage_meter.query, """
+        SELECT turn_key, turn_id, pipeline, recorded_at, provider, metric, value FROM usage
+        WHERE turn_key IN (
+            SELECT turn_key FROM usage WHERE session_id = ? GROUP BY turn_key ORDER BY MAX(recorded_at) DESC LIMIT ?
+        )
+        ORDER BY recorded_at DESC
+    """, (session_id, turns))
+    recent = {}
+    for turn_key, turn_id, pipeline, recorded_at, provider, metric, value in rows:
+        turn = recent.setdefault(turn_key, {
+            "turn_id": turn_id,
+            "pipeline": pipeline,
+            "recorded_at": datetime.fromtimestamp(recorded_at).isoformat(),
+            "usage": {}
+        })
+        turn["usage"].setdefault(provider, {})[metric] = round(value, 3)
+    return {"session_id": session_id, "totals": usage_totals(totals), "turns": list(recent.values())}
 
 @app.get("/generate-fallback-audio/{message}")
 async def generate_fallback_audio_endpoint(message: str):
     """Generate and return fallback audio file for a specific message"""
     try:
-        logger.info(f"Generating fallback audio for message: {message}")
+        logger.info("Generating fallback audio for message: %s", payload(message))
         
         audio_url = await generate_fallback_audio_url(message)
         
@@ -452,22 +2521,24 @@ async def generate_fallback_audio_endpoint(message: str):
             "timestamp": datetime.now().isoformat()
         }
 
+@app.api_route("/fallback-audio/{filename}", methods=["GET", "HEAD"])
+async def serve_fallback_audio(filename: str, request: Request):
+    """Stream a fallback audio file with long-lived caching for content-hashed names"""
+    return cached_audio_response(request, fallback_manifest, filename)
+
+@app.api_route("/tts-audio/{filename}", methods=["GET", "HEAD"])
+async def serve_tts_audio(filename: str, request: Request):
+    """Stream a cached (transcoded) TTS audio variant"""
+    return cached_audio_response(request, tts_manifest, filename)
+
 @app.get("/download-fallback-audio/{filename}")
-async def download_fallback_audio(filename: str):
+async def download_fallback_audio(filename: str, request: Request):
     """Download a specific fallback audio file"""
     try:
-        file_path = fallback_audio_dir / filename
-        
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="Fallback audio file not found")
-        
-        return FileResponse(
-            path=str(file_path),
-            media_type="audio/mpeg",
-            filename=filename,
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        return cached_audio_response(request, fallback_manifest, filename, download=True)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to download fallback audio: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -476,18 +2547,7 @@ async def download_fallback_audio(filename: str):
 async def list_fallback_audio():
     """List all available fallback audio files"""
     try:
-        audio_files = []
-        
-        if fallback_audio_dir.exists():
-            for file_path in fallback_audio_dir.glob("*.mp3"):
-                file_stats = file_path.stat()
-                audio_files.append({
-                    "filename": file_path.name,
-                    "size": file_stats.st_size,
-                    "created": datetime.fromtimestamp(file_stats.st_ctime).isoformat(),
-                    "download_url": f"http://localhost:8000/download-fallback-audio/{file_path.name}",
-                    "play_url": f"http://localhost:8000/fallback-audio/{file_path.name}"
-                })
+        audio_files = fallback_manifest.listing()
         
         return {
             "status": "success",
@@ -507,55 +2567,899 @@ async def list_fallback_audio():
 
 
 
-@app.post("/generate-audio")
-async def generate_audio(req: TTSRequest):
-    """Generate audio with comprehensive error handling"""
-    try:
-        logger.info(f"Generating audio for text: {req.text[:50]}...")
-        
-        if not req.text or req.text.strip() == "":
-            raise HTTPException(status_code=400, detail="Text cannot be empty")
-        
-        tts_result = await safe_tts_generate(req.text, req.voiceId)
-        
-        if tts_result["success"]:
+def rate_limit_setting(budget: str, per_minute: str, burst: str) -> tuple:
+    """(capacity, refill per second) for a budget, overridable via RATE_LIMIT_<BUDGET>_PER_MINUTE / _BURST"""
+    prefix = f"RATE_LIMIT_{budget.upper()}"
+    per_minute_value = float(os.getenv(f"{prefix}_PER_MINUTE", per_minute))
+    return float(os.getenv(f"{prefix}_BURST", burst)), per_minute_value / 60
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMITS = {
+    "requests": rate_limit_setting("requests", "30", "10"),
+    "stt_seconds": rate_limit_setting("stt_seconds", "300", "600"),
+    "llm_calls": rate_limit_setting("llm_calls", "20", "10"),
+    "tts_characters": rate_limit_setting("tts_characters", "6000", "6000")
+}
+RATE_LIMIT_TRUST_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+
+class TokenBucket:
+    """Classic token bucket; post-hoc charges may drive it negative (debt is repaid by refill)"""
+    __slots__ = ("capacity", "refill_rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def retry_after(self, amount: float) -> float:
+        """Seconds until `amount` tokens (at least a non-negative balance) are available, 0 if now"""
+        self.refill()
+        needed = amount - self.tokens
+        if needed <= 0:
+            return 0.0
+        if self.refill_rate <= 0:
+            return float("inf")
+        return needed / self.refill_rate
+
+    def charge(self, amount: float):
+        self.refill()
+        self.tokens -= amount
+
+class RateLimiter:
+    """Token buckets per (budget, key), kept in process memory next to chat_sessions"""
+
+    def __init__(self, limits: dict):
+        self.limits = limits
+        self.buckets = {}
+        self.operations = 0
+
+    def bucket(self, budget: str, key: str) -> TokenBucket:
+        bucket = self.buckets.get((budget, key))
+        if bucket is None:
+            bucket = self.buckets[(budget, key)] = TokenBucket(*self.limits[budget])
+        return bucket
+
+    def acquire(self, keys: list, amounts: dict):
+        """Take each budget's amount from every key's bucket, or raise 429 without taking anything"""
+        self.maybe_prune()
+        charges = []
+        for budget, amount in amounts.items():
+            capacity, refill_rate = self.limits[budget]
+            if capacity <= 0 and refill_rate <= 0:
+                continue
+            buckets = [self.bucket(budget, key) for key in keys]
+            retry_after = max(bucket.retry_after(min(amount, capacity)) for bucket in buckets)
+            if retry_after > 0:
+                logger.warning("Rate limit exceeded for %s (%s), retry after %.1fs", budget, ", ".join(keys), retry_after)
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"Rate limit exceeded for {budget}",
+                    headers={"Retry-After": str(max(1, math.ceil(min(retry_after, 3600))))}
+                )
+            charges.extend((bucket, amount) for bucket in buckets)
+        for bucket, amount in charges:
+            bucket.charge(amount)
+
+    def charge(self, keys: list, budget: str, amount: float):
+        for key in keys:
+            self.bucket(budget, key).charge(amount)
+
+    def maybe_prune(self):
+        """Drop buckets that have refilled completely so idle clients don't accumulate"""
+        self.operations += 1
+        if self.operations % 1000:
+            return
+        for bucket_key, bucket in list(self.buckets.items()):
+            bucket.refill()
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[bucket_key]
+
+rate_limiter = RateLimiter(RATE_LIMITS)
+
+def rate_limit_keys(request: Optional[Request], session_id: Optional[str] = None) -> list:
+    """Identity key (API key or session) plus the client IP, so rotating sessions doesn't escape the limit"""
+    keys = []
+    if request is not None:
+        api_key = request.headers.get("x-api-key")
+        if api_key:
+            keys.append(f"key:{hashlib.sha256(api_key.encode()).hexdigest()[:16]}")
+    if not keys and session_id:
+        keys.append(f"session:{session_id}")
+    if request is not None:
+        forwarded_for = request.headers.get("x-forwarded-for") if RATE_LIMIT_TRUST_FORWARDED_FOR else None
+        client_ip = forwarded_for.split(",")[0].strip() if forwarded_for else (request.client.host if request.client else None)
+        if client_ip:
+            keys.append(f"ip:{client_ip}")
+    return keys
+
+STT_STAGE_TIMEOUT = float(os.getenv("STT_STAGE_TIMEOUT", "90"))
+UPLOAD_STT_TIMEOUT = float(os.getenv("UPLOAD_STT_TIMEOUT", "3600"))
+LLM_STAGE_TIMEOUT = float(os.getenv("LLM_STAGE_TIMEOUT", "45"))
+TTS_STAGE_TIMEOUT = float(os.getenv("TTS_STAGE_TIMEOUT", "45"))
+FALLBACK_PREFETCH_TIMEOUT = float(os.getenv("FALLBACK_PREFETCH_TIMEOUT", "1"))
+DEFAULT_VOICE_ID = "en-US-marcus"
+FALLBACK_TTS_MESSAGE = "I'm having trouble connecting right now"
+
+class StageFailure(Exception):
+    """Raised by a stage to end the turn with the pipeline's failure response"""
+
+    def __init__(self, kind: str, error: str):
+        super().__init__(error)
+        self.kind = kind
+        self.error = error
+
+class Stage:
+    """A named pipeline step with an optional timeout and timeout handler"""
+    __slots__ = ("name", "func", "timeout", "on_timeout")
+
+    def __init__(self, name: str, func, timeout: Optional[float] = None, on_timeout=None):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+
+class TurnContext:
+    """State shared by the stages of one pipeline run"""
+
+    def __init__(self, request: Optional[Request] = None, file: Optional[UploadFile] = None,
+                 session_id: Optional[str] = None, voice_id: str = DEFAULT_VOICE_ID):
+        self.request = request
+        self.file = file
+        self.filename = getattr(file, "filename", None)
+        self.session_id = session_id
+        self.voice_id = voice_id
+        self.turn = None
+        self.output_format = None
+        self.upload = None
+        self.audio_data = None
+        self.audio_key = None
+        self.transcription = None
+        self.user_text = None
+        self.session = None
+        self.prompt = None
+        self.reply_text = None
+        self.llm_tier = LLM_DEFAULT_TIER
+        self.llm_success = None
+        self.llm_error = None
+        self.tts_result = None
+        self.audio_url = None
+        self.fallback_audio = None
+        self.acknowledged = None
+        self.events = None
+        self.speak = True
+        self.timings = {}
+        self.undo = []
+        self.rate_keys = None
+        self.prepaid = {}
+        self.usage = None
+
+    @property
+    def status(self) -> str:
+        if self.llm_success is False or (self.tts_result is not None and not self.tts_result["success"]):
+            return "partial_success"
+        return "success"
+
+pipeline_hooks = []
+
+def add_pipeline_hook(hook):
+    """Register hook(event, stage_name, ctx, elapsed_ms, error), called around every stage"""
+    pipeline_hooks.append(hook)
+
+def emit_pipeline_event(event: str, stage_name: str, ctx: TurnContext, elapsed_ms: Optional[float] = None, error: Optional[str] = None):
+    for hook in pipeline_hooks:
+        try:
+            hook(event, stage_name, ctx, elapsed_ms, error)
+        except Exception as e:
+            logger.error("Pipeline hook failed: %s", e)
+
+class TurnPipeline:
+    """Runs declared stages in order; a tuple of stages runs concurrently"""
+
+    def __init__(self, name: str, steps: list, respond, on_failure):
+        self.name = name
+        self.steps = steps
+        self.respond = respond
+        self.on_failure = on_failure
+
+    async def run(self, ctx: TurnContext) -> dict:
+        """Run the turn and attach the provider usage it caused to the response"""
+        ctx.usage = TurnUsage(self.name, ctx.session_id)
+        usage_token = active_usage.set(ctx.usage)
+        try:
+            response = await self.execute(ctx)
+        finally:
+            active_usage.reset(usage_token)
+            usage_meter.finish(ctx.usage, ctx.turn.turn_id if ctx.turn else None)
+        if isinstance(response, dict):
+            response["usage"] = ctx.usage.summary()
+        return response
+
+    async def execute(self, ctx: TurnContext) -> dict:
+        try:
+            for step in self.steps:
+                if isinstance(step, Stage):
+                    await self.run_stage(step, ctx)
+                else:
+                    await self.run_concurrently(step, ctx)
+            logger.info("%s completed with status %s in %s", self.name, ctx.status, ctx.timings, extra=SAMPLED)
+            return self.respond(ctx)
+            
+        except StageFailure as failure:
+            logger.warning("%s failed (%s): %s", self.name, failure.kind, failure.error)
+            return await self.on_failure(ctx, failure.kind, failure.error)
+        except TurnSuperseded:
+            self.roll_back(ctx)
+            logger.info("Turn %d of session %s was interrupted, discarding its reply", ctx.turn.turn_id, ctx.session_id)
             return {
-                "status": "success",
-                "audio": {
-                    "audioFile": tts_result["audio_url"]
-                },
-                "text": req.text,
-                "voice_id": req.voiceId
+                "status": "interrupted",
+                "session_id": ctx.session_id,
+                "turn_id": ctx.turn.turn_id,
+                "timestamp": datetime.now().isoformat()
             }
+        except asyncio.CancelledError:
+            # The client went away (closed stream or socket) mid-turn: same as an interrupt
+            self.roll_back(ctx)
+            raise
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error("Unexpected error in %s: %s", self.name, e)
+            return await self.on_failure(ctx, "general_error", str(e))
+        finally:
+            if ctx.turn is not None:
+                turn_tracker.finish(ctx.turn)
+
+    @staticmethod
+    def roll_back(ctx: TurnContext):
+        """Remove what an unfinished turn wrote to the session, newest first"""
+        while ctx.undo:
+            ctx.undo.pop()()
+
+    async def run_concurrently(self, stages: tuple, ctx: TurnContext):
+        tasks = [asyncio.ensure_future(self.run_stage(stage, ctx)) for stage in stages]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def run_stage(self, stage: Stage, ctx: TurnContext):
+        emit_pipeline_event("start", stage.name, ctx)
+        started = time.perf_counter()
+        error = None
+        try:
+            with span(f"stage.{stage.name}", pipeline=self.name, **{"session.id": ctx.session_id}):
+                work = stage.func(ctx)
+                if ctx.turn is not None:
+                    work = ctx.turn.run(work)
+                if stage.timeout:
+                    await asyncio.wait_for(work, stage.timeout)
+                else:
+                    await work
+        except asyncio.TimeoutError:
+            error = f"{stage.name} timed out after {stage.timeout:g}s"
+            logger.warning("%s stage timed out after %.1fs", stage.name, stage.timeout)
+            if stage.on_timeout is None:
+                raise StageFailure("general_error", error)
+            await stage.on_timeout(ctx, error)
+        except BaseException as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            ctx.timings[stage.name] = round(elapsed_ms, 1)
+            emit_pipeline_event("end", stage.name, ctx, elapsed_ms, error)
+
+def get_or_create_session(session_id: str) -> dict:
+    if session_id not in chat_sessions:
+        messages = chat_log.load(session_id) if chat_log else []
+        now = time.time()
+        chat_sessions[session_id] = {
+            "id": session_id,
+            "messages": messages,
+            "next_message_id": messages[-1].id + 1 if messages else 1,
+            "created_at": messages[0].timestamp if messages else now,
+            "last_activity": messages[-1].timestamp if messages else now
+        }
+        for message in messages:
+            chat_search_index.add(session_id, message)
+        if messages:
+            logger.info("Restored chat session %s with %d messages from its log", session_id, len(messages))
         else:
-            logger.warning(f"TTS failed, using fallback: {tts_result['error']}")
-            fallback_message = "I'm having trouble connecting right now"
-            fallback_audio = await generate_fallback_audio_url(fallback_message)
-            return {
-                "status": "fallback",
-                "audio": {
-                    "audioFile": fallback_audio
-                },
-                "text": req.text,
-                "voice_id": req.voiceId,
-                "error": tts_result["error"],
-                "fallback_message": fallback_message
-            }
+            logger.info("Created new chat session: %s", session_id)
+    return chat_sessions[session_id]
+
+def append_session_message(session: dict, role: str, content: str) -> ChatMessage:
+    message = ChatMessage(session["next_message_id"], role, content, time.time())
+    session["next_message_id"] += 1
+    session["messages"].append(message)
+    session["last_activity"] = message.timestamp
+    chat_search_index.add(session["id"], message)
+    if chat_log:
+        chat_log.append(session["id"], message)
+    return message
+
+def remove_session_message(session: dict, message: ChatMessage):
+    session["messages"].remove(message)
+    chat_search_index.remove(session["id"], message)
+    if chat_log:
+        chat_log.delete(session["id"], message)
+
+def restore_chat_sessions():
+    """Load every logged session at startup so history and search cover them"""
+    for session_id in chat_log.session_ids():
+        get_or_create_session(session_id)
+
+def find_session_message(session: dict, message_id: int) -> Optional[ChatMessage]:
+    messages = session["messages"]
+    index = bisect.bisect_left(messages, message_id, key=lambda message: message.id)
+    return messages[index] if index < len(messages) and messages[index].id == message_id else None
+
+def session_message_page(session: dict, before: Optional[int], limit: int) -> tuple:
+    """The newest `limit` messages older than message id `before`, plus the cursor of the next older page"""
+    messages = session["messages"]
+    end = len(messages) if before is None else bisect.bisect_left(messages, before, key=lambda message: message.id)
+    start = max(0, end - limit)
+    page = messages[start:end]
+    return page, (page[0].id if start > 0 else None)
+
+def build_conversation_prompt(session: dict) -> str:
+    context_messages = []
+    for msg in session["messages"][-10:]:
+        context_messages.append(f"{msg.role.title()}: {msg.content}")
+    
+    conversation_context = "\n".join(context_messages)
+    
+    return f"""You are a helpful AI assistant having a natural conversation. 
+        
+Previous conversation:
+{conversation_context}
+
+Please respond naturally and conversationally to the user's latest message. Keep your response concise but helpful."""
+
+REASONING_PATTERN = re.compile(
+    r"\b(why|how (do|does|did|can|could|would|should)|explain|compare|difference|analy[sz]e|plan|step by step|"
+    r"calculate|solve|write|code|summari[sz]e|recommend|pros and cons|what if|translate|story)\b", re.IGNORECASE)
+CHIT_CHAT_PATTERN = re.compile(
+    r"^\W*(hi|hello|hey|thanks|thank you|ok(ay)?|yes|yeah|no|nope|cool|great|nice|bye|goodbye|good (morning|night)|"
+    r"how are you|what'?s up)\b", re.IGNORECASE)
+FOLLOW_UP_PATTERN = re.compile(r"^\W*(and|but|so|go on|continue|more|tell me more|what about|then)\b", re.IGNORECASE)
+LLM_FAST_MAX_WORDS = int(os.getenv("LLM_FAST_MAX_WORDS", "12"))
+
+def classify_turn(user_text: str, session: Optional[dict]) -> str:
+    """Pick the LLM tier for a turn from cheap local signals: length, intent keywords and session state"""
+    if not LLM_TIERING_ENABLED or not user_text:
+        return LLM_DEFAULT_TIER
+    words = len(user_text.split())
+    if REASONING_PATTERN.search(user_text):
+        return "strong"
+    # A terse follow-up to an answer that needed the strong model continues that line of reasoning
+    if session and session.get("last_llm_tier") == "strong" and FOLLOW_UP_PATTERN.search(user_text):
+        return "strong"
+    if CHIT_CHAT_PATTERN.search(user_text) and words <= LLM_FAST_MAX_WORDS * 2:
+        return "fast"
+    return "fast" if words <= LLM_FAST_MAX_WORDS else "strong"
+
+def rate_limit_stage(*budgets: str) -> Stage:
+    """Stage that admits the turn against the given budgets before any provider is called"""
+    async def enforce_rate_limits(ctx: TurnContext):
+        if not RATE_LIMIT_ENABLED:
+            return
+        ctx.rate_keys = rate_limit_keys(ctx.request, ctx.session_id)
+        for budget in budgets:
+            if budget in ("requests", "llm_calls"):
+                ctx.prepaid[budget] = 1
+            elif budget == "tts_characters" and ctx.reply_text:
+                ctx.prepaid[budget] = len(ctx.reply_text)
+            else:
+                ctx.prepaid[budget] = 0
+        rate_limiter.acquire(ctx.rate_keys, ctx.prepaid)
+    return Stage("rate_limit", enforce_rate_limits)
+
+def charge_rate_limit(ctx: TurnContext, budget: str, amount: float):
+    """Charge actual usage that wasn't known when the turn was admitted"""
+    if ctx.rate_keys:
+        amount -= ctx.prepaid.pop(budget, 0)
+        if amount > 0:
+            rate_limiter.charge(ctx.rate_keys, budget, amount)
+
+async def stage_read_upload(ctx: TurnContext):
+    if not ctx.filename:
+        raise HTTPException(status_code=400, detail="No file provided")
+    
+    ctx.audio_data = await ctx.file.read()
+    logger.info("Audio data size: %d bytes", len(ctx.audio_data), extra=SAMPLED)
+    
+    if len(ctx.audio_data) == 0:
+        raise HTTPException(status_code=400, detail="Empty audio file")
+
+async def stage_transcribe(ctx: TurnContext):
+    ctx.transcription = await safe_transcribe(ctx.audio_data, cache_key=ctx.audio_key)
+    
+    if not ctx.transcription["success"]:
+        raise StageFailure("stt_error", ctx.transcription["error"])
+    
+    ctx.user_text = ctx.transcription["text"]
+    if not ctx.transcription.get("cached"):
+        charge_rate_limit(ctx, "stt_seconds", ctx.transcription.get("duration") or 0)
+    logger.info("User query: %s", payload(ctx.user_text), extra=SAMPLED)
+
+async def transcribe_timed_out(ctx: TurnContext, error: str):
+    raise StageFailure("stt_error", error)
+
+async def stage_require_speech(ctx: TurnContext):
+    if not ctx.user_text or ctx.user_text.strip() == "":
+        raise StageFailure("no_speech", "No speech detected in the audio")
+
+async def stage_acknowledge(ctx: TurnContext):
+    """Answer the client with an acknowledgement clip now; the pipeline keeps going for the real reply"""
+    if ctx.acknowledged is not None and not ctx.acknowledged.done():
+        ctx.acknowledged.set_result(acknowledgement_response(ctx))
+
+async def stage_open_session(ctx: TurnContext):
+    ctx.session = get_or_create_session(ctx.session_id)
+    message = append_session_message(ctx.session, "user", ctx.user_text)
+    # An interrupted turn leaves no trace in history: neither the reply nor the utterance it answered
+    ctx.undo.append(lambda: remove_session_message(ctx.session, message))
+
+async def stage_build_prompt(ctx: TurnContext):
+    ctx.prompt = build_conversation_prompt(ctx.session) if ctx.session is not None else ctx.user_text
+
+def route_llm_tier(ctx: TurnContext):
+    ctx.llm_tier = classify_turn(ctx.user_text, ctx.session)
+    if ctx.session is not None:
+        ctx.session["last_llm_tier"] = ctx.llm_tier
+
+async def stage_generate_reply(ctx: TurnContext):
+    route_llm_tier(ctx)
+    llm_result = await safe_llm_generate(ctx.prompt, tier=ctx.llm_tier)
+    
+    if llm_result["success"]:
+        ctx.reply_text = llm_result["text"]
+        ctx.llm_success = True
+    else:
+        ctx.reply_text = llm_result["fallback_response"]
+        ctx.llm_success = False
+        ctx.llm_error = llm_result["error"]
+    
+    logger.info("AI response: %s", payload(ctx.reply_text), extra=SAMPLED)
+
+async def generate_reply_timed_out(ctx: TurnContext, error: str):
+    ctx.reply_text = FALLBACK_RESPONSES["llm_error"]
+    ctx.llm_success = False
+    ctx.llm_error = error
+
+def publish_event(ctx: TurnContext, event: dict):
+    """Push an incremental event to a streaming client, if the turn has one"""
+    if ctx.events is not None:
+        ctx.events.put_nowait(event)
+
+SENTENCE_BOUNDARY = re.compile(r"[.!?…]+[\"')\]]*\s+")
+TTS_CHUNK_MIN_CHARS = int(os.getenv("TTS_CHUNK_MIN_CHARS", "40"))
+
+class SentenceSynthesizer:
+    """Starts TTS for every complete sentence of a streaming reply and publishes the clips in order
+
+    Short sentences are merged until a chunk has TTS_CHUNK_MIN_CHARS, so the first clip is
+    ready early without flooding Murf with one-word requests.
+    """
+
+    def __init__(self, ctx: TurnContext, started: float):
+        self.ctx = ctx
+        self.started = started
+        self.buffer = ""
+        self.clips = []
+        self.publisher = None
+
+    def feed(self, text: str):
+        self.buffer += text
+        while True:
+            boundary = next((m for m in SENTENCE_BOUNDARY.finditer(self.buffer) if m.end() >= TTS_CHUNK_MIN_CHARS), None)
+            if boundary is None:
+                return
+            self.start(self.buffer[:boundary.end()].strip())
+            self.buffer = self.buffer[boundary.end():]
+
+    def start(self, text: str):
+        charge_rate_limit(self.ctx, "tts_characters", len(text))
+        task = asyncio.ensure_future(safe_tts_generate(text, self.ctx.voice_id, audio_format=self.ctx.output_format))
+        self.clips.append(task)
+        self.publisher = asyncio.ensure_future(self.publish(len(self.clips) - 1, text, task, self.publisher))
+
+    async def publish(self, index: int, text: str, task: asyncio.Task, previous: Optional[asyncio.Task]) -> dict:
+        result = await task
+        if previous is not None:
+            await previous
+        if index == 0:
+            self.ctx.timings["first_audio"] = round((time.perf_counter() - self.started) * 1000, 1)
+        publish_event(self.ctx, {
+            "type": "audio",
+            "index": index,
+            "text": text,
+            "audio_url": result["audio_url"] if result["success"] else None,
+            "format": result.get("format")
+        })
+        return result
+
+    async def finish(self) -> list:
+        if self.buffer.strip():
+            self.start(self.buffer.strip())
+            self.buffer = ""
+        if self.publisher is not None:
+            await self.publisher
+        return [task.result() for task in self.clips]
+
+    def cancel(self):
+        for task in self.clips + ([self.publisher] if self.publisher else []):
+            task.cancel()
+
+async def stage_stream_reply(ctx: TurnContext):
+    """Generate the reply as a stream: text deltas go to the client and complete sentences to TTS"""
+    started = time.perf_counter()
+    route_llm_tier(ctx)
+    publish_event(ctx, {"type": "transcript", "text": ctx.user_text, "session_id": ctx.session_id,
+                        "turn_id": ctx.turn.turn_id if ctx.turn else None})
+    
+    synthesizer = SentenceSynthesizer(ctx, started) if ctx.speak else None
+    parts = []
+    try:
+        async for event in safe_llm_stream(ctx.prompt, tier=ctx.llm_tier):
+            if event["type"] == "delta":
+                if not parts:
+                    ctx.timings["first_token"] = round((time.perf_counter() - started) * 1000, 1)
+                parts.append(event["text"])
+                ctx.reply_text = "".join(parts)
+                publish_event(ctx, event)
+                if synthesizer is not None:
+                    synthesizer.feed(event["text"])
+                continue
             
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error in generate_audio: {e}")
+            ctx.reply_text = event["text"]
+            ctx.llm_success = event["success"]
+            ctx.llm_error = event.get("error")
+            if not parts and synthesizer is not None:
+                # Nothing was streamed (provider down): speak the fallback reply instead
+                synthesizer.feed(ctx.reply_text)
+        
+        if synthesizer is None:
+            ctx.tts_result = {"success": True, "skipped": True, "format": None}
+            return
+        clips = await synthesizer.finish()
+        ctx.tts_result = {
+            "success": all(clip["success"] for clip in clips),
+            "format": (ctx.output_format or {}).get("format", "mp3"),
+            "clips": [clip.get("audio_url") for clip in clips]
+        }
+        ctx.audio_url = next((url for url in ctx.tts_result["clips"] if url), None)
+    finally:
+        if synthesizer is not None:
+            synthesizer.cancel()
+
+async def stream_reply_timed_out(ctx: TurnContext, error: str):
+    if not ctx.reply_text:
+        ctx.reply_text = FALLBACK_RESPONSES["llm_error"]
+    ctx.llm_success = False
+    ctx.llm_error = error
+    ctx.tts_result = {"success": False, "error": error}
+
+async def stage_echo_transcript(ctx: TurnContext):
+    ctx.reply_text = ctx.user_text
+
+async def stage_accept_text(ctx: TurnContext):
+    """Use a transcript produced on the client in place of upload + STT"""
+    ctx.user_text = (ctx.user_text or "").strip()
+    if not ctx.user_text:
+        raise StageFailure("no_speech", "Empty text message")
+    ctx.transcription = {"success": True, "text": ctx.user_text, "duration": None, "confidence": None, "source": "client"}
+    logger.info("User text: %s", payload(ctx.user_text), extra=SAMPLED)
+
+async def stage_begin_turn(ctx: TurnContext):
+    """Supersede the session's in-flight turn (barge-in)
+
+    Placed after admission and, for voice turns, after speech is confirmed, so a request
+    that is rejected or carries no speech leaves the reply in progress alone.
+    """
+    if ctx.session_id:
+        ctx.turn = turn_tracker.begin(ctx.session_id)
+
+async def stage_synthesize(ctx: TurnContext):
+    if not ctx.speak:
+        ctx.tts_result = {"success": True, "skipped": True, "format": None}
+        return
+    charge_rate_limit(ctx, "tts_characters", len(ctx.reply_text))
+    ctx.tts_result = await safe_tts_generate(ctx.reply_text, ctx.voice_id, audio_format=ctx.output_format)
+    
+    if ctx.tts_result["success"]:
+        ctx.audio_url = ctx.tts_result["audio_url"]
+    else:
+        logger.info("TTS failed, using fallback audio")
+        ctx.audio_url = ctx.tts_result.get("fallback_audio") or await generate_fallback_audio_url(FALLBACK_TTS_MESSAGE)
+
+async def synthesize_timed_out(ctx: TurnContext, error: str):
+    ctx.tts_result = {"success": False, "error": error}
+    ctx.audio_url = ctx.fallback_audio or create_web_speech_fallback(FALLBACK_TTS_MESSAGE)
+
+async def stage_persist_reply(ctx: TurnContext):
+    message = append_session_message(ctx.session, "assistant", ctx.reply_text)
+    ctx.undo.append(lambda: remove_session_message(ctx.session, message))
+
+async def stage_prefetch_fallback(ctx: TurnContext):
+    ctx.fallback_audio = await generate_fallback_audio_url(FALLBACK_TTS_MESSAGE)
+
+async def prefetch_timed_out(ctx: TurnContext, error: str):
+    pass
+
+READ_UPLOAD = Stage("read_upload", stage_read_upload)
+ACCEPT_TEXT = Stage("accept_text", stage_accept_text)
+BEGIN_TURN = Stage("begin_turn", stage_begin_turn)
+STREAM_REPLY = Stage("stream_reply", stage_stream_reply, LLM_STAGE_TIMEOUT + TTS_STAGE_TIMEOUT, stream_reply_timed_out)
+TRANSCRIBE = Stage("transcribe", stage_transcribe, STT_STAGE_TIMEOUT, transcribe_timed_out)
+REQUIRE_SPEECH = Stage("require_speech", stage_require_speech)
+ACKNOWLEDGE = Stage("acknowledge", stage_acknowledge)
+OPEN_SESSION = Stage("open_session", stage_open_session)
+BUILD_PROMPT = Stage("build_prompt", stage_build_prompt)
+GENERATE_REPLY = Stage("generate_reply", stage_generate_reply, LLM_STAGE_TIMEOUT, generate_reply_timed_out)
+ECHO_TRANSCRIPT = Stage("echo_transcript", stage_echo_transcript)
+SYNTHESIZE = Stage("synthesize", stage_synthesize, TTS_STAGE_TIMEOUT, synthesize_timed_out)
+PERSIST_REPLY = Stage("persist_reply", stage_persist_reply)
+PREFETCH_FALLBACK = Stage("prefetch_fallback", stage_prefetch_fallback, FALLBACK_PREFETCH_TIMEOUT, prefetch_timed_out)
+
+async def error_response(ctx: TurnContext, kind: str, error: str) -> dict:
+    return {
+        "error": error,
+        "status": "error"
+    }
+
+def transcription_response(ctx: TurnContext) -> dict:
+    return {
+        "transcript": ctx.user_text,
+        "status": "completed",
+        "filename": ctx.filename,
+        "audio_duration": ctx.transcription.get("duration"),
+        "confidence": ctx.transcription.get("confidence"),
+        "words_count": len(ctx.user_text.split()) if ctx.user_text else 0
+    }
+
+def echo_response(ctx: TurnContext) -> dict:
+    return {
+        "status": ctx.status,
+        "original_filename": ctx.filename,
+        "transcribed_text": ctx.user_text,
+        "audio_url": ctx.audio_url,
+        "voice_id": ctx.voice_id,
+        "audio_duration": ctx.transcription.get("duration"),
+        "words_count": len(ctx.user_text.split()) if ctx.user_text else 0
+    }
+
+def llm_query_response(ctx: TurnContext) -> dict:
+    response_data = {
+        "status": ctx.status,
+        "original_filename": ctx.filename,
+        "user_query": ctx.user_text,
+        "llm_response": ctx.reply_text,
+        "audioFile": ctx.audio_url,
+        "audio_format": ctx.tts_result.get("format", "mp3"),
+        "voice_id": ctx.voice_id,
+        "model": LLM_TIERS[ctx.llm_tier]["model"],
+        "model_tier": ctx.llm_tier,
+        "audio_duration": ctx.transcription.get("duration"),
+        "timestamp": datetime.now().isoformat(),
+        "service_status": {
+            "transcription": ctx.transcription["success"],
+            "llm": ctx.llm_success,
+            "tts": ctx.tts_result["success"]
+        }
+    }
+    
+    if not ctx.llm_success:
+        response_data["llm_error"] = ctx.llm_error
+        response_data["fallback_message"] = FALLBACK_RESPONSES["llm_error"]
+    
+    if not ctx.tts_result["success"]:
+        response_data["tts_error"] = ctx.tts_result["error"]
+        response_data["tts_fallback_message"] = FALLBACK_RESPONSES["tts_error"]
+    
+    return response_data
+
+async def llm_query_error_response(ctx: TurnContext, kind: str, error: str) -> dict:
+    fallback_message = FALLBACK_TTS_MESSAGE if kind != "general_error" else FALLBACK_RESPONSES["general_error"]
+    fallback_audio = await generate_fallback_audio_url(fallback_message)
+    return {
+        "status": "error",
+        "error": error,
+        "fallback_message": fallback_message,
+        "audioFile": fallback_audio,
+        "original_filename": ctx.filename,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def agent_response(ctx: TurnContext) -> dict:
+    return {
+        "status": ctx.status,
+        "session_id": ctx.session_id,
+        "turn_id": ctx.turn.turn_id,
+        "original_filename": ctx.filename,
+        "user_message": ctx.user_text,
+        "ai_response": ctx.reply_text,
+        "audioFile": ctx.audio_url,
+        "voice_id": ctx.voice_id,
+        "model": LLM_TIERS[ctx.llm_tier]["model"],
+        "model_tier": ctx.llm_tier,
+        "audio_duration": ctx.transcription.get("duration"),
+        "message_count": len(ctx.session["messages"]),
+        "timestamp": datetime.now().isoformat()
+    }
+
+def acknowledgement_response(ctx: TurnContext) -> dict:
+    ack_text, ack_audio = choose_acknowledgement()
+    return {
+        "status": "pending",
+        "session_id": ctx.session_id,
+        "turn_id": ctx.turn.turn_id,
+        "user_query": ctx.user_text,
+        "ack_text": ack_text,
+        "ack_audio": ack_audio,
+        "result_url": f"/conversation/{ctx.session_id}/turns/{ctx.turn.turn_id}/result",
+        "stage_timings_ms": dict(ctx.timings),
+        "timestamp": datetime.now().isoformat()
+    }
+
+def conversation_response(ctx: TurnContext) -> dict:
+    return {
+        "status": ctx.status,
+        "session_id": ctx.session_id,
+        "turn_id": ctx.turn.turn_id,
+        "user_query": ctx.user_text,
+        "ai_response": ctx.reply_text,
+        "audioFile": ctx.audio_url,
+        "audio_format": ctx.tts_result.get("format", "mp3"),
+        "voice_id": ctx.voice_id,
+        "model": LLM_TIERS[ctx.llm_tier]["model"],
+        "model_tier": ctx.llm_tier,
+        "message_count": len(ctx.session["messages"]),
+        "audio_duration": ctx.transcription.get("duration"),
+        "timestamp": datetime.now().isoformat(),
+        "stage_timings_ms": ctx.timings,
+        "service_status": {
+            "transcription": ctx.transcription["success"],
+            "llm": ctx.llm_success,
+            "tts": ctx.tts_result["success"]
+        }
+    }
+
+CONVERSATION_FALLBACK_MESSAGES = {
+    "stt_error": FALLBACK_RESPONSES["stt_error"],
+    "no_speech": "I didn't catch that. Could you please repeat?",
+    "general_error": FALLBACK_RESPONSES["general_error"]
+}
+
+async def conversation_error_response(ctx: TurnContext, kind: str, error: str) -> dict:
+    fallback_message = CONVERSATION_FALLBACK_MESSAGES.get(kind, FALLBACK_RESPONSES["general_error"])
+    fallback_audio = await generate_fallback_audio_url(fallback_message)
+    return {
+        "status": "error",
+        "error": error,
+        "ai_response": fallback_message,
+        "audioFile": fallback_audio,
+        "session_id": ctx.session_id,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def generate_audio_response(ctx: TurnContext) -> dict:
+    if ctx.tts_result["success"]:
         return {
-            "status": "error",
-            "error": str(e),
-            "fallback_message": FALLBACK_RESPONSES["general_error"]
+            "status": "success",
+            "audio": {
+                "audioFile": ctx.tts_result["audio_url"],
+                "format": ctx.tts_result["format"],
+                "mediaType": ctx.tts_result["media_type"],
+                "sampleRate": ctx.tts_result["sample_rate"],
+                "bitrate": ctx.tts_result["bitrate"]
+            },
+            "text": ctx.reply_text,
+            "voice_id": ctx.voice_id
         }
+    
+    logger.warning("TTS failed, using fallback: %s", ctx.tts_result["error"])
+    return {
+        "status": "fallback",
+        "audio": {
+            "audioFile": ctx.audio_url
+        },
+        "text": ctx.reply_text,
+        "voice_id": ctx.voice_id,
+        "error": ctx.tts_result["error"],
+        "fallback_message": FALLBACK_TTS_MESSAGE
+    }
+
+async def generate_audio_error_response(ctx: TurnContext, kind: str, error: str) -> dict:
+    return {
+        "status": "error",
+        "error": error,
+        "fallback_message": FALLBACK_RESPONSES["general_error"]
+    }
+
+TRANSCRIBE_PIPELINE = TurnPipeline(
+    "transcribe_file",
+    [rate_limit_stage("requests", "stt_seconds"), READ_UPLOAD, TRANSCRIBE],
+    transcription_response, error_response
+)
+ECHO_PIPELINE = TurnPipeline(
+    "tts_echo",
+    [rate_limit_stage("requests", "stt_seconds", "tts_characters"),
+     READ_UPLOAD, TRANSCRIBE, REQUIRE_SPEECH, ECHO_TRANSCRIPT, (SYNTHESIZE, PREFETCH_FALLBACK)],
+    echo_response, error_response
+)
+LLM_QUERY_PIPELINE = TurnPipeline(
+    "llm_query",
+    [rate_limit_stage("requests", "stt_seconds", "llm_calls", "tts_characters"),
+     READ_UPLOAD, TRANSCRIBE, REQUIRE_SPEECH, BUILD_PROMPT, GENERATE_REPLY, (SYNTHESIZE, PREFETCH_FALLBACK)],
+    llm_query_response, llm_query_error_response
+)
+AGENT_PIPELINE = TurnPipeline(
+    "conversational_agent",
+    [rate_limit_stage("requests", "stt_seconds", "llm_calls", "tts_characters"),
+     READ_UPLOAD, TRANSCRIBE, REQUIRE_SPEECH, BEGIN_TURN, OPEN_SESSION, BUILD_PROMPT, GENERATE_REPLY,
+     (SYNTHESIZE, PERSIST_REPLY, PREFETCH_FALLBACK)],
+    agent_response, error_response
+)
+CONVERSATION_PIPELINE = TurnPipeline(
+    "conversation_query",
+    [rate_limit_stage("requests", "stt_seconds", "llm_calls", "tts_characters"),
+     READ_UPLOAD, TRANSCRIBE, REQUIRE_SPEECH, BEGIN_TURN, ACKNOWLEDGE, OPEN_SESSION, BUILD_PROMPT, GENERATE_REPLY,
+     (SYNTHESIZE, PERSIST_REPLY, PREFETCH_FALLBACK)],
+    conversation_response, conversation_error_response
+)
+CONVERSATION_TEXT_PIPELINE = TurnPipeline(
+    "conversation_text",
+    [rate_limit_stage("requests", "llm_calls", "tts_characters"),
+     ACCEPT_TEXT, BEGIN_TURN, OPEN_SESSION, BUILD_PROMPT, GENERATE_REPLY,
+     (SYNTHESIZE, PERSIST_REPLY, PREFETCH_FALLBACK)],
+    conversation_response, conversation_error_response
+)
+CONVERSATION_STREAM_PIPELINE = TurnPipeline(
+    "conversation_stream",
+    [rate_limit_stage("requests", "stt_seconds", "llm_calls", "tts_characters"),
+     READ_UPLOAD, TRANSCRIBE, REQUIRE_SPEECH, BEGIN_TURN, OPEN_SESSION, BUILD_PROMPT, STREAM_REPLY,
+     (PERSIST_REPLY, PREFETCH_FALLBACK)],
+    conversation_response, conversation_error_response
+)
+CONVERSATION_TEXT_STREAM_PIPELINE = TurnPipeline(
+    "conversation_text_stream",
+    [rate_limit_stage("requests", "llm_calls", "tts_characters"),
+     ACCEPT_TEXT, BEGIN_TURN, OPEN_SESSION, BUILD_PROMPT, STREAM_REPLY, (PERSIST_REPLY, PREFETCH_FALLBACK)],
+    conversation_response, conversation_error_response
+)
+GENERATE_AUDIO_PIPELINE = TurnPipeline(
+    "generate_audio",
+    [rate_limit_stage("requests", "tts_characters"), (SYNTHESIZE, PREFETCH_FALLBACK)],
+    generate_audio_response, generate_audio_error_response
+)
+
+@app.post("/generate-audio")
+async def generate_audio(req: TTSRequest, request: Request):
+    """Generate audio with comprehensive error handling"""
+    logger.info("Generating audio for text: %s", payload(req.text), extra=SAMPLED)
+    
+    if not req.text or req.text.strip() == "":
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+    
+    ctx = TurnContext(request=request, voice_id=req.voiceId)
+    ctx.output_format = negotiate_audio_format(req.format, request.headers.get("accept"), req.sampleRate, req.bitrate)
+    ctx.reply_text = req.text
+    return await GENERATE_AUDIO_PIPELINE.run(ctx)
 
 @app.post("/upload-audio")
 async def upload_audio(file: UploadFile = File(...)):
     try:
-        print(f"Received file: {file.filename}, Content-Type: {file.content_type}")
+        logger.info("Received file: %s, Content-Type: %s", file.filename, file.content_type, extra=SAMPLED)
         
         file_path = uploads_dir / file.filename
         
@@ -572,560 +3476,873 @@ async def upload_audio(file: UploadFile = File(...)):
             "size": file_size
         }
         
-        print(f"Returning response: {response_data}")
+        logger.info("Upload stored: %s (%d bytes)", file.filename, file_size, extra=SAMPLED)
         return response_data
     
     except Exception as e:
         error_response = {"error": f"Failed to upload audio: {str(e)}"}
-        print(f"Error occurred: {error_response}")
+        logger.error("Error occurred: %s", error_response)
         return error_response
 
 @app.post("/transcribe/file")
-async def transcribe_file(file: UploadFile = File(...)):
-    try:
-        print(f"Received file for transcription: {file.filename}, Content-Type: {file.content_type}")
-        
-        audio_data = await file.read()
-        print(f"Audio data size: {len(audio_data)} bytes")
-        
-        print("Starting transcription with AssemblyAI...")
-        transcript = transcriber.transcribe(audio_data)
-        
-        if transcript.status == aai.TranscriptStatus.error:
-            print(f"Transcription failed: {transcript.error}")
-            return {
-                "error": f"Transcription failed: {transcript.error}",
-                "status": "error"
-            }
-        
-        print(f"Transcription completed successfully")
-        print(f"Transcript text: {transcript.text[:100]}...")
-        
-        response_data = {
-            "transcript": transcript.text,
-            "status": "completed",
-            "filename": file.filename,
-            "audio_duration": transcript.audio_duration,
-            "confidence": getattr(transcript, 'confidence', None),
-            "words_count": len(transcript.text.split()) if transcript.text else 0
-        }
-        
-        return response_data
-        
-    except Exception as e:
-        print(f"Error during transcription: {str(e)}")
+async def transcribe_file(request: Request, file: UploadFile = File(...)):
+    logger.info("Received file for transcription: %s, Content-Type: %s", file.filename, file.content_type, extra=SAMPLED)
+    return await TRANSCRIBE_PIPELINE.run(TurnContext(request=request, file=file))
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "500")) * 1024 * 1024
+UPLOAD_TTL = float(os.getenv("UPLOAD_TTL", "86400"))
+UPLOAD_IDLE_TIMEOUT = float(os.getenv("UPLOAD_IDLE_TIMEOUT", "300"))
+UPLOAD_STREAM_TO_PROVIDER = os.getenv("UPLOAD_STREAM_TO_PROVIDER", "true").lower() in ("1", "true", "yes")
+UPLOAD_MAX_ACTIVE = int(os.getenv("UPLOAD_MAX_ACTIVE", "32"))
+ASSEMBLYAI_UPLOAD_URL = "https://api.assemblyai.com/v2/upload"
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+)$")
+UPLOAD_READ_SIZE = 1024 * 1024
+
+class ChunkedUpload:
+    """One resumable upload whose chunks are written in place into a file of its final size
+
+    Only chunks that passed their hash check count as received. The contiguous received
+    prefix is hashed as it grows and is what gets streamed to the STT provider.
+    """
+
+    def __init__(self, filename: str, size: int, sha256: Optional[str], directory: Path):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.size = size
+        self.expected_sha256 = sha256.lower() if sha256 else None
+        self.path = directory / f"{self.id}.part"
+        self.stored_path = None
+        self.ranges = []  # merged [start, end) byte ranges received
+        self.writing = []  # verified ranges being copied into the file
+        self.prefix = 0  # bytes from 0 that are received and hashed
+        self.sha256 = hashlib.sha256()
+        self.content_hash = hashlib.blake2b(digest_size=16)  # same digest as audio_content_hash
+        self.hash_lock = asyncio.Lock()
+        self.prefix_changed = threading.Condition()
+        self.provider_upload = None
+        self.aborted = False
+        self.finalizing = False
+        self.last_activity = time.monotonic()
+        with open(self.path, "wb") as f:
+            f.truncate(size)
+
+    @property
+    def received(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+    def add_range(self, start: int, end: int):
+        merged = []
+        for range_start, range_end in sorted(self.ranges + [(start, end)]):
+            if merged and range_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+            else:
+                merged.append((range_start, range_end))
+        self.ranges = merged
+
+    def covers(self, start: int, end: int) -> bool:
+        return any(range_start <= start and end <= range_end for range_start, range_end in self.ranges)
+
+    def overlaps(self, start: int, end: int) -> bool:
+        return any(start < range_end and range_start < end for range_start, range_end in self.ranges + self.writing)
+
+    def missing(self) -> list:
+        gaps, position = [], 0
+        for start, end in self.ranges:
+            if start > position:
+                gaps.append([position, start])
+            position = end
+        if position < self.size:
+            gaps.append([position, self.size])
+        return gaps
+
+    def hash_prefix(self):
+        """Hash newly contiguous bytes and release them to the provider stream (worker thread)"""
+        contiguous = self.ranges[0][1] if self.ranges and self.ranges[0][0] == 0 else 0
+        if contiguous <= self.prefix:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.prefix)
+            remaining = contiguous - self.prefix
+            while remaining:
+                piece = f.read(min(UPLOAD_READ_SIZE, remaining))
+                self.sha256.update(piece)
+                self.content_hash.update(piece)
+                remaining -= len(piece)
+        with self.prefix_changed:
+            self.prefix = contiguous
+            self.prefix_changed.notify_all()
+
+    def prefix_chunks(self, source):
+        """Yield the file as its verified prefix grows; blocks the calling thread in between
+
+        source is a handle opened when the stream started, so finalize can move the file
+        out from under it.
+        """
+        sent = 0
+        while sent < self.size:
+            with self.prefix_changed:
+                if not self.prefix_changed.wait_for(lambda: self.prefix > sent or self.aborted, UPLOAD_IDLE_TIMEOUT):
+                    raise TimeoutError(f"No upload progress for {UPLOAD_IDLE_TIMEOUT:g}s")
+                if self.aborted:
+                    raise RuntimeError("Upload was aborted")
+                available = self.prefix
+            source.seek(sent)
+            while sent < available:
+                piece = source.read(min(UPLOAD_READ_SIZE, available - sent))
+                sent += len(piece)
+                yield piece
+
+    def abort(self):
+        """Stop the provider stream and drop the partial file (a finalized file stays in uploads/)"""
+        with self.prefix_changed:
+            self.aborted = True
+            self.prefix_changed.notify_all()
+        self.path.unlink(missing_ok=True)
+
+    def status(self) -> dict:
         return {
-            "error": f"Transcription error: {str(e)}",
-            "status": "error"
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "received": self.received,
+            "ranges": [list(r) for r in self.ranges],
+            "missing": self.missing(),
+            "complete": self.received == self.size,
+            "streaming_to_provider": self.provider_upload is not None
         }
-        
-@app.post("/tts/echo")
-async def tts_echo(file: UploadFile = File(...)):
+
+def assemblyai_upload_stream(upload: ChunkedUpload, source) -> str:
+    """Send the upload to AssemblyAI with chunked transfer encoding while it is still arriving"""
+    response = requests.post(
+        ASSEMBLYAI_UPLOAD_URL,
+        headers={"authorization": os.getenv("ASSEMBLYAI_API_KEY")},
+        data=upload.prefix_chunks(source),
+        timeout=(10, UPLOAD_IDLE_TIMEOUT + 30)
+    )
+    response.raise_for_status()
+    return response.json()["upload_url"]
+
+class ChunkedUploads:
+    """Uploads in progress, kept in process memory (a server restart discards them)"""
+
+    def __init__(self, directory: Path, ttl: float):
+        self.directory = directory
+        self.ttl = ttl
+        self.uploads = {}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for stale in [*self.directory.glob("*.part"), *self.directory.glob("*.chunk")]:
+            stale.unlink(missing_ok=True)
+
+    def prune(self):
+        now = time.monotonic()
+        for upload_id, upload in list(self.uploads.items()):
+            if now - upload.last_activity > self.ttl and not upload.finalizing:
+                self.discard(upload_id)
+
+    async def create(self, filename: str, size: int, sha256: Optional[str], stream_to_provider: bool) -> ChunkedUpload:
+        self.prune()
+        if len(self.uploads) >= UPLOAD_MAX_ACTIVE:
+            raise HTTPException(status_code=503, detail="Too many uploads in progress, try again later",
+                                headers={"Retry-After": "30"})
+        upload = await asyncio.to_thread(ChunkedUpload, filename, size, sha256, self.directory)
+        if stream_to_provider:
+            self.stream_to_provider(upload)
+        self.uploads[upload.id] = upload
+        return upload
+
+    def stream_to_provider(self, upload: ChunkedUpload):
+        # A dedicated thread: the stream blocks for as long as the client takes to upload,
+        # which must not tie up the default executor used by asyncio.to_thread
+        loop = asyncio.get_running_loop()
+        upload.provider_upload = loop.create_future()
+        # Retrieved at finalize; a failed stream just means finalize uploads the file itself
+        upload.provider_upload.add_done_callback(lambda future: future.cancelled() or future.exception())
+        
+        def settle(result=None, error=None):
+            if not upload.provider_upload.done():
+                if error is not None:
+                    upload.provider_upload.set_exception(error)
+                else:
+                    upload.provider_upload.set_result(result)
+        
+        source = open(upload.path, "rb")
+        
+        def stream():
+            try:
+                with source:
+                    upload_url = assemblyai_upload_stream(upload, source)
+                loop.call_soon_threadsafe(settle, upload_url)
+            except Exception as e:
+                loop.call_soon_threadsafe(settle, None, e)
+        
+        threading.Thread(target=stream, name=f"upload-{upload.id[:8]}", daemon=True).start()
+
+    def get(self, upload_id: str) -> ChunkedUpload:
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired upload")
+        upload.last_activity = time.monotonic()
+        return upload
+
+    def discard(self, upload_id: str):
+        upload = self.uploads.pop(upload_id, None)
+        if upload is not None:
+            upload.abort()
+
+chunked_uploads = ChunkedUploads(uploads_dir / "partial", UPLOAD_TTL)
+
+class CreateUploadRequest(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+    transcribe: bool = True
+
+def parse_content_range(header: Optional[str], size: int) -> tuple:
+    match = CONTENT_RANGE_PATTERN.match(header or "")
+    if not match:
+        raise HTTPException(status_code=400, detail="Content-Range header must look like 'bytes 0-1048575/5242880'")
+    start, last, total = (int(value) for value in match.groups())
+    if total != size or start > last or last >= size:
+        raise HTTPException(status_code=416, detail=f"Range {start}-{last}/{total} does not fit an upload of {size} bytes")
+    return start, last + 1
+
+def append_file(path: Path, data: bytes):
+    with open(path, "ab") as f:
+        f.write(data)
+
+def hash_file_range(path: Path, start: int, end: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining:
+            piece = f.read(min(UPLOAD_READ_SIZE, remaining))
+            if not piece:
+                break
+            digest.update(piece)
+            remaining -= len(piece)
+    return digest.hexdigest()
+
+def copy_upload_chunk(staged: Path, path: Path, offset: int):
+    with open(staged, "rb") as source, open(path, "r+b") as target:
+        target.seek(offset)
+        shutil.copyfileobj(source, target, UPLOAD_READ_SIZE)
+
+async def stage_resolve_upload(ctx: TurnContext):
+    """Transcribe from the provider copy streamed during the upload, or the assembled file"""
+    upload = ctx.upload
+    ctx.audio_key = transcript_cache.digest_key(upload.content_hash.hexdigest())
+    ctx.audio_data = str(upload.stored_path)
+    if upload.provider_upload is not None:
+        try:
+            ctx.audio_data = await asyncio.shield(upload.provider_upload)
+        except Exception as e:
+            logger.warning("Streaming upload to AssemblyAI failed, sending the assembled file instead: %s", e)
+
+async def resolve_upload_timed_out(ctx: TurnContext, error: str):
+    logger.warning("Streaming upload to AssemblyAI is still running (%s), sending the assembled file instead", error)
+    ctx.audio_data = str(ctx.upload.stored_path)
+
+RESOLVE_UPLOAD = Stage("resolve_upload", stage_resolve_upload, STT_STAGE_TIMEOUT, resolve_upload_timed_out)
+# Uploads are the path for long recordings, which take far longer than a voice turn to transcribe
+TRANSCRIBE_UPLOAD = Stage("transcribe", stage_transcribe, UPLOAD_STT_TIMEOUT, transcribe_timed_out)
+
+UPLOAD_TRANSCRIBE_PIPELINE = TurnPipeline(
+    "transcribe_upload",
+    [rate_limit_stage("requests", "stt_seconds"), RESOLVE_UPLOAD, TRANSCRIBE_UPLOAD],
+    transcription_response, error_response
+)
+
+@app.post("/uploads")
+async def create_upload(req: CreateUploadRequest, request: Request):
+    """Start a resumable upload; send the bytes with PUT /uploads/{upload_id} and Content-Range"""
+    filename = Path(req.filename).name
+    if filename in ("", ".", ".."):
+        raise HTTPException(status_code=400, detail=f"Invalid filename: {req.filename!r}")
+    if req.size <= 0:
+        raise HTTPException(status_code=400, detail="Upload size must be positive")
+    if req.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_BYTES // (1024 * 1024)} MB")
+    if RATE_LIMIT_ENABLED:
+        rate_limiter.acquire(rate_limit_keys(request), {"requests": 1, "stt_seconds": 0})
+    stream = req.transcribe and UPLOAD_STREAM_TO_PROVIDER and provider_available("assemblyai")
+    upload = await chunked_uploads.create(filename, req.size, req.sha256, stream)
+    logger.info("Created upload %s for %s (%d bytes)", upload.id, upload.filename, upload.size, extra=SAMPLED)
+    return {**upload.status(), "upload_url": f"/uploads/{upload.id}"}
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    """Received and missing byte ranges, so an interrupted client knows where to resume"""
+    return chunked_uploads.get(upload_id).status()
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, request: Request):
+    """Receive one byte range; X-Chunk-SHA256 (hex) is verified when sent
+
+    The body is staged in its own file and only copied into the upload once its length and
+    hash check out. Ranges that overlap received bytes are refused, except an exact resend of
+    bytes already received: its hash is compared with the stored bytes and it is acknowledged
+    without rewriting anything.
+    """
+    upload = chunked_uploads.get(upload_id)
+    if upload.finalizing:
+        raise HTTPException(status_code=409, detail="Upload is already being finalized")
+    start, end = parse_content_range(request.headers.get("content-range"), upload.size)
+    resend = upload.covers(start, end)
+    if not resend and upload.overlaps(start, end):
+        raise HTTPException(status_code=409, detail=f"Bytes {start}-{end - 1} overlap bytes already received")
+    expected_hash = request.headers.get("x-chunk-sha256")
+    
+    staged = upload.path.with_name(f"{upload.id}.{uuid.uuid4().hex[:8]}.chunk")
     try:
-        print(f"Received file for echo: {file.filename}, Content-Type: {file.content_type}")
-        
-        audio_data = await file.read()
-        print(f"Audio data size: {len(audio_data)} bytes")
-        
-        print("Starting transcription with AssemblyAI...")
-        transcript = transcriber.transcribe(audio_data)
-        
-        if transcript.status == aai.TranscriptStatus.error:
-            print(f"Transcription failed: {transcript.error}")
-            return {
-                "error": f"Transcription failed: {transcript.error}",
-                "status": "error"
-            }
-        
-        transcribed_text = transcript.text
-        print(f"Transcription completed: {transcribed_text}")
-        
-        if not transcribed_text or transcribed_text.strip() == "":
-            return {
-                "error": "No speech detected in the audio",
-                "status": "error"
-            }
-        
-        print("Generating speech with Murf API...")
-        murf_url = "https://api.murf.ai/v1/speech/generate-with-key"
-        
-        murf_headers = {
-            "accept": "application/json",
-            "Content-Type": "application/json",
-            "api-key": os.getenv("MURF_API_KEY")
-        }
-        
-        murf_payload = {
-            "text": transcribed_text,
-            "voiceId": "en-US-marcus",
-            "format": "MP3"
-        }
-        
-        murf_response = requests.post(murf_url, headers=murf_headers, json=murf_payload)
-        
-        if murf_response.status_code != 200:
-            print(f"Murf API failed: {murf_response.status_code} - {murf_response.text}")
-            return {
-                "error": f"Speech generation failed: {murf_response.text}",
-                "status": "error"
-            }
-        
-        murf_result = murf_response.json()
-        audio_url = murf_result.get("audioFile")
-        
-        if not audio_url:
-            print("No audio URL in Murf response")
-            return {
-                "error": "No audio URL received from Murf API",
-                "status": "error"
-            }
-        
-        print(f"Echo bot completed successfully. Audio URL: {audio_url}")
-        
-        response_data = {
-            "status": "success",
-            "original_filename": file.filename,
-            "transcribed_text": transcribed_text,
-            "audio_url": audio_url,
-            "voice_id": "en-US-marcus",
-            "audio_duration": transcript.audio_duration,
-            "words_count": len(transcribed_text.split()) if transcribed_text else 0
-        }
-        
-        return response_data
-        
-    except Exception as e:
-        print(f"Error in echo bot: {str(e)}")
-        return {
-            "error": f"Echo bot error: {str(e)}",
-            "status": "error"
-        }
+        chunk_hash = hashlib.sha256()
+        length, buffer = 0, bytearray()
+        async for piece in request.stream():
+            length += len(piece)
+            if start + length > end:
+                raise HTTPException(status_code=400, detail=f"Body is longer than the {end - start} bytes of its Content-Range")
+            chunk_hash.update(piece)
+            buffer += piece
+            if len(buffer) >= UPLOAD_READ_SIZE:
+                await asyncio.to_thread(append_file, staged, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(append_file, staged, bytes(buffer))
+        if start + length != end:
+            raise HTTPException(status_code=400, detail=f"Body has {length} of the {end - start} bytes of its Content-Range")
+        if expected_hash and chunk_hash.hexdigest() != expected_hash.lower():
+            raise HTTPException(status_code=422, detail=f"SHA-256 mismatch for bytes {start}-{end - 1}; send the chunk again")
+        if resend:
+            if await asyncio.to_thread(hash_file_range, upload.path, start, end) != chunk_hash.hexdigest():
+                raise HTTPException(status_code=409, detail=f"Bytes {start}-{end - 1} differ from the bytes already received")
+            return upload.status()
+        
+        # Checked again: another PUT may have claimed these bytes while this body was arriving
+        if upload.overlaps(start, end) or upload.aborted:
+            raise HTTPException(status_code=409, detail=f"Bytes {start}-{end - 1} overlap bytes already received")
+        upload.writing.append((start, end))
+        try:
+            await asyncio.to_thread(copy_upload_chunk, staged, upload.path, start)
+        finally:
+            upload.writing.remove((start, end))
+    finally:
+        staged.unlink(missing_ok=True)
+    
+    upload.add_range(start, end)
+    async with upload.hash_lock:
+        await asyncio.to_thread(upload.hash_prefix)
+    upload.last_activity = time.monotonic()
+    return upload.status()
 
-@app.post("/llm/query")
-async def llm_query(file: UploadFile = File(...)):
-    """Voice LLM query with comprehensive error handling and fallbacks"""
+@app.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str):
+    chunked_uploads.get(upload_id)
+    chunked_uploads.discard(upload_id)
+    return {"upload_id": upload_id, "status": "deleted"}
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, request: Request, transcribe: bool = Query(True)):
+    """Verify the whole file, move it to uploads/ and (by default) transcribe it"""
+    upload = chunked_uploads.get(upload_id)
+    if upload.received != upload.size:
+        return JSONResponse(status_code=409, content={**upload.status(), "error": "Upload is incomplete"})
+    if upload.finalizing:
+        raise HTTPException(status_code=409, detail="Upload is already being finalized")
+    upload.finalizing = True
     try:
-        logger.info(f"Received audio for LLM query: {file.filename}, Content-Type: {file.content_type}")
-        
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="No file provided")
-        
-        audio_data = await file.read()
-        logger.info(f"Audio data size: {len(audio_data)} bytes")
-        
-        if len(audio_data) == 0:
-            raise HTTPException(status_code=400, detail="Empty audio file")
-        
-        logger.info("Step 1: Transcribing audio with AssemblyAI...")
-        transcription_result = await safe_transcribe(audio_data)
-        
-        if not transcription_result["success"]:
-            fallback_message = "I'm having trouble connecting right now"
-            fallback_audio = await generate_fallback_audio_url(fallback_message)
-            return {
-                "status": "error",
-                "error": transcription_result["error"],
-                "fallback_message": fallback_message,
-                "audioFile": fallback_audio,
-                "original_filename": file.filename,
-                "timestamp": datetime.now().isoformat()
-            }
-        
-        user_query = transcription_result["text"]
-        logger.info(f"User query: {user_query}")
-        
-        if not user_query or user_query.strip() == "":
-            fallback_message = "I'm having trouble connecting right now"
-            fallback_audio = await generate_fallback_audio_url(fallback_message)
-            return {
-                "status": "error",
-                "error": "No speech detected in the audio",
-                "fallback_message": fallback_message,
-                "audioFile": fallback_audio,
-                "original_filename": file.filename,
-                "timestamp": datetime.now().isoformat()
-            }
-        
-        logger.info("Step 2: Generating LLM response with Gemini AI...")
-        llm_result = await safe_llm_generate(user_query)
-        
-        if not llm_result["success"]:
-            ai_response_text = llm_result["fallback_response"]
-            llm_success = False
-        else:
-            ai_response_text = llm_result["text"]
-            llm_success = True
-        
-        logger.info(f"AI response: {ai_response_text[:100]}...")
-        
-        logger.info("Step 3: Converting AI response to speech with Murf...")
-        tts_result = await safe_tts_generate(ai_response_text)
-        
-        if tts_result["success"]:
-            audio_url = tts_result["audio_url"]
-            tts_success = True
-        else:
-            logger.info("TTS failed, generating fallback audio with error message")
-            fallback_message = "I'm having trouble connecting right now"
-            audio_url = await generate_fallback_audio_url(fallback_message)
-            tts_success = False
-        
-        if transcription_result["success"] and llm_success and tts_success:
-            status = "success"
-        elif transcription_result["success"]:
-            status = "partial_success"
+        async with upload.hash_lock:
+            await asyncio.to_thread(upload.hash_prefix)
+        sha256 = upload.sha256.hexdigest()
+        if upload.expected_sha256 and sha256 != upload.expected_sha256:
+            chunked_uploads.discard(upload_id)
+            raise HTTPException(status_code=422, detail=f"SHA-256 of the assembled file is {sha256}, expected {upload.expected_sha256}")
+        
+        # Prefixed with the upload id: two uploads of the same name must never replace each other
+        upload.stored_path = uploads_dir / f"{upload.id}_{upload.filename}"
+        await asyncio.to_thread(shutil.move, upload.path, upload.stored_path)
+        result = {"status": "uploaded", "upload_id": upload.id, "filename": upload.filename,
+                  "stored_as": upload.stored_path.name, "size": upload.size, "sha256": sha256}
+        logger.info("Upload %s stored as %s", upload.id, upload.stored_path, extra=SAMPLED)
+        
+        if transcribe:
+            ctx = TurnContext(request=request)
+            ctx.filename = upload.filename
+            ctx.upload = upload
+            result.update(await UPLOAD_TRANSCRIBE_PIPELINE.run(ctx))
+        elif upload.provider_upload is not None:
+            upload.abort()
+        return result
+    finally:
+        chunked_uploads.uploads.pop(upload_id, None)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+BATCH_MAX_FILE_BYTES = int(os.getenv("BATCH_MAX_FILE_MB", "25")) * 1024 * 1024
+BATCH_MAX_TOTAL_BYTES = int(os.getenv("BATCH_MAX_TOTAL_MB", "1024")) * 1024 * 1024
+BATCH_AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg", ".webm", ".m4a", ".mp4", ".flac", ".aac", ".amr")
+
+# Shared by every batch so concurrent batches can't multiply the load on the STT provider
+batch_transcription_slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+# Raised while extracting a damaged, encrypted or unsupported zip entry
+BATCH_ENTRY_ERRORS = (zipfile.BadZipFile, zlib.error, NotImplementedError, RuntimeError, EOFError)
+
+class BatchSpool:
+    """The files of one batch, copied to a temporary directory as they are unpacked
+
+    Files stay on disk until the STT client reads them, so only the files being transcribed
+    are ever in memory. Zip entries that cannot be extracted become per-file errors.
+    """
+
+    def __init__(self):
+        self.directory = Path(tempfile.mkdtemp(prefix="batch-"))
+        self.items = []  # {"filename", "path", "content_hash"} or {"filename", "error"}
+        self.total_bytes = 0
+
+    def add_upload(self, filename: str, source):
+        signature = source.read(4)
+        source.seek(0)
+        if filename.lower().endswith(".zip") or signature == b"PK\x03\x04":
+            self.add_archive(filename, source)
         else:
-            status = "fallback"
-        
-        logger.info(f"Voice LLM query completed with status: {status}")
-        
-        response_data = {
-            "status": status,
-            "original_filename": file.filename,
-            "user_query": user_query,
-            "llm_response": ai_response_text,
-            "audioFile": audio_url,
-            "voice_id": "en-US-marcus",
-            "model": "gemini-1.5-flash",
-            "audio_duration": transcription_result.get("duration"),
-            "timestamp": datetime.now().isoformat(),
-            "service_status": {
-                "transcription": transcription_result["success"],
-                "llm": llm_success,
-                "tts": tts_success
-            }
-        }
-        
-        if not llm_success:
-            response_data["llm_error"] = llm_result["error"]
-            response_data["fallback_message"] = FALLBACK_RESPONSES["llm_error"]
-        
-        if not tts_success:
-            response_data["tts_error"] = tts_result["error"]
-            response_data["tts_fallback_message"] = FALLBACK_RESPONSES["tts_error"]
-        
-        return response_data
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error in voice LLM query: {str(e)}")
-        return {
-            "status": "error",
-            "error": f"Voice LLM query error: {str(e)}",
-            "fallback_message": FALLBACK_RESPONSES["general_error"],
-            "original_filename": getattr(file, 'filename', 'unknown'),
-            "timestamp": datetime.now().isoformat()
-        }
+            self.add(filename, source)
 
-@app.post("/agent/chat/{session_id}")
-async def conversational_agent(session_id: str, file: UploadFile = File(...)):
+    def add_archive(self, filename: str, source):
+        try:
+            archive = zipfile.ZipFile(source)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"{filename} is not a valid zip archive")
+        with archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or not name.lower().endswith(BATCH_AUDIO_EXTENSIONS) or "__MACOSX" in name:
+                    continue
+                if info.file_size > BATCH_MAX_FILE_BYTES:
+                    raise HTTPException(status_code=413, detail=f"{filename}/{name} exceeds {BATCH_MAX_FILE_BYTES // (1024 * 1024)} MB")
+                try:
+                    with archive.open(info) as entry:
+                        self.add(name, entry)
+                except BATCH_ENTRY_ERRORS as e:
+                    self.check_count()
+                    self.items.append({"filename": name, "error": f"Could not extract from {filename}: {str(e) or type(e).__name__}"})
+
+    def check_count(self):
+        if len(self.items) >= BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_FILES} files")
+
+    def add(self, filename: str, reader):
+        """Copy one file into the spool, hashing it on the way (same digest as audio_content_hash)"""
+        self.check_count()
+        path = self.directory / f"{len(self.items)}.audio"
+        digest = hashlib.blake2b(digest_size=16)
+        size = 0
+        try:
+            with open(path, "wb") as f:
+                for piece in iter(lambda: reader.read(UPLOAD_READ_SIZE), b""):
+                    size += len(piece)
+                    if size > BATCH_MAX_FILE_BYTES:
+                        raise HTTPException(status_code=413, detail=f"{filename} exceeds {BATCH_MAX_FILE_BYTES // (1024 * 1024)} MB")
+                    if self.total_bytes + size > BATCH_MAX_TOTAL_BYTES:
+                        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_TOTAL_BYTES // (1024 * 1024)} MB in total")
+                    digest.update(piece)
+                    f.write(piece)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+        self.total_bytes += size
+        self.items.append({"filename": filename, "path": path, "content_hash": digest.hexdigest()})
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+async def transcribe_batch_item(path: Path, content_hash: str) -> dict:
+    async with batch_transcription_slots:
+        try:
+            return await asyncio.wait_for(safe_transcribe(str(path), cache_key=transcript_cache.digest_key(content_hash)),
+                                          STT_STAGE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return {"success": False, "error": f"transcription timed out after {STT_STAGE_TIMEOUT:g}s"}
+
+@app.post("/transcribe/batch")
+async def transcribe_batch(request: Request, files: List[UploadFile] = File(...)):
+    """Transcribe many files (or zip archives of them) concurrently, streaming NDJSON results as each completes"""
+    spool = BatchSpool()
     try:
-        print(f"Received audio for conversation session: {session_id}, File: {file.filename}")
-        
-        if session_id not in chat_sessions:
-            chat_sessions[session_id] = {
-                "messages": [],
-                "created_at": datetime.now().isoformat(),
-                "last_activity": datetime.now().isoformat()
-            }
-            print(f"Created new chat session: {session_id}")
-        
-        audio_data = await file.read()
-        print(f"Audio data size: {len(audio_data)} bytes")
-        
-        print("Step 1: Transcribing audio with AssemblyAI...")
-        transcript = transcriber.transcribe(audio_data)
-        
-        if transcript.status == aai.TranscriptStatus.error:
-            print(f"Transcription failed: {transcript.error}")
-            return {
-                "error": f"Transcription failed: {transcript.error}",
-                "status": "error"
-            }
-        
-        user_message = transcript.text
-        print(f"User message: {user_message}")
-        
-        if not user_message or user_message.strip() == "":
-            return {
-                "error": "No speech detected in the audio",
-                "status": "error"
-            }
-        
-        chat_sessions[session_id]["messages"].append({
-            "role": "user",
-            "content": user_message,
-            "timestamp": datetime.now().isoformat()
-        })
-        chat_sessions[session_id]["last_activity"] = datetime.now().isoformat()
-        
-        conversation_context = "You are a helpful and friendly AI assistant having a natural conversation. Keep your responses conversational and engaging.\n\nConversation history:\n"
-        
-        for msg in chat_sessions[session_id]["messages"]:
-            if msg["role"] == "user":
-                conversation_context += f"User: {msg['content']}\n"
+        for file in files:
+            await asyncio.to_thread(spool.add_upload, file.filename or f"file_{len(spool.items)}", file.file)
+        if not spool.items:
+            raise HTTPException(status_code=400, detail="No audio files provided")
+        
+        rate_keys = rate_limit_keys(request) if RATE_LIMIT_ENABLED else None
+        if rate_keys:
+            rate_limiter.acquire(rate_keys, {"requests": 1, "stt_seconds": 0})
+    except BaseException:
+        await asyncio.to_thread(spool.cleanup)
+        raise
+    items = spool.items
+    logger.info("Received batch of %d files for transcription", len(items))
+    
+    async def stream_results():
+        started = time.perf_counter()
+        jobs = {}
+        pending = []
+        counts = {"completed": 0, "error": 0, "cached": 0, "duplicates": 0}
+        
+        async def run_item(index: int, item: dict):
+            filename = item["filename"]
+            if "error" in item:
+                return {"index": index, "filename": filename, "content_hash": None, "cached": False,
+                        "status": "error", "error": item["error"]}
+            content_hash = item["content_hash"]
+            duplicate_of = None
+            if content_hash in jobs:
+                duplicate_of, job = jobs[content_hash]
+                transcription = await job
             else:
-                conversation_context += f"Assistant: {msg['content']}\n"
-        
-        conversation_context += "\nPlease respond to the user's latest message naturally, considering the conversation history."
-        
-        print(f"Conversation context length: {len(conversation_context)} characters")
-        
-        print("Step 4: Generating contextual AI response with Gemini...")
-        llm_response = gemini_model.generate_content(conversation_context)
-        
-        if not llm_response.text:
-            return {
-                "error": "No response generated from Gemini AI",
-                "status": "error"
-            }
-        
-        ai_response_text = llm_response.text.strip()
-        print(f"AI response: {ai_response_text[:100]}...")
-        
-        chat_sessions[session_id]["messages"].append({
-            "role": "assistant",
-            "content": ai_response_text,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        print("Step 6: Converting AI response to speech with Murf...")
-        murf_url = "https://api.murf.ai/v1/speech/generate-with-key"
-        
-        murf_headers = {
-            "accept": "application/json",
-            "Content-Type": "application/json",
-            "api-key": os.getenv("MURF_API_KEY")
-        }
-        
-        murf_payload = {
-            "text": ai_response_text,
-            "voiceId": "en-US-marcus",
-            "format": "MP3"
-        }
-        
-        murf_response = requests.post(murf_url, headers=murf_headers, json=murf_payload)
-        
-        if murf_response.status_code != 200:
-            print(f"Murf API failed: {murf_response.status_code} - {murf_response.text}")
-            return {
-                "error": f"Speech generation failed: {murf_response.text}",
-                "status": "error"
-            }
-        
-        murf_result = murf_response.json()
-        audio_url = murf_result.get("audioFile")
-        
-        if not audio_url:
-            print("No audio URL in Murf response")
-            return {
-                "error": "No audio URL received from Murf API",
-                "status": "error"
-            }
-        
-        print(f"Conversational agent completed successfully. Session: {session_id}")
-        
-        response_data = {
-            "status": "success",
-            "session_id": session_id,
-            "original_filename": file.filename,
-            "user_message": user_message,
-            "ai_response": ai_response_text,
-            "audioFile": audio_url,
-            "voice_id": "en-US-marcus",
-            "model": "gemini-1.5-flash",
-            "audio_duration": transcript.audio_duration,
-            "message_count": len(chat_sessions[session_id]["messages"]),
-            "timestamp": datetime.now().isoformat()
-        }
+                job = asyncio.ensure_future(transcribe_batch_item(item["path"], content_hash))
+                jobs[content_hash] = (index, job)
+                transcription = await job
+                if rate_keys and transcription.get("success") and not transcription.get("cached"):
+                    rate_limiter.charge(rate_keys, "stt_seconds", transcription.get("duration") or 0)
+            
+            cached = duplicate_of is None and bool(transcription.get("cached"))
+            result = {"index": index, "filename": filename, "content_hash": content_hash, "cached": cached}
+            if duplicate_of is not None:
+                result["duplicate_of"] = duplicate_of
+            if transcription["success"]:
+                result.update({
+                    "status": "completed",
+                    "transcript": transcription["text"],
+                    "audio_duration": transcription.get("duration"),
+                    "confidence": transcription.get("confidence"),
+                    "words_count": len(transcription["text"].split()) if transcription["text"] else 0
+                })
+            else:
+                result.update({"status": "error", "error": transcription["error"]})
+            return result
         
-        return response_data
+        # Register jobs in upload order so the first copy of duplicated audio owns the provider call
+        for index, item in enumerate(items):
+            pending.append(asyncio.ensure_future(run_item(index, item)))
+        try:
+            for next_result in asyncio.as_completed(pending):
+                result = await next_result
+                counts[result["status"]] += 1
+                counts["cached"] += result["cached"]
+                counts["duplicates"] += "duplicate_of" in result
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            # Client went away mid-stream: stop queued work instead of transcribing for nobody
+            for task in pending + [job for _, job in jobs.values()]:
+                task.cancel()
+            await asyncio.to_thread(spool.cleanup)
+        
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("Batch of %d files finished in %.1f ms: %s", len(items), elapsed_ms, counts)
+        yield json.dumps({"summary": {"files": len(items), **counts, "elapsed_ms": elapsed_ms}}) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
         
-    except Exception as e:
-        print(f"Error in conversational agent: {str(e)}")
-        return {
-            "error": f"Conversational agent error: {str(e)}",
-            "status": "error"
-        }
+@app.post("/tts/echo")
+async def tts_echo(request: Request, file: UploadFile = File(...), audio_format: Optional[str] = Form(None)):
+    logger.info("Received file for echo: %s, Content-Type: %s", file.filename, file.content_type, extra=SAMPLED)
+    ctx = TurnContext(request=request, file=file)
+    ctx.output_format = negotiate_audio_format(audio_format, request.headers.get("accept"))
+    return await ECHO_PIPELINE.run(ctx)
+
+@app.post("/llm/query")
+async def llm_query(request: Request, file: UploadFile = File(...), audio_format: Optional[str] = Form(None)):
+    """Voice LLM query with comprehensive error handling and fallbacks"""
+    logger.info("Received audio for LLM query: %s, Content-Type: %s", file.filename, file.content_type, extra=SAMPLED)
+    ctx = TurnContext(request=request, file=file)
+    ctx.output_format = negotiate_audio_format(audio_format, request.headers.get("accept"))
+    return await LLM_QUERY_PIPELINE.run(ctx)
+
+@app.post("/agent/chat/{session_id}")
+async def conversational_agent(session_id: str, request: Request, file: UploadFile = File(...),
+                               audio_format: Optional[str] = Form(None)):
+    session_id_var.set(session_id)
+    logger.info("Received audio for conversation session: %s, File: %s", session_id, file.filename, extra=SAMPLED)
+    ctx = TurnContext(request=request, file=file, session_id=session_id)
+    ctx.output_format = negotiate_audio_format(audio_format, request.headers.get("accept"))
+    return await AGENT_PIPELINE.run(ctx)
+
+@app.get("/agent/chat/search")
+async def search_chat_messages(q: str = Query(..., min_length=1), session_id: Optional[str] = Query(None),
+                               limit: int = Query(20, ge=1, le=CHAT_HISTORY_MAX_PAGE_SIZE)):
+    """Find messages containing every word of q across all sessions (or one), newest first"""
+    hits = []
+    for hit_session_id, message_id in chat_search_index.search(q, session_id):
+        message = find_session_message(chat_sessions[hit_session_id], message_id)
+        if message is not None:
+            hits.append((hit_session_id, message))
+    hits.sort(key=lambda hit: hit[1].timestamp, reverse=True)
+    return {
+        "query": q,
+        "results": [{"session_id": hit_session_id, **message.to_dict()} for hit_session_id, message in hits[:limit]],
+        "total": len(hits),
+        "status": "success"
+    }
 
 @app.get("/agent/chat/{session_id}/history")
-async def get_chat_history(session_id: str):
-    """Get chat history for a session"""
+async def get_chat_history(session_id: str, cursor: Optional[int] = Query(None),
+                           limit: int = Query(CHAT_HISTORY_PAGE_SIZE, ge=1, le=CHAT_HISTORY_MAX_PAGE_SIZE)):
+    """Get chat history for a session, newest page first
+
+    Pass the returned next_cursor as cursor to fetch the page of older messages.
+    """
     try:
         if session_id not in chat_sessions:
             return {
                 "session_id": session_id,
                 "messages": [],
                 "message_count": 0,
+                "next_cursor": None,
                 "status": "new_session"
             }
         
         session = chat_sessions[session_id]
+        page, next_cursor = session_message_page(session, cursor, limit)
         return {
             "session_id": session_id,
-            "messages": session["messages"],
+            "messages": [message.to_dict() for message in page],
             "message_count": len(session["messages"]),
-            "created_at": session["created_at"],
-            "last_activity": session["last_activity"],
+            "next_cursor": next_cursor,
+            "created_at": datetime.fromtimestamp(session["created_at"]).isoformat(),
+            "last_activity": datetime.fromtimestamp(session["last_activity"]).isoformat(),
             "status": "active"
         }
         
     except Exception as e:
-        print(f"Error getting chat history: {str(e)}")
+        logger.error("Error getting chat history: %s", e)
         return {
             "error": f"Chat history error: {str(e)}",
             "status": "error"
         }
 
 @app.post("/conversation/query")
-async def conversation_query(file: UploadFile = File(...), session_id: str = None):
-    """Conversational agent endpoint with session management"""
+async def conversation_query(request: Request, file: UploadFile = File(...), session_id: Optional[str] = Form(None),
+                             session_id_query: Optional[str] = Query(None, alias="session_id"),
+                             audio_format: Optional[str] = Form(None), ack: bool = Form(False)):
+    """Conversational agent endpoint with session management
+
+    With ack=true the response is an acknowledgement clip sent as soon as the transcript is
+    ready; the real reply is fetched from the returned result_url.
+    """
+    session_id = session_id or session_id_query or f"session_{int(datetime.now().timestamp())}"
+    session_id_var.set(session_id)
+    logger.info("Received conversation query: %s, Session: %s", file.filename, session_id, extra=SAMPLED)
+    
+    ctx = TurnContext(request=request, file=file, session_id=session_id)
+    ctx.output_format = negotiate_audio_format(audio_format, request.headers.get("accept"))
+    
+    recording = trace_recorder.start("/conversation/query", {"session_id": session_id, "audio_format": audio_format, "ack": ack}) if trace_recorder else None
+    if not ack:
+        response = await CONVERSATION_PIPELINE.run(ctx)
+        if recording is not None:
+            trace_recorder.submit(recording, ctx, response)
+        return response
+    
+    ctx.acknowledged = asyncio.get_running_loop().create_future()
+    pipeline_task = asyncio.create_task(CONVERSATION_PIPELINE.run(ctx))
+    if recording is not None:
+        pipeline_task.add_done_callback(
+            lambda task: task.cancelled() or task.exception() or trace_recorder.submit(recording, ctx, task.result()))
     try:
-        logger.info(f"Received conversation query: {file.filename}, Session: {session_id}")
-        
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="No file provided")
-        
-        audio_data = await file.read()
-        logger.info(f"Audio data size: {len(audio_data)} bytes")
-        
-        if len(audio_data) == 0:
-            raise HTTPException(status_code=400, detail="Empty audio file")
-        
-        logger.info("Step 1: Transcribing audio...")
-        transcription_result = await safe_transcribe(audio_data)
-        
-        if not transcription_result["success"]:
-            fallback_message = FALLBACK_RESPONSES["stt_error"]
-            fallback_audio = await generate_fallback_audio_url(fallback_message)
-            return {
-                "status": "error",
-                "error": transcription_result["error"],
-                "ai_response": fallback_message,
-                "audioFile": fallback_audio,
-                "session_id": session_id,
-                "timestamp": datetime.now().isoformat()
-            }
-        
-        user_query = transcription_result["text"]
-        logger.info(f"User query: {user_query}")
-        
-        if not user_query or user_query.strip() == "":
-            fallback_message = "I didn't catch that. Could you please repeat?"
-            fallback_audio = await generate_fallback_audio_url(fallback_message)
-            return {
-                "status": "error",
-                "error": "No speech detected",
-                "ai_response": fallback_message,
-                "audioFile": fallback_audio,
-                "session_id": session_id,
-                "timestamp": datetime.now().isoformat()
-            }
-        
-        if not session_id:
-            session_id = f"session_{int(datetime.now().timestamp())}"
-        
-        if session_id not in chat_sessions:
-            chat_sessions[session_id] = {
-                "messages": [],
-                "created_at": datetime.now().isoformat(),
-                "last_activity": datetime.now().isoformat()
-            }
-        
-        session = chat_sessions[session_id]
-        session["last_activity"] = datetime.now().isoformat()
-        
-        session["messages"].append({
-            "role": "user",
-            "content": user_query,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        logger.info("Step 2: Generating AI response with conversation context...")
-        
-        context_messages = []
-        for msg in session["messages"][-10:]:
-            context_messages.append(f"{msg['role'].title()}: {msg['content']}")
-        
-        conversation_context = "\n".join(context_messages)
-        
-        prompt = f"""You are a helpful AI assistant having a natural conversation. 
-        
-Previous conversation:
-{conversation_context}
+        await asyncio.wait({pipeline_task, ctx.acknowledged}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        pipeline_task.cancel()
+        raise
+    if not ctx.acknowledged.done():
+        # Failed (or finished) before there was a transcript to acknowledge
+        return pipeline_task.result()
+    follow_up_results.add(session_id, ctx.turn.turn_id, pipeline_task)
+    return ctx.acknowledged.result()
 
-Please respond naturally and conversationally to the user's latest message. Keep your response concise but helpful."""
-        
-        llm_result = await safe_llm_generate(prompt)
-        
-        if not llm_result["success"]:
-            ai_response_text = llm_result["fallback_response"]
-            llm_success = False
-        else:
-            ai_response_text = llm_result["text"]
-            llm_success = True
-        
-        session["messages"].append({
-            "role": "assistant",
-            "content": ai_response_text,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        logger.info(f"AI response: {ai_response_text[:100]}...")
-        
-        logger.info("Step 3: Converting AI response to speech...")
-        tts_result = await safe_tts_generate(ai_response_text)
-        
-        if tts_result["success"]:
-            audio_url = tts_result["audio_url"]
-            tts_success = True
-        else:
-            logger.info("TTS failed, generating fallback audio")
-            audio_url = await generate_fallback_audio_url(ai_response_text)
-            tts_success = False
-        
-        if transcription_result["success"] and llm_success and tts_success:
-            status = "success"
-        elif transcription_result["success"]:
-            status = "partial_success"
-        else:
-            status = "fallback"
-        
-        logger.info(f"Conversation query completed with status: {status}")
-        
-        response_data = {
-            "status": status,
-            "session_id": session_id,
-            "user_query": user_query,
-            "ai_response": ai_response_text,
-            "audioFile": audio_url,
-            "voice_id": "en-US-marcus",
-            "model": "gemini-1.5-flash",
-            "message_count": len(session["messages"]),
-            "audio_duration": transcription_result.get("duration"),
-            "timestamp": datetime.now().isoformat(),
-            "service_status": {
-                "transcription": transcription_result["success"],
-                "llm": llm_success,
-                "tts": tts_success
-            }
-        }
-        
-        return response_data
-        
-    except HTTPException:
+def text_turn_context(connection, text: str, session_id: str, voice_id: Optional[str], speak: bool,
+                      audio_format: Optional[str], accept: Optional[str]) -> TurnContext:
+    ctx = TurnContext(request=connection, session_id=session_id, voice_id=voice_id or DEFAULT_VOICE_ID)
+    ctx.user_text = text
+    ctx.speak = speak
+    if speak:
+        ctx.output_format = negotiate_audio_format(audio_format, accept)
+    return ctx
+
+@app.post("/conversation/text")
+async def conversation_text(request: Request, body: ConversationTextRequest):
+    """Conversation turn from a client-side transcript: same sessions as /conversation/query, no upload or STT"""
+    session_id = body.session_id or f"session_{int(datetime.now().timestamp())}"
+    session_id_var.set(session_id)
+    ctx = text_turn_context(request, body.text, session_id, body.voiceId, body.speak, body.format, request.headers.get("accept"))
+    return await CONVERSATION_TEXT_PIPELINE.run(ctx)
+
+@app.websocket("/conversation/ws")
+async def conversation_socket(websocket: WebSocket, session_id: Optional[str] = Query(None)):
+    """Message-based conversation channel
+
+    Client messages: {"type": "text", "text", "session_id"?, "speak"?, "format"?, "voiceId"?},
+    {"type": "interrupt"} and {"type": "ping"}. Replies are {"type": "reply", ...} with the same
+    body as /conversation/text, or {"type": "error", "error"}. A new text message barges in on
+    the session's previous turn.
+    """
+    await websocket.accept()
+    default_session_id = session_id or f"session_{uuid.uuid4().hex[:12]}"
+    turns = set()
+    
+    async def run_text_turn(message: dict):
+        turn_session_id = message.get("session_id") or default_session_id
+        session_id_var.set(turn_session_id)
+        try:
+            ctx = text_turn_context(websocket, message.get("text") or "", turn_session_id, message.get("voiceId"),
+                                    bool(message.get("speak", True)), message.get("format"), None)
+            response = await CONVERSATION_TEXT_PIPELINE.run(ctx)
+            await websocket.send_json({"type": "reply", **response})
+        except HTTPException as e:
+            await websocket.send_json({"type": "error", "status_code": e.status_code, "error": e.detail,
+                                       "retry_after": (e.headers or {}).get("Retry-After")})
+    
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except (ValueError, KeyError):
+                await websocket.send_json({"type": "error", "error": "Messages must be JSON objects"})
+                continue
+            kind = message.get("type") if isinstance(message, dict) else None
+            if kind == "text":
+                task = asyncio.create_task(run_text_turn(message))
+                turns.add(task)
+                task.add_done_callback(turns.discard)
+            elif kind == "interrupt":
+                turn = turn_tracker.interrupt(message.get("session_id") or default_session_id)
+                await websocket.send_json({"type": "interrupted", "turn_id": turn.turn_id if turn else None})
+            elif kind == "ping":
+                await websocket.send_json({"type": "pong"})
+            else:
+                await websocket.send_json({"type": "error", "error": f"Unknown message type: {kind}"})
+    except WebSocketDisconnect:
+        logger.info("Conversation socket closed for session %s", default_session_id)
+    finally:
+        for task in turns:
+            task.cancel()
+
+def sse_event(event: dict) -> str:
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.post("/conversation/stream")
+async def conversation_stream(request: Request, file: Optional[UploadFile] = File(None), text: Optional[str] = Form(None),
+                              session_id: Optional[str] = Form(None), audio_format: Optional[str] = Form(None),
+                              speak: bool = Form(True)):
+    """Server-sent events for one turn (voice upload or text): transcript, text deltas, sentence audio clips, done
+
+    The reply is appended to the session once it is complete.
+    """
+    if file is None and text is None:
+        raise HTTPException(status_code=400, detail="Provide an audio file or text")
+    session_id = session_id or f"session_{int(datetime.now().timestamp())}"
+    session_id_var.set(session_id)
+    
+    ctx = TurnContext(request=request, file=file, session_id=session_id)
+    ctx.user_text = text
+    ctx.speak = speak
+    if speak:
+        ctx.output_format = negotiate_audio_format(audio_format, request.headers.get("accept"))
+    ctx.events = asyncio.Queue()
+    pipeline = CONVERSATION_STREAM_PIPELINE if file is not None else CONVERSATION_TEXT_STREAM_PIPELINE
+    pipeline_task = asyncio.create_task(pipeline.run(ctx))
+    
+    # Hold the response until the turn is admitted and transcribed, so rate limits and bad
+    # uploads still get their real status code instead of a 200 stream
+    first_event = asyncio.ensure_future(ctx.events.get())
+    try:
+        await asyncio.wait({first_event, pipeline_task}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        first_event.cancel()
+        pipeline_task.cancel()
         raise
-    except Exception as e:
-        logger.error(f"Unexpected error in conversation query: {e}")
-        fallback_message = FALLBACK_RESPONSES["general_error"]
-        fallback_audio = await generate_fallback_audio_url(fallback_message)
-        return {
-            "status": "error",
-            "error": str(e),
-            "ai_response": fallback_message,
-            "audioFile": fallback_audio,
-            "session_id": session_id,
-            "timestamp": datetime.now().isoformat()
-        }
+    if not first_event.done():
+        first_event.cancel()
+        if pipeline_task.exception() is not None:
+            raise pipeline_task.exception()
+    
+    async def events():
+        try:
+            if first_event.done() and not first_event.cancelled():
+                yield sse_event(first_event.result())
+            while True:
+                getter = asyncio.ensure_future(ctx.events.get())
+                await asyncio.wait({getter, pipeline_task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield sse_event(getter.result())
+                    continue
+                getter.cancel()
+                while not ctx.events.empty():
+                    yield sse_event(ctx.events.get_nowait())
+                final = pipeline_task.result()
+                yield sse_event({**final, "type": "error" if final.get("status") == "error" else "done"})
+                return
+        finally:
+            pipeline_task.cancel()
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+class FollowUpResults:
+    """Replies of acknowledged turns, kept until collected or FOLLOW_UP_RESULT_TTL after they finish"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.turns = {}
+
+    def add(self, session_id: str, turn_id: int, task: asyncio.Task):
+        self.prune()
+        self.turns[(session_id, turn_id)] = [task, None]
+        task.add_done_callback(lambda _: self.mark_finished(session_id, turn_id))
+
+    def mark_finished(self, session_id: str, turn_id: int):
+        entry = self.turns.get((session_id, turn_id))
+        if entry is not None:
+            entry[1] = time.monotonic()
+
+    def get(self, session_id: str, turn_id: int) -> Optional[asyncio.Task]:
+        entry = self.turns.get((session_id, turn_id))
+        return entry[0] if entry else None
+
+    def prune(self):
+        now = time.monotonic()
+        for key, (_, finished) in list(self.turns.items()):
+            if finished is not None and now - finished > self.ttl:
+                del self.turns[key]
+
+follow_up_results = FollowUpResults(FOLLOW_UP_RESULT_TTL)
+
+@app.get("/conversation/{session_id}/turns/{turn_id}/result")
+async def conversation_turn_result(session_id: str, turn_id: int, wait: float = Query(25, ge=0, le=60)):
+    """Long-poll for the reply of an acknowledged turn (202 while it is still being generated)"""
+    task = follow_up_results.get(session_id, turn_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired turn")
+    if not task.done():
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=wait)
+        except asyncio.TimeoutError:
+            return JSONResponse(status_code=202, content={"status": "pending", "session_id": session_id, "turn_id": turn_id})
+    return task.result()
+
+@app.post("/conversation/{session_id}/interrupt")
+async def interrupt_conversation(session_id: str):
+    """Cancel the in-flight turn of a session (explicit barge-in from the client)"""
+    turn = turn_tracker.interrupt(session_id)
+    return {
+        "status": "interrupted" if turn else "idle",
+        "session_id": session_id,
+        "turn_id": turn.turn_id if turn else None,
+        "timestamp": datetime.now().isoformat()
+    }
 
+startup_metrics["import_ms"] = round((time.perf_counter() - _module_import_started) * 1000, 1)
+startup_metrics["import_budget_ms"] = IMPORT_TIME_BUDGET_MS
+if startup_metrics["import_ms"] > IMPORT_TIME_BUDGET_MS:
+    logger.warning("⚠️ Module import took %.1f ms (budget %.0f ms)", startup_metrics["import_ms"], IMPORT_TIME_BUDGET_MS)
+else:
+    logger.info("✅ Module imported in %.1f ms", startup_metrics["import_ms"])
@@ -14,6 +14,12 @@
     let audioChunks = [];
     let sessionId = generateSessionId();
     let conversationCount = 0;
+    let pendingRequest = null;
+    let ackAudio = null;
+    let clipQueue = [];
+    let clipAudio = null;
+    let onClipsDrained = null;
+    const streamingSupported = typeof ReadableStream !== 'undefined' && typeof TextDecoder !== 'undefined';
     const continuousMode = true;
 
     updateSessionInfo();
@@ -24,6 +30,15 @@
     clearHistoryBtn.addEventListener("click", clearHistory);
 
 
+    function preferredAudioFormat() {
+        const connection = navigator.connection;
+        const constrained = connection && (connection.saveData || ['slow-2g', '2g', '3g'].includes(connection.effectiveType));
+        if (constrained && new Audio().canPlayType('audio/webm; codecs="opus"')) {
+            return 'webm';
+        }
+        return 'mp3';
+    }
+
     function generateSessionId() {
         return 'session_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
     }
@@ -102,8 +117,154 @@
         }
     }
 
+    function stopAcknowledgement() {
+        if (ackAudio) {
+            ackAudio.pause();
+            ackAudio = null;
+        }
+        if (window.speechSynthesis) {
+            window.speechSynthesis.cancel();
+        }
+    }
+
+    function playAcknowledgement(text, audioUrl) {
+        stopAcknowledgement();
+        if (audioUrl && !audioUrl.startsWith('web-speech:')) {
+            ackAudio = new Audio(audioUrl);
+            ackAudio.play().catch(e => console.log("Auto-play prevented"));
+        } else if (window.speechSynthesis) {
+            window.speechSynthesis.speak(new SpeechSynthesisUtterance(text));
+        }
+    }
+
+    function queueClip(url) {
+        clipQueue.push(url);
+        if (!clipAudio) {
+            playNextClip();
+        }
+    }
+
+    function playNextClip() {
+        const url = clipQueue.shift();
+        if (!url) {
+            clipAudio = null;
+            if (onClipsDrained) {
+                const callback = onClipsDrained;
+                onClipsDrained = null;
+                callback();
+            }
+            return;
+        }
+        stopAcknowledgement();
+        clipAudio = new Audio(url);
+        clipAudio.addEventListener('ended', playNextClip);
+        clipAudio.addEventListener('error', playNextClip);
+        clipAudio.play().catch(e => {
+            console.log("Auto-play prevented");
+            playNextClip();
+        });
+    }
+
+    function stopClips() {
+        clipQueue = [];
+        onClipsDrained = null;
+        if (clipAudio) {
+            clipAudio.pause();
+            clipAudio = null;
+        }
+    }
+
+    function afterClipsFinish(callback) {
+        if (!clipAudio && clipQueue.length === 0) {
+            callback();
+        } else {
+            onClipsDrained = callback;
+        }
+    }
+
+    async function streamConversation(formData, signal) {
+        // Server-sent events: transcript, text deltas, sentence audio clips, then done/error
+        const response = await fetch('http://localhost:8000/conversation/stream', {
+            method: 'POST',
+            body: formData,
+            signal
+        });
+        if (!response.ok || !response.body) {
+            return { response, result: await response.json(), streamed: false };
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let bubble = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const dataLine = buffer.slice(0, boundary).split('\n').find(line => line.startsWith('data: '));
+                buffer = buffer.slice(boundary + 2);
+                if (!dataLine) {
+                    continue;
+                }
+                const event = JSON.parse(dataLine.slice(6));
+
+                if (event.type === 'transcript') {
+                    addMessage("user", event.text);
+                    bubble = addMessage("ai", "");
+                    updateStatus("Thinking...", "status-processing");
+                } else if (event.type === 'delta' && bubble) {
+                    bubble.textContent += event.text;
+                    conversationHistory.scrollTop = conversationHistory.scrollHeight;
+                } else if (event.type === 'audio' && event.audio_url) {
+                    queueClip(event.audio_url);
+                } else if (event.type === 'done' || event.type === 'error') {
+                    if (bubble && event.ai_response) {
+                        bubble.textContent = event.ai_response;
+                    }
+                    return { response, result: event, streamed: bubble !== null };
+                }
+            }
+        }
+        throw new Error("Response stream ended without a result");
+    }
+
+    async function waitForReply(resultUrl, signal) {
+        while (true) {
+            const response = await fetch(`http://localhost:8000${resultUrl}?wait=25`, { signal });
+            if (response.status !== 202) {
+                return { response, result: await response.json() };
+            }
+        }
+    }
+
+    function interruptCurrentTurn() {
+        stopAcknowledgement();
+        stopClips();
+        conversationHistory.querySelectorAll('audio').forEach(audio => {
+            if (!audio.paused) {
+                audio.pause();
+            }
+        });
+
+        if (pendingRequest) {
+            pendingRequest.abort();
+            pendingRequest = null;
+            fetch(`http://localhost:8000/conversation/${encodeURIComponent(sessionId)}/interrupt`, {
+                method: 'POST',
+                keepalive: true
+            }).catch(() => {});
+        }
+    }
+
     async function startRecording() {
         try {
+            interruptCurrentTurn();
             updateStatus("Starting microphone...", "status-processing");
             
             const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
@@ -147,24 +308,77 @@
     }
 
     async function processConversation(audioBlob) {
+        const controller = new AbortController();
+        pendingRequest = controller;
+
         try {
             const formData = new FormData();
             const timestamp = new Date().toISOString().replace(/[:.]/g, '-');
             const filename = `conversation_${timestamp}.webm`;
             formData.append('file', audioBlob, filename);
             formData.append('session_id', sessionId);
+            formData.append('audio_format', preferredAudioFormat());
 
             updateStatus("Getting AI response...", "status-processing");
 
-            const response = await fetch('http://localhost:8000/conversation/query', {
-                method: 'POST',
-                body: formData
-            });
+            let response;
+            let result;
+            let streamed = false;
+            let userShown = false;
 
-            const result = await response.json();
+            if (streamingSupported) {
+                ({ response, result, streamed } = await streamConversation(formData, controller.signal));
+            } else {
+                formData.append('ack', 'true');
+                response = await fetch('http://localhost:8000/conversation/query', {
+                    method: 'POST',
+                    body: formData,
+                    signal: controller.signal
+                });
+                result = await response.json();
+            }
 
-            if (response.ok && result.status === 'success') {
+            if (response.ok && result.status === 'pending') {
+                // Transcript is ready: acknowledge right away, then collect the real reply
                 addMessage("user", result.user_query);
+                userShown = true;
+                playAcknowledgement(result.ack_text, result.ack_audio);
+                updateStatus("Thinking...", "status-processing");
+                ({ response, result } = await waitForReply(result.result_url, controller.signal));
+            }
+
+            if (pendingRequest === controller) {
+                pendingRequest = null;
+            }
+
+            if (result.status === 'interrupted') {
+                return;
+            }
+
+            if (response.ok && result.status === 'success' && streamed) {
+                conversationCount++;
+                updateSessionInfo();
+                updateStatus("Ready for your next message", "status-ready");
+
+                if (continuousMode) {
+                    afterClipsFinish(() => {
+                        setTimeout(() => {
+                            if (continuousMode && !isRecording) {
+                                updateStatus("Ready for next input", "status-ready");
+                                setTimeout(() => {
+                                    if (continuousMode && !isRecording) {
+                                        startRecording();
+                                    }
+                                }, 1500);
+                            }
+                        }, 500);
+                    });
+                }
+            } else if (response.ok && result.status === 'success') {
+                stopAcknowledgement();
+                if (!userShown) {
+                    addMessage("user", result.user_query);
+                }
                 addMessage("ai", result.ai_response, result.audioFile);
                 
                 conversationCount++;
@@ -205,13 +419,21 @@
                     }, 1000);
                 }
                 
+            } else if (response.status === 429) {
+                const retryAfter = response.headers.get('Retry-After') || 'a few';
+                updateStatus(`Too many requests. Try again in ${retryAfter} seconds.`, "status-error");
             } else {
-                const errorMessage = result.error || "Sorry, I couldn't process your message.";
-                addMessage("ai", errorMessage, result.audioFile);
+                if (!streamed) {
+                    const errorMessage = result.error || "Sorry, I couldn't process your message.";
+                    addMessage("ai", errorMessage, result.audioFile);
+                }
                 updateStatus("Error occurred. Try again.", "status-error");
             }
 
         } catch (error) {
+            if (error.name === 'AbortError') {
+                return;
+            }
             console.error("Error processing conversation:", error);
             addMessage("ai", "I'm having trouble connecting right now. Please try again.");
             updateStatus("Connection error. Try again.", "status-error");
@@ -340,6 +562,8 @@
                 behavior: 'smooth'
             });
         }, 100);
+
+        return bubbleDiv;
     }
 
     function updateStatus(message, className = "") {
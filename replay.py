@@ -0,0 +1,157 @@
+"""Replay recorded conversation turns against the current code
+
+Turns are captured by running the server with TRACE_RECORD_DIR set. Replay feeds the
+recorded uploads through /conversation/query in-process, with the AssemblyAI, Gemini
+and Murf calls (including the Murf audio downloads) served from the recording, with
+their original latency, and compares per-stage timings so a regression shows up before
+it reaches production. Post-processing runs for real, so ffmpeg should match the host
+the corpus was recorded on.
+
+    python replay.py traces/ --speed 1.0 --max-regression 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from collections import deque
+from pathlib import Path
+
+# Replay must never hit real providers, throttle itself or record (or meter) its own traffic
+os.environ.pop("TRACE_RECORD_DIR", None)
+os.environ["USAGE_DB_PATH"] = ""
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["HEALTH_PROBE_INTERVAL"] = "0"
+
+import app
+from fastapi.testclient import TestClient
+
+class RecordedProviders:
+    """Serves recorded provider responses, preferring the call whose request matches"""
+
+    def __init__(self, corpus_dir: Path, calls: list, speed: float):
+        self.corpus_dir = corpus_dir
+        self.speed = speed
+        self.pending = {name: deque() for name in app.PROVIDER_CALLS}
+        self.diverged = 0
+        for call in calls:
+            self.pending.setdefault(call["provider"], deque()).append(call)
+
+    def decode(self, value):
+        if isinstance(value, dict) and set(value) == {"blob"}:
+            return (self.corpus_dir / "blobs" / value["blob"]).read_bytes()
+        return value
+
+    def stub(self, name: str):
+        def call(request):
+            pending = self.pending[name]
+            if not pending:
+                raise RuntimeError(f"No recorded {name} response left for this turn")
+            recorded = next((c for c in pending if self.decode(c["request"]) == request), None)
+            if recorded is None:
+                self.diverged += 1
+                recorded = pending[0]
+            pending.remove(recorded)
+            time.sleep(recorded["latency_ms"] / 1000 * self.speed)
+            if recorded["error"]:
+                raise RuntimeError(recorded["error"])
+            return self.decode(recorded["response"])
+        return call
+
+def load_turns(corpus_dir: Path) -> list:
+    with open(corpus_dir / "turns.jsonl", encoding="utf-8") as f:
+        turns = [json.loads(line) for line in f if line.strip()]
+    return sorted(turns, key=lambda turn: turn["recorded_at"])
+
+def prepare_app():
+    app.services_status.update(assemblyai=True, gemini=True, murf=True)
+    app.index_audio_directories()
+
+def replay_turn(client: TestClient, corpus_dir: Path, turn: dict, speed: float) -> dict:
+    providers = RecordedProviders(corpus_dir, turn["calls"], speed)
+    for name in app.PROVIDER_CALLS:
+        app.PROVIDER_CALLS[name] = providers.stub(name)
+
+    upload = providers.decode(turn["upload"]) if turn["upload"] else b""
+    form = {key: value for key, value in turn["form"].items() if value is not None}
+    form["session_id"] = f"replay_{form.get('session_id', turn['id'])}"
+
+    started = time.perf_counter()
+    response = client.post(turn["endpoint"], data=form, files={"file": (turn["filename"] or "recording.webm", upload)})
+    total_ms = (time.perf_counter() - started) * 1000
+    body = response.json()
+
+    return {
+        "id": turn["id"],
+        "status": body.get("status"),
+        "recorded_status": turn["status"],
+        "recorded_ms": turn["total_ms"],
+        "replayed_ms": round(total_ms, 1),
+        "stages": {
+            stage: {"recorded_ms": recorded_ms, "replayed_ms": body.get("stage_timings_ms", {}).get(stage)}
+            for stage, recorded_ms in turn["stage_timings_ms"].items()
+        },
+        "unused_calls": sum(len(pending) for pending in providers.pending.values()),
+        "diverged_calls": providers.diverged
+    }
+
+def ratio(replayed: float, recorded: float) -> float:
+    return replayed / recorded if recorded else 1.0
+
+def summarize(results: list, min_stage_ms: float) -> dict:
+    stage_ratios = {}
+    for result in results:
+        for stage, timing in result["stages"].items():
+            # Sub-millisecond stages are dominated by scheduler noise; their ratios mean nothing
+            if timing["replayed_ms"] is not None and timing["recorded_ms"] >= min_stage_ms:
+                stage_ratios.setdefault(stage, []).append(ratio(timing["replayed_ms"], timing["recorded_ms"]))
+    return {
+        "turns": len(results),
+        "status_mismatches": sum(1 for r in results if r["status"] != r["recorded_status"]),
+        "median_total_ratio": round(statistics.median(ratio(r["replayed_ms"], r["recorded_ms"]) for r in results), 3),
+        "median_stage_ratio": {stage: round(statistics.median(values), 3) for stage, values in stage_ratios.items()}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded conversation turns and compare stage timings")
+    parser.add_argument("corpus", type=Path, help="directory written by the server with TRACE_RECORD_DIR")
+    parser.add_argument("--speed", type=float, default=1.0, help="scale recorded provider latency (0 measures app overhead only)")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="fail when the median replayed/recorded ratio of the total or any stage exceeds 1 + this")
+    parser.add_argument("--min-stage-ms", type=float, default=5.0, help="ignore stages faster than this when comparing")
+    parser.add_argument("--report", type=Path, help="write per-turn results as JSON")
+    args = parser.parse_args()
+
+    turns = load_turns(args.corpus)
+    if not turns:
+        print(f"No recorded turns in {args.corpus}")
+        return 1
+
+    prepare_app()
+    original_calls = dict(app.PROVIDER_CALLS)
+    client = TestClient(app.app)
+    try:
+        results = [replay_turn(client, args.corpus, turn, args.speed) for turn in turns]
+    finally:
+        app.PROVIDER_CALLS.update(original_calls)
+
+    summary = summarize(results, args.min_stage_ms)
+    for result in results:
+        print(f"{result['id']}  {result['status']:<10} recorded {result['recorded_ms']:>8.1f} ms  replayed {result['replayed_ms']:>8.1f} ms")
+    print(json.dumps(summary, indent=2))
+    if args.report:
+        args.report.write_text(json.dumps({"summary": summary, "turns": results}, indent=2))
+
+    if args.max_regression is not None:
+        limit = 1 + args.max_regression
+        regressed = [stage for stage, value in summary["median_stage_ratio"].items() if value > limit]
+        if summary["median_total_ratio"] > limit or regressed:
+            print(f"❌ Regression over {args.max_regression:.0%}: total ratio {summary['median_total_ratio']}, stages {regressed}")
+            return 1
+        print(f"✅ Within {args.max_regression:.0%} of recorded timings")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Provider health scoring, driven through HEALTH_PROBES with local stand-ins
+
+    python -m unittest discover tests
+"""
+
+import os
+import time
+import asyncio
+import unittest
+
+import requests
+
+os.environ.setdefault("USAGE_DB_PATH", "")
+os.environ.setdefault("HEALTH_PROBE_INTERVAL", "0")
+
+import app
+
+def healthy_probe():
+    pass
+
+def slow_probe():
+    time.sleep(0.05)
+
+def failing_probe():
+    response = requests.Response()
+    response.status_code = 503
+    response.url = "https://provider.example/v1/models?key=secret"
+    raise requests.HTTPError("503 Server Error for url: https://provider.example/v1/models?key=secret", response=response)
+
+class ProviderHealthTest(unittest.TestCase):
+    provider = "gemini"
+
+    def setUp(self):
+        self.saved_probe = app.HEALTH_PROBES[self.provider]
+        self.saved_health = app.provider_health[self.provider]
+        self.saved_status = app.services_status[self.provider]
+        self.saved_threshold = app.HEALTH_DEGRADED_LATENCY_MS
+        app.provider_health[self.provider] = app.ProviderHealth(self.provider)
+        app.services_status[self.provider] = True
+
+    def tearDown(self):
+        app.HEALTH_PROBES[self.provider] = self.saved_probe
+        app.provider_health[self.provider] = self.saved_health
+        app.services_status[self.provider] = self.saved_status
+        app.HEALTH_DEGRADED_LATENCY_MS = self.saved_threshold
+
+    def probe(self, stand_in, times: int = 5):
+        app.HEALTH_PROBES[self.provider] = stand_in
+        for _ in range(times):
+            asyncio.run(app.probe_provider(self.provider))
+        return app.provider_health[self.provider]
+
+    def test_unknown_before_any_sample(self):
+        self.assertEqual(app.provider_health[self.provider].state, "unknown")
+
+    def test_fast_probes_are_healthy(self):
+        health = self.probe(healthy_probe)
+        self.assertEqual(health.state, "healthy")
+        self.assertTrue(app.provider_available(self.provider))
+        self.assertEqual(app.provider_retries(self.provider, 3), 3)
+
+    def test_slow_probes_are_degraded(self):
+        app.HEALTH_DEGRADED_LATENCY_MS = 20
+        health = self.probe(slow_probe)
+        self.assertEqual(health.state, "degraded")
+        self.assertEqual(app.provider_retries(self.provider, 3), 1)
+
+    def test_failing_probes_are_down(self):
+        health = self.probe(failing_probe, app.HEALTH_DOWN_AFTER_FAILURES)
+        self.assertEqual(health.state, "down")
+        self.assertFalse(app.provider_available(self.provider))
+        self.assertEqual(health.last_error, "probe: HTTPError (HTTP 503)")
+        self.assertNotIn("secret", health.snapshot()["last_error"])
+
+    def test_recovers_after_a_successful_probe(self):
+        self.probe(failing_probe, app.HEALTH_DOWN_AFTER_FAILURES)
+        health = self.probe(healthy_probe, 20)
+        self.assertEqual(health.state, "healthy")
+
+    def test_long_real_calls_do_not_degrade(self):
+        app.HEALTH_DEGRADED_LATENCY_MS = 20
+        health = self.probe(healthy_probe)
+        for _ in range(10):
+            app.record_provider_call(self.provider, time.perf_counter() - 30)
+        self.assertEqual(health.state, "healthy")
+        self.assertGreater(health.snapshot()["request_latency_p95_ms"], 20)
+
+    def test_failed_real_calls_count_as_errors(self):
+        health = self.probe(healthy_probe)
+        for _ in range(3):
+            app.record_provider_call(self.provider, time.perf_counter(), "ConnectionError")
+        self.assertEqual(health.state, "down")
+
+if __name__ == "__main__":
+    unittest.main()